@@ -0,0 +1,1157 @@
+# Benchmarks and parity checks
+#
+# Each benchmark can be run from a terminal, e.g.:
+#   python benchmarks.py tokenizer
+#   python benchmarks.py parallel --jobs 1 2 4 8
+#   python benchmarks.py stylistic
+#   python benchmarks.py pos
+#   python benchmarks.py profile --jobs 1 2 4
+#   python benchmarks.py server --sessions 1000
+#   python benchmarks.py batching
+#   python benchmarks.py word-scores
+#   python benchmarks.py lean
+#   python benchmarks.py evaluation
+#   python benchmarks.py suite --scales 1 10 100 --output suite.json [--baseline old_suite.json]
+#   python benchmarks.py instrumentation
+#   python benchmarks.py memory
+#
+# tokenizer: checks that WordTokenizer returns exactly the tokens of
+#            nltk.tokenize.word_tokenize on dataset.csv and test.csv (original
+#            and lowercased text), then compares tokens per second of the
+#            original get_tokens and of WordTokenizer on whole reviews and on
+#            single sentences (short, chatbot-like messages).
+# parallel:  times vectorize_train and string2vec_batch on dataset.csv with
+#            1, 2, 4 and 8 worker processes, and checks that every parallel
+#            result is identical to the serial one.  Scaling is bounded by the
+#            number of CPUs of the machine (os.cpu_count() is printed).
+# stylistic: checks that StylisticAnalyzer.analyze returns the values of the
+#            Part 2 functions (count_words, words_per_sentence, get_pos_tags +
+#            get_pos_categories, count_negations) on every document, then
+#            compares the latency of both on inputs of 1, 10 and 50 reviews.
+#            The POS category counts are also checked and timed on their own,
+#            per document and as a whole-corpus matrix.
+# pos:       checks that PosTagger tags like nltk.pos_tag, then measures the
+#            per-call latency on single sentences of nltk.pos_tag, of a new
+#            PerceptronTagger per call (what nltk.pos_tag does on older NLTK),
+#            and of PosTagger without and with its LRU cache.
+# profile:   checks that every row of profile_corpus holds the features of the
+#            Part 2 functions and that summarize_profile returns the correlates
+#            of summarize_analysis, then measures documents per second of a
+#            per-document analyze() loop and of profile_corpus with 1, 2 and 4
+#            worker processes.
+# server:    runs scripted conversations against ChatbotEngine over TCP, checks
+#            that every transcript is the output of the blocking run_chatbot
+#            for the same answers, and measures the session durations, the
+#            sessions per second and the worst event loop lag with that many
+#            concurrent users.
+# batching:  sends sentiment requests from 1 to 256 concurrent clients through
+#            an InferenceScheduler with several max_batch/max_wait_ms settings
+#            (max_batch=1 is one predict call per message), checks every label
+#            against predict_sentiment, and reports the p50/p99 latency per
+#            request, the requests per second and the mean batch size.
+# word-scores: checks that the WordScoreModel of the chatbot's linear model
+#            labels reviews, sentences and random token lists like
+#            predict_sentiment, then compares the per-message latency of both
+#            and the memory of the score table with that of the embeddings.
+# lean:      exports the chatbot's LinearSVC and a LogisticRegression and an
+#            MLPClassifier trained on dataset.csv with float32 and float64
+#            weights, and counts the labels of LeanModel that differ from
+#            predict_sentiment_batch; then measures, in fresh processes, the
+#            import time, the loading time and the first prediction of
+#            project_p3 and of lean_inference.
+# evaluation: checks that evaluate_predictions returns the values of
+#            precision_score, recall_score, f1_score and accuracy_score on
+#            random and degenerate predictions, then compares the time of the
+#            four scikit-learn calls with the single confusion matrix count.
+# suite:     times the hot paths of the project on dataset.csv and on synthetic
+#            corpora 10 and 100 times its size (documents made of random
+#            sentences of the reviews with the same label): get_tokens,
+#            string2vec, string2vec_batch, vectorize_train, every
+#            train_model_tfidf/train_model_w2v, predict on one document and on
+#            the whole corpus, the Part 2 stylistic functions, and one full
+#            run_chatbot conversation.  The results are written to a JSON file
+#            with the versions of the code and the libraries; --baseline
+#            prints the speed of every case relative to an earlier file.
+# instrumentation: measures the cost of a disabled stage() and @timed call,
+#            replays synthetic conversations through DialogueBot with the
+#            instrumentation disabled and enabled, checks the transcripts and
+#            the state and io/wait counts, prints the recorded stages, and
+#            compares the histogram percentiles with the exact ones.
+# memory:    checks the MemoryProfiler on known numpy allocations (retained,
+#            transient and in a nested stage), then profiles loading the
+#            embeddings as the unpickled w2v.pkl dictionary and as the
+#            memory-mapped store, and the Word2Vec features of dataset.csv
+#            computed from each.
+# =========================================================================================================
+
+import argparse
+import asyncio
+import builtins
+import contextlib
+import functools
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import nltk
+import numpy as np
+from nltk.tag import PerceptronTagger
+
+from project_p1 import (EMBEDDING_FILE, EMBEDDING_STORE, get_tokens, instantiate_models, load_as_list, string2vec,
+                        string2vec_batch, train_model_tfidf, train_model_w2v, vectorize_train)
+from project_p2 import (count_negations, count_words, get_pos_categories, get_pos_tags, summarize_analysis,
+                        words_per_sentence)
+from embedding_store import open_embeddings
+from pos_tagger import POS_TAGGER, PosTagger
+from stylistic import StylisticAnalyzer, count_pos_categories, pos_category_matrix
+from stylistic_profile import PROFILE_COLUMNS, profile_corpus, summarize_profile
+from tokenizer import WordTokenizer
+from chatbot_server import ChatbotEngine, _predict_batch, start_server
+from inference_scheduler import InferenceScheduler
+from evaluation import evaluate_predictions
+from lean_inference import export_lean_model, load_lean_model
+from word_scores import TIE_MARGIN, build_word_scores, load_word_scores, save_word_scores
+import instrumentation
+from memory_profile import MemoryProfiler, format_table
+
+
+DATA_FILES = ["dataset.csv", "test.csv"]
+
+
+# Function: load_documents(fnames=DATA_FILES)
+# fnames: A list of CSV files in the load_as_list format
+# Returns: All documents of those files, in order
+def load_documents(fnames=DATA_FILES):
+    documents = []
+    for fname in fnames:
+        documents.extend(load_as_list(fname)[0])
+    return documents
+
+
+# Function: reference_get_tokens(inp_str)
+# inp_str: input string
+# Returns: token list, as computed by get_tokens before the WordTokenizer engine
+def reference_get_tokens(inp_str):
+    try:
+        nltk.data.find('tokenizers/punkt')
+    except LookupError:
+        pass
+    return nltk.tokenize.word_tokenize(inp_str)
+
+
+# Function: check_tokenizer_parity(documents, tokenizer=None)
+# documents: A list of strings
+# tokenizer: OPTIONAL; The WordTokenizer to check (a new one by default)
+# Returns: A list of (document, expected tokens, actual tokens) for every mismatch
+#
+# Lowercased documents are checked too, since TfidfVectorizer lowercases the
+# documents before handing them to the tokenizer.
+def check_tokenizer_parity(documents, tokenizer=None):
+    tokenizer = tokenizer if tokenizer is not None else WordTokenizer()
+    mismatches = []
+    for document in documents:
+        for text in (document, document.lower()):
+            expected = nltk.tokenize.word_tokenize(text)
+            actual = tokenizer.tokenize(text)
+            if actual != expected:
+                mismatches.append((text, expected, actual))
+    return mismatches
+
+
+# Function: time_call(function, repeat)
+# function: A function of no arguments
+# repeat: Number of timed runs
+# Returns: The best wall-clock time of the runs, in seconds, and the last result
+def time_call(function, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+# Function: bench_tokenizer(documents, repeat=3)
+# documents: A list of strings
+# repeat: Number of timed runs, the best one is reported
+# Returns: A dictionary of tokens per second for the original get_tokens and WordTokenizer
+def bench_tokenizer(documents, repeat=3):
+    tokenizer = WordTokenizer()
+    tokenizer.tokenize("Warm up.")
+
+    reference_time, reference_tokens = time_call(lambda: [reference_get_tokens(d) for d in documents], repeat)
+    engine_time, engine_tokens = time_call(lambda: tokenizer.tokenize_many(documents), repeat)
+
+    n_tokens = sum(len(tokens) for tokens in engine_tokens)
+    return {
+        "documents": len(documents),
+        "tokens": n_tokens,
+        "get_tokens_tokens_per_sec": n_tokens / reference_time,
+        "tokenizer_tokens_per_sec": n_tokens / engine_time,
+        "speedup": reference_time / engine_time,
+    }
+
+
+def run_tokenizer(args):
+    documents = load_documents()
+
+    mismatches = check_tokenizer_parity(documents)
+    print("Parity with word_tokenize: {0} mismatches over {1} texts".format(len(mismatches), 2 * len(documents)))
+    for text, expected, actual in mismatches[:10]:
+        print("  {0!r}\n    expected {1}\n    actual   {2}".format(text[:80], expected, actual))
+
+    # Whole reviews, and their sentences as stand-ins for short chatbot messages
+    messages = [sentence for document in documents for sentence in nltk.tokenize.sent_tokenize(document)]
+    for name, texts in (("reviews", documents), ("messages", messages)):
+        results = bench_tokenizer(texts, args.repeat)
+        print("{0}: {1} texts, {2} tokens".format(name, results["documents"], results["tokens"]))
+        print("  get_tokens:    {0:12.0f} tokens/sec".format(results["get_tokens_tokens_per_sec"]))
+        print("  WordTokenizer: {0:12.0f} tokens/sec ({1:.1f}x)".format(results["tokenizer_tokens_per_sec"], results["speedup"]))
+    return 1 if mismatches else 0
+
+
+# Function: same_tfidf(expected, actual)
+# expected, actual: The (vectorizer, document-term matrix) pairs returned by vectorize_train
+# Returns: True if both vectorizers have the same vocabulary and idf weights, and both matrices the same values
+def same_tfidf(expected, actual):
+    (expected_vectorizer, expected_matrix), (actual_vectorizer, actual_matrix) = expected, actual
+    return (expected_vectorizer.vocabulary_ == actual_vectorizer.vocabulary_
+            and np.array_equal(expected_vectorizer.idf_, actual_vectorizer.idf_)
+            and expected_matrix.shape == actual_matrix.shape
+            and (expected_matrix != actual_matrix).nnz == 0)
+
+
+# Function: bench_parallel(documents, word2vec, jobs, repeat=3)
+# documents: A list of strings
+# word2vec: The pretrained Word2Vec model
+# jobs: A list of worker counts; the serial path is always measured first
+# repeat: Number of timed runs, the best one is reported
+# Returns: A list of dictionaries with the timings and parity of every worker count
+def bench_parallel(documents, word2vec, jobs, repeat=3):
+    tfidf_time, tfidf_serial = time_call(lambda: vectorize_train(documents), repeat)
+    w2v_time, w2v_serial = time_call(lambda: string2vec_batch(word2vec, documents), repeat)
+
+    results = []
+    for n_jobs in jobs:
+        tfidf_parallel_time, tfidf_parallel = time_call(lambda: vectorize_train(documents, n_jobs), repeat)
+        w2v_parallel_time, w2v_parallel = time_call(lambda: string2vec_batch(word2vec, documents, n_jobs), repeat)
+        results.append({
+            "n_jobs": n_jobs,
+            "tfidf_sec": tfidf_parallel_time,
+            "tfidf_speedup": tfidf_time / tfidf_parallel_time,
+            "tfidf_identical": same_tfidf(tfidf_serial, tfidf_parallel),
+            "w2v_sec": w2v_parallel_time,
+            "w2v_speedup": w2v_time / w2v_parallel_time,
+            "w2v_identical": np.array_equal(w2v_serial, w2v_parallel),
+        })
+    return results
+
+
+def run_parallel(args):
+    documents = load_as_list("dataset.csv")[0]
+    word2vec = open_embeddings(EMBEDDING_FILE, EMBEDDING_STORE)
+
+    print("{0} documents, {1} CPUs".format(len(documents), os.cpu_count()))
+    print("{0:>6} {1:>10} {2:>8} {3:>10} {4:>8}  identical".format("n_jobs", "tfidf sec", "speedup", "w2v sec", "speedup"))
+    results = bench_parallel(documents, word2vec, args.jobs, args.repeat)
+    for result in results:
+        print("{n_jobs:>6} {tfidf_sec:>10.3f} {tfidf_speedup:>7.2f}x {w2v_sec:>10.3f} {w2v_speedup:>7.2f}x  {0}".format(
+            "yes" if result["tfidf_identical"] and result["w2v_identical"] else "NO", **result))
+    return 0 if all(result["tfidf_identical"] and result["w2v_identical"] for result in results) else 1
+
+
+# Function: reference_pos_categories(tagged_input)
+# tagged_input: A list of (token, POS) tuples
+# Returns: The six POS category counts, as computed by get_pos_categories before the categories table
+def reference_pos_categories(tagged_input):
+    def count(tags):
+        return sum(1 for _, pos in tagged_input if pos in tags)
+    return (count(['PRP', 'PRP$', 'WP', 'WP$']), count(['PRP']), count(['DT']), count(['VBD', 'VBN']),
+            count(['MD']), count(['IN']))
+
+
+# Function: reference_stylistic(text)
+# text: A string of arbitrary length
+# Returns: The nine summarize_analysis features, computed by the Part 2 functions one after another
+#          (with get_pos_tags and get_pos_categories as they were before the PosTagger and categories table)
+def reference_stylistic(text):
+    pos_tags = nltk.pos_tag(nltk.word_tokenize(text))
+    return (count_words(text), words_per_sentence(text), *reference_pos_categories(pos_tags), count_negations(text))
+
+
+# Function: check_stylistic_parity(documents, analyzer=None)
+# documents: A list of strings
+# analyzer: OPTIONAL; The StylisticAnalyzer to check (a new one by default)
+# Returns: A list of (document, expected features, actual features) for every mismatch
+def check_stylistic_parity(documents, analyzer=None):
+    analyzer = analyzer if analyzer is not None else StylisticAnalyzer()
+    mismatches = []
+    for document in documents:
+        expected = reference_stylistic(document)
+        actual = tuple(analyzer.analyze(document))
+        if actual != expected:
+            mismatches.append((document, expected, actual))
+    return mismatches
+
+
+# Function: bench_stylistic(texts, repeat=3)
+# texts: A list of strings
+# repeat: Number of timed runs, the best one is reported
+# Returns: A dictionary with the mean latency, in milliseconds, of the Part 2 functions and of StylisticAnalyzer
+def bench_stylistic(texts, repeat=3):
+    # Without the tagger cache, which would answer every timed run after the first one
+    analyzer = StylisticAnalyzer(tagger=PosTagger(cache_size=0))
+    analyzer.analyze("Warm up.")
+    reference_stylistic("Warm up.")
+
+    reference_time, _ = time_call(lambda: [reference_stylistic(text) for text in texts], repeat)
+    analyzer_time, _ = time_call(lambda: [analyzer.analyze(text) for text in texts], repeat)
+    return {
+        "texts": len(texts),
+        "reference_ms": 1000 * reference_time / len(texts),
+        "analyzer_ms": 1000 * analyzer_time / len(texts),
+        "speedup": reference_time / analyzer_time,
+    }
+
+
+def run_stylistic(args):
+    documents = load_documents()
+
+    mismatches = check_stylistic_parity(documents)
+    print("Parity with the Part 2 functions: {0} mismatches over {1} texts".format(len(mismatches), len(documents)))
+    for text, expected, actual in mismatches[:10]:
+        print("  {0!r}\n    expected {1}\n    actual   {2}".format(text[:80], expected, actual))
+
+    # The categories table, one document at a time and as a whole-corpus matrix
+    tagged_documents = [nltk.pos_tag(nltk.word_tokenize(document)) for document in documents]
+    reference_time, expected = time_call(lambda: [reference_pos_categories(tagged) for tagged in tagged_documents], args.repeat)
+    table_time, actual = time_call(lambda: [count_pos_categories(tagged) for tagged in tagged_documents], args.repeat)
+    matrix_time, matrix = time_call(lambda: pos_category_matrix(tagged_documents), args.repeat)
+    categories_match = actual == expected and matrix.tolist() == [list(counts) for counts in expected]
+    print("POS categories of {0} documents: {1}; nested scans {2:.1f} ms, table {3:.1f} ms, matrix {4:.1f} ms".format(
+        len(documents), "identical" if categories_match else "MISMATCH",
+        1000 * reference_time, 1000 * table_time, 1000 * matrix_time))
+
+    # Long inputs made of consecutive reviews
+    for n_reviews in (1, 10, 50):
+        texts = [" ".join(documents[i:i + n_reviews]) for i in range(0, min(len(documents), 20 * n_reviews), n_reviews)]
+        results = bench_stylistic(texts, args.repeat)
+        print("{0:>2} review(s) per input: Part 2 functions {1:8.2f} ms, StylisticAnalyzer {2:8.2f} ms ({3:.1f}x)".format(
+            n_reviews, results["reference_ms"], results["analyzer_ms"], results["speedup"]))
+    return 1 if mismatches or not categories_match else 0
+
+
+# Function: bench_pos(token_lists, repeat=3)
+# token_lists: A list of token lists
+# repeat: Number of timed runs, the best one is reported
+# Returns: A dictionary with the mean latency per call, in milliseconds, of every way of tagging
+def bench_pos(token_lists, repeat=3):
+    uncached, cached = PosTagger(cache_size=0).load(), PosTagger(cache_size=len(token_lists)).load()
+    cached.tag_many(token_lists)  # Fills the cache: the timed runs measure repeated inputs
+
+    timings = {
+        "nltk.pos_tag": lambda: [nltk.pos_tag(tokens) for tokens in token_lists],
+        "PosTagger": lambda: uncached.tag_many(token_lists),
+        "PosTagger (cached)": lambda: cached.tag_many(token_lists),
+    }
+    results = {name: 1000 * time_call(function, repeat)[0] / len(token_lists) for name, function in timings.items()}
+    # A new tagger per call loads its weights every time; a few calls are enough to measure it
+    few = token_lists[:5]
+    results["new PerceptronTagger per call"] = 1000 * time_call(lambda: [PerceptronTagger().tag(tokens) for tokens in few], 1)[0] / len(few)
+    return results
+
+
+def run_pos(args):
+    tokenizer = WordTokenizer()
+    sentences = [tokenizer.tokenize(sentence) for document in load_documents()
+                 for sentence in tokenizer.sentences(document)]
+
+    tagger = PosTagger(cache_size=0)
+    mismatches = sum(1 for tokens in sentences if tagger.tag(tokens) != nltk.pos_tag(tokens))
+    print("Parity with nltk.pos_tag: {0} mismatches over {1} sentences".format(mismatches, len(sentences)))
+
+    for name, milliseconds in bench_pos(sentences[:args.sentences], args.repeat).items():
+        print("  {0:<30} {1:10.3f} ms/call".format(name, milliseconds))
+    return 1 if mismatches else 0
+
+
+# Function: check_profile_parity(documents, table)
+# documents: A list of strings
+# table: The profile table of documents
+# Returns: The number of rows whose features or correlates differ from the Part 2 functions
+def check_profile_parity(documents, table):
+    summaries = summarize_profile(table)
+    mismatches = 0
+    for row, document in enumerate(documents):
+        expected = reference_stylistic(document)
+        actual = tuple(table[name].iat[row] for name in PROFILE_COLUMNS)
+        if actual != expected or list(summaries[row]) != summarize_analysis(*expected):
+            mismatches += 1
+    return mismatches
+
+
+# Function: bench_profile(documents, jobs, batch_size, repeat=3)
+# documents: A list of strings
+# jobs: A list of worker counts
+# batch_size: Number of documents per task
+# repeat: Number of timed runs, the best one is reported
+# Returns: A dictionary from every way of profiling to its documents per second, and the last profile table
+def bench_profile(documents, jobs, batch_size, repeat=3):
+    # Without the tagger cache, like the profile pipeline
+    analyzer = StylisticAnalyzer(tagger=PosTagger(cache_size=0))
+    analyzer.analyze("Warm up.")
+
+    results = {"analyze() loop": len(documents) / time_call(lambda: [analyzer.analyze(d) for d in documents], repeat)[0]}
+    table = None
+    for n_jobs in jobs:
+        elapsed, table = time_call(lambda: profile_corpus(documents, n_jobs, batch_size), repeat)
+        results["profile_corpus, {0} job(s)".format(n_jobs)] = len(documents) / elapsed
+    return results, table
+
+
+def run_profile(args):
+    documents = load_documents()
+
+    results, table = bench_profile(documents, args.jobs, args.batch_size, args.repeat)
+    mismatches = check_profile_parity(documents, table)
+    print("Parity with the Part 2 functions: {0} mismatches over {1} documents".format(mismatches, len(documents)))
+
+    print("{0} documents, {1} CPUs".format(len(documents), os.cpu_count()))
+    for name, documents_per_sec in results.items():
+        print("  {0:<28} {1:10.0f} documents/sec".format(name, documents_per_sec))
+
+    rows = [tuple(table[name].iat[row] for name in PROFILE_COLUMNS) for row in range(len(table))]
+    loop_time, _ = time_call(lambda: [summarize_analysis(*features) for features in rows], args.repeat)
+    vectorized_time, _ = time_call(lambda: summarize_profile(table), args.repeat)
+    print("  summarize_analysis loop {0:10.1f} ms, summarize_profile {1:.1f} ms".format(1000 * loop_time, 1000 * vectorized_time))
+    return 1 if mismatches else 0
+
+# Answers of the scripted conversations of the server benchmark
+CHAT_SCRIPTS = [
+    ["My name is Ann Lee", "I love this wonderful day", "Nothing. I am never sad; I went there.", "x", "(b)",
+     "It was awful and bad", "(c)", "I will go. We shall see!", " (a) "],
+    ["Bob", "The food was cold and the waiter was rude.", "No.", "(a)"],
+    ["I am Carla Diaz", "Great movie, I would watch it again!", "We had been there before. It was not great, was it?", "(c)",
+     "Prepositions of place: in, on, under and over.", "(a)"],
+]
+
+
+# Function: run_chatbot_transcript(bundle, answers)
+# bundle: The ModelBundle of the chatbot
+# answers: The user's answers, in order
+# Returns: Everything printed by the blocking run_chatbot of Part 3, prompts included, for those answers
+def run_chatbot_transcript(bundle, answers):
+    import project_p3
+    answers = iter(answers)
+    output = io.StringIO()
+
+    def scripted_input(prompt=""):
+        output.write(prompt)
+        answer = next(answers, None)
+        if answer is None:
+            raise EOFError("the script has no answer left")
+        return answer
+
+    original_input, builtins.input = builtins.input, scripted_input
+    try:
+        with contextlib.redirect_stdout(output):
+            project_p3.run_chatbot(bundle.model, bundle.vectorizer, bundle.word2vec)
+    finally:
+        builtins.input = original_input
+    return output.getvalue()
+
+
+# One scripted user: every answer is sent at once, the transcript is read until the server closes the connection
+async def _chat_client(port, answers):
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write("".join(answer + "\n" for answer in answers).encode("utf-8"))
+    await writer.drain()
+    transcript = (await reader.read()).decode("utf-8")
+    writer.close()
+    await writer.wait_closed()
+    return transcript, time.perf_counter() - start
+
+
+# Largest delay of a 10 ms timer while the sessions run: how long the event loop was blocked
+async def _loop_lag(done):
+    loop = asyncio.get_running_loop()
+    worst = 0.0
+    while not done.is_set():
+        expected = loop.time() + 0.01
+        await asyncio.sleep(0.01)
+        worst = max(worst, loop.time() - expected)
+    return worst
+
+
+# Function: bench_server(bundle, n_sessions, n_jobs=None)
+# bundle: The ModelBundle of the chatbot
+# n_sessions: Number of concurrent scripted conversations
+# n_jobs: OPTIONAL; Inference processes of the engine (a thread pool when None)
+# Returns: A dictionary with the number of wrong transcripts and the timings of the sessions
+def bench_server(bundle, n_sessions, n_jobs=None):
+    expected = [run_chatbot_transcript(bundle, answers) for answers in CHAT_SCRIPTS]
+
+    async def run():
+        async with ChatbotEngine(bundle.model, bundle.vectorizer, bundle.word2vec, n_jobs=n_jobs) as engine:
+            server = await start_server(engine, port=0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                done = asyncio.Event()
+                lag = asyncio.ensure_future(_loop_lag(done))
+                start = time.perf_counter()
+                results = await asyncio.gather(*[_chat_client(port, CHAT_SCRIPTS[i % len(CHAT_SCRIPTS)])
+                                                 for i in range(n_sessions)])
+                elapsed = time.perf_counter() - start
+                done.set()
+                return results, elapsed, await lag
+
+    results, elapsed, lag = asyncio.run(run())
+    durations = np.array([duration for _, duration in results])
+    return {
+        "wrong_transcripts": sum(1 for i, (transcript, _) in enumerate(results) if transcript != expected[i % len(expected)]),
+        "sessions_per_sec": n_sessions / elapsed,
+        "p50_ms": 1000 * np.percentile(durations, 50),
+        "p99_ms": 1000 * np.percentile(durations, 99),
+        "max_loop_lag_ms": 1000 * lag,
+    }
+
+
+def run_server(args):
+    from project_p3 import load_chatbot_bundle
+    bundle = load_chatbot_bundle()
+
+    wrong = 0
+    for n_sessions in args.sessions:
+        results = bench_server(bundle, n_sessions, args.jobs)
+        wrong += results["wrong_transcripts"]
+        print("{0:>6} sessions: {1} wrong transcripts, {2:8.1f} sessions/sec, session p50 {3:8.1f} ms, "
+              "p99 {4:8.1f} ms, max loop lag {5:6.1f} ms".format(n_sessions, results["wrong_transcripts"],
+                                                                 results["sessions_per_sec"], results["p50_ms"],
+                                                                 results["p99_ms"], results["max_loop_lag_ms"]))
+    return 1 if wrong else 0
+
+
+# Function: bench_batching(bundle, messages, concurrency, max_batch, max_wait_ms)
+# bundle: The ModelBundle of the chatbot
+# messages: The messages sent, split evenly between the clients
+# concurrency: Number of clients; each one sends its next message as soon as it has its answer
+# max_batch, max_wait_ms: Settings of the InferenceScheduler
+# Returns: A dictionary with the labels, the latency percentiles, the requests per second and the mean batch size
+def bench_batching(bundle, messages, concurrency, max_batch, max_wait_ms):
+    predict_batch = functools.partial(_predict_batch, bundle.model, bundle.vectorizer, bundle.word2vec)
+    labels = [None] * len(messages)
+    latencies = []
+
+    async def client(scheduler, positions):
+        for position in positions:
+            start = time.perf_counter()
+            labels[position] = await scheduler.submit(messages[position])
+            latencies.append(time.perf_counter() - start)
+
+    async def run():
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            scheduler = InferenceScheduler(predict_batch, max_batch, max_wait_ms, executor)
+            start = time.perf_counter()
+            await asyncio.gather(*[client(scheduler, range(i, len(messages), concurrency)) for i in range(concurrency)])
+            return time.perf_counter() - start, scheduler.mean_batch_size()
+
+    elapsed, mean_batch_size = asyncio.run(run())
+    return {
+        "labels": labels,
+        "p50_ms": 1000 * np.percentile(latencies, 50),
+        "p99_ms": 1000 * np.percentile(latencies, 99),
+        "requests_per_sec": len(messages) / elapsed,
+        "mean_batch_size": mean_batch_size,
+    }
+
+
+def run_batching(args):
+    from project_p3 import load_chatbot_bundle, predict_sentiment
+    bundle = load_chatbot_bundle()
+    tokenizer = WordTokenizer()
+    messages = [sentence for document in load_documents() for sentence in tokenizer.sentences(document)][:args.messages]
+    expected = [predict_sentiment(bundle.model, message, bundle.vectorizer, bundle.word2vec) for message in messages]
+
+    wrong = 0
+    print("{0} messages".format(len(messages)))
+    print("{0:>9} {1:>11} {2:>7} {3:>10} {4:>10} {5:>10} {6:>10}".format(
+        "max_batch", "max_wait_ms", "clients", "p50 ms", "p99 ms", "req/sec", "batch"))
+    for max_batch, max_wait_ms in args.settings:
+        for concurrency in args.clients:
+            results = bench_batching(bundle, messages, concurrency, int(max_batch), max_wait_ms)
+            wrong += sum(1 for label, reference in zip(results["labels"], expected) if not np.array_equal(label, reference))
+            print("{0:>9} {1:>11} {2:>7} {p50_ms:>10.2f} {p99_ms:>10.2f} {requests_per_sec:>10.0f} {mean_batch_size:>10.1f}".format(
+                int(max_batch), max_wait_ms, concurrency, **results))
+    print("Labels different from predict_sentiment: {0}".format(wrong))
+    return 1 if wrong else 0
+
+
+# Function: word_score_messages(documents, n_random=2000, seed=0)
+# documents: A list of strings
+# n_random: Number of random token lists added
+# seed: Seed of the random token lists
+# Returns: The documents, their sentences, an empty message, and random messages made of their tokens
+def word_score_messages(documents, n_random=2000, seed=0):
+    tokenizer = WordTokenizer()
+    sentences = [sentence for document in documents for sentence in tokenizer.sentences(document)]
+    vocabulary = sorted({token for document in documents for token in document.split()})
+    rng = np.random.default_rng(seed)
+    random_messages = [" ".join(rng.choice(vocabulary, size=rng.integers(1, 40))) for _ in range(n_random)]
+    return documents + sentences + [""] + random_messages
+
+
+def run_word_scores(args):
+    import tempfile
+    import tracemalloc
+    from project_p3 import get_tokens, load_chatbot_bundle, predict_sentiment, string2vec
+    bundle = load_chatbot_bundle()
+    messages = word_score_messages(load_documents(), args.random)
+
+    word_scores = build_word_scores(bundle.model, bundle.word2vec)
+    expected = np.concatenate([predict_sentiment(bundle.model, message, word2vec=bundle.word2vec) for message in messages])
+    actual = np.concatenate([predict_sentiment(word_scores, message) for message in messages])
+    decisions = word_scores.decision_function([get_tokens(message) for message in messages])
+    reference = bundle.model.decision_function(
+        np.vstack([string2vec(bundle.word2vec, message) for message in messages]))
+    wrong = int(np.sum(actual != expected))
+    print("{0} messages: {1} labels different from predict_sentiment, {2} decision values within {3:g} of zero, "
+          "largest decision difference {4:.2e}".format(len(messages), wrong, int(np.sum(np.abs(decisions) <= TIE_MARGIN)),
+                                                       TIE_MARGIN, np.max(np.abs(decisions - reference))))
+
+    short = messages[len(load_documents()):][:args.messages]
+    for name, model in (("embeddings", bundle.model), ("word scores", word_scores)):
+        seconds, _ = time_call(lambda: [predict_sentiment(model, message, word2vec=bundle.word2vec) for message in short],
+                            args.repeat)
+        print("{0:<12} {1:8.1f} us/message".format(name, 1e6 * seconds / len(short)))
+
+    with tempfile.TemporaryDirectory() as scores_dir:
+        save_word_scores(scores_dir, bundle.model, bundle.word2vec)
+        tracemalloc.start()
+        loaded = load_word_scores(scores_dir)
+        table_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        on_disk = sum(os.path.getsize(os.path.join(scores_dir, name)) for name in os.listdir(scores_dir))
+    print("Embedding matrix: {0:.1f} MB; word score table: {1:.1f} MB loaded ({2} words), {3:.1f} MB on disk".format(
+        bundle.word2vec.vectors.nbytes / 1e6, table_bytes / 1e6, len(loaded), on_disk / 1e6))
+    return 1 if wrong else 0
+
+
+# Cold start of the chatbot's sentiment prediction: imports, model loading and the first message
+COLD_START_SCRIPTS = {
+    "project_p3": (
+        "import project_p3",
+        "bundle = project_p3.load_chatbot_bundle()",
+        "project_p3.predict_sentiment(bundle.model, MESSAGE, bundle.vectorizer, bundle.word2vec)",
+    ),
+    "lean_inference": (
+        "import lean_inference",
+        "model = lean_inference.load_lean_model(LEAN_MODEL)",
+        "model.predict_messages([MESSAGE])",
+    ),
+}
+
+# Run in a fresh interpreter: prints the seconds of every step of a COLD_START_SCRIPTS entry and the heavy modules loaded
+COLD_START_TEMPLATE = """
+import json, sys, time
+MESSAGE, LEAN_MODEL = {message!r}, {lean_model!r}
+times = []
+for step in {steps!r}:
+    start = time.perf_counter()
+    exec(step)
+    times.append(time.perf_counter() - start)
+print(json.dumps([times, sorted(name for name in ("sklearn", "pandas", "nltk", "scipy") if name in sys.modules)]))
+"""
+
+
+# Function: cold_start(name, lean_model, message="I love this wonderful day")
+# name: A key of COLD_START_SCRIPTS
+# lean_model: The .npz file of the lean model
+# message: The first message predicted
+# Returns: The import, load and first prediction times in seconds, and the heavy modules imported
+def cold_start(name, lean_model, message="I love this wonderful day"):
+    import json
+    import subprocess
+    script = COLD_START_TEMPLATE.format(message=message, lean_model=lean_model, steps=COLD_START_SCRIPTS[name])
+    output = subprocess.run([sys.executable, "-c", script], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run_lean(args):
+    import tempfile
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.neural_network import MLPClassifier
+    from project_p3 import load_chatbot_bundle, predict_sentiment_batch, train_model_w2v
+    bundle = load_chatbot_bundle()
+    documents, labels = load_as_list("dataset.csv")
+    models = {
+        "LinearSVC": bundle.model,
+        "LogisticRegression": train_model_w2v(LogisticRegression(random_state=100), bundle.word2vec, documents, labels),
+        "MLPClassifier": train_model_w2v(MLPClassifier(random_state=100), bundle.word2vec, documents, labels),
+    }
+    messages = word_score_messages(load_documents(), args.random)
+
+    wrong = 0
+    with tempfile.TemporaryDirectory() as export_dir:
+        print("{0} messages".format(len(messages)))
+        for name, model in models.items():
+            expected = predict_sentiment_batch(model, messages, word2vec=bundle.word2vec)
+            for dtype in (np.float32, np.float64):
+                fname = export_lean_model(os.path.join(export_dir, "lean.npz"), model, bundle.word2vec, dtype)
+                different = int(np.sum(load_lean_model(fname).predict_messages(messages) != expected))
+                wrong += different if dtype == np.float64 else 0
+                print("{0:<20} {1:<8} {2:>5} labels different from predict_sentiment_batch".format(
+                    name, np.dtype(dtype).name, different))
+
+        lean_model = export_lean_model(os.path.join(export_dir, "lean.npz"), bundle.model, bundle.word2vec)
+        print("{0:<16} {1:>10} {2:>10} {3:>12} {4:>10}  {5}".format("cold start", "import ms", "load ms", "predict ms",
+                                                                   "total ms", "modules"))
+        for name in COLD_START_SCRIPTS:
+            runs = [cold_start(name, lean_model) for _ in range(args.repeat)]
+            times = np.median([run_times for run_times, _ in runs], axis=0)
+            print("{0:<16} {1:>10.1f} {2:>10.1f} {3:>12.1f} {4:>10.1f}  {5}".format(
+                name, *(1000 * times), 1000 * times.sum(), ", ".join(runs[0][1]) or "-"))
+    return 1 if wrong else 0
+
+
+# Function: reference_metrics(labels, predictions)
+# labels, predictions: Lists of integers (all 0 or 1)
+# Returns: Precision, recall, F1, and accuracy values, as test_model_tfidf used to compute them
+def reference_metrics(labels, predictions):
+    from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score
+    return (precision_score(labels, predictions, zero_division=0.0), recall_score(labels, predictions, zero_division=0.0),
+            f1_score(labels, predictions, zero_division=0.0), accuracy_score(labels, predictions))
+
+
+def run_evaluation(args):
+    rng = np.random.default_rng(0)
+    cases = [(rng.integers(0, 2, size=n), rng.integers(0, 2, size=n)) for n in rng.integers(1, 500, size=args.cases)]
+    for n in (1, 10):
+        for labels in (np.zeros(n, dtype=np.int64), np.ones(n, dtype=np.int64)):
+            cases.extend([(labels, np.zeros(n, dtype=np.int64)), (labels, np.ones(n, dtype=np.int64))])
+    wrong = sum(1 for labels, predictions in cases
+                if evaluate_predictions(labels, predictions) != reference_metrics(labels.tolist(), predictions))
+    print("{0} label sets: {1} different from the scikit-learn metrics".format(len(cases), wrong))
+
+    for size in args.sizes:
+        labels, predictions = rng.integers(0, 2, size=size).tolist(), rng.integers(0, 2, size=size)
+        reference_seconds, _ = time_call(lambda: reference_metrics(labels, predictions), args.repeat)
+        single_seconds, _ = time_call(lambda: evaluate_predictions(labels, predictions), args.repeat)
+        print("{0:>9} labels: 4 metric calls {1:9.3f} ms, single pass {2:9.3f} ms ({3:.0f}x)".format(
+            size, 1000 * reference_seconds, 1000 * single_seconds, reference_seconds / single_seconds))
+    return 1 if wrong else 0
+
+
+# Function: bench_instrumentation_calls(calls)
+# calls: Number of timed calls
+# Returns: The nanoseconds per call of a plain function, of the same function run in a disabled
+#          stage(), and of the function decorated with a disabled @timed
+def bench_instrumentation_calls(calls):
+    def function():
+        return None
+
+    def in_stage():
+        with instrumentation.stage("benchmark"):
+            return None
+
+    decorated = instrumentation.timed("benchmark")(function)
+    results = []
+    for call in (function, in_stage, decorated):
+        seconds, _ = time_call(lambda: [call() for _ in range(calls)], 3)
+        results.append(1e9 * seconds / calls)
+    return results
+
+
+# Function: bench_instrumentation_replay(bundle, conversations, repeat)
+# bundle: The ModelBundle of the chatbot
+# conversations: Recorded conversations, as returned by dialogue.record_conversations
+# repeat: Number of timed replays
+# Returns: The best replay report (see dialogue.replay)
+def bench_instrumentation_replay(bundle, conversations, repeat):
+    from dialogue import DialogueBot, replay
+    best = None
+    for _ in range(repeat):
+        report = asyncio.run(replay(DialogueBot(bundle.model, bundle.vectorizer, bundle.word2vec), conversations))
+        if best is None or report["seconds"] < best["seconds"]:
+            best = report
+    return best
+
+
+def run_instrumentation(args):
+    from dialogue import DialogueBot, record_conversations
+    from project_p3 import load_chatbot_bundle
+    if instrumentation.is_enabled():
+        print("Unset {0} and {1} to measure the disabled instrumentation".format(
+            instrumentation.METRICS_FILE_ENV, instrumentation.METRICS_PORT_ENV))
+        return 1
+
+    plain_ns, stage_ns, timed_ns = bench_instrumentation_calls(args.calls)
+    print("Disabled instrumentation: plain call {0:.0f} ns, in stage() {1:.0f} ns (+{2:.0f} ns), "
+          "@timed {3:.0f} ns (+{4:.0f} ns)".format(plain_ns, stage_ns, stage_ns - plain_ns, timed_ns, timed_ns - plain_ns))
+
+    bundle = load_chatbot_bundle()
+    documents = load_as_list("test.csv")[0]
+    conversations = record_conversations(DialogueBot(bundle.model, bundle.vectorizer, bundle.word2vec),
+                                         documents, args.conversations)
+    disabled = bench_instrumentation_replay(bundle, conversations, args.repeat)
+    instrumentation.enable()
+    try:
+        enabled = bench_instrumentation_replay(bundle, conversations, 1)
+        stages = instrumentation.snapshot()
+    finally:
+        instrumentation.disable()
+
+    wrong = disabled["wrong_transcripts"] + enabled["wrong_transcripts"]
+    print("{0} conversations, {1} user turns: {2:.0f} turns/sec disabled, {3:.0f} turns/sec enabled "
+          "({4:+.1f}%), {5} wrong transcripts".format(disabled["conversations"], disabled["turns"],
+                                                      disabled["turns_per_sec"], enabled["turns_per_sec"],
+                                                      100 * (disabled["seconds"] / enabled["seconds"] - 1), wrong))
+    # Every state ran once in the timed replay after the enabling, and every user turn waited once for an answer
+    wrong_counts = [state for state, stats in enabled["states"].items()
+                    if stages.get("state/" + state, {}).get("count") != stats["count"]]
+    if stages.get("io/wait", {}).get("count") != enabled["turns"]:
+        wrong_counts.append("io/wait")
+    print("States recorded a different number of times than they ran: {0}".format(wrong_counts or "none"))
+    for line in instrumentation.format_report(stages):
+        print("  " + line)
+    # The disabled stages of a turn cost one disabled stage() each
+    stages_per_turn = sum(stats["count"] for stats in stages.values()) / disabled["turns"]
+    print("{0:.1f} stages per user turn: about {1:.2f} us of the {2:.1f} us of a turn when disabled ({3:.3f}%)".format(
+        stages_per_turn, stages_per_turn * (stage_ns - plain_ns) / 1000, 1e6 / disabled["turns_per_sec"],
+        100 * stages_per_turn * (stage_ns - plain_ns) * 1e-9 * disabled["turns_per_sec"]))
+
+    rng = np.random.default_rng(0)
+    samples = rng.lognormal(np.log(1e-3), 1.5, size=args.calls)
+    histogram = instrumentation.Histogram()
+    for seconds in samples.tolist():
+        histogram.observe(seconds)
+    for q in (50, 99):
+        print("p{0} of {1} log-normal durations: {2:.4f} ms exact, {3:.4f} ms from the histogram".format(
+            q, len(samples), 1000 * np.percentile(samples, q), 1000 * histogram.percentile(q)))
+    return 1 if wrong or wrong_counts else 0
+
+
+# Function: check_memory_profiler(mb)
+# mb: Size of the known allocations, in megabytes
+# Returns: The StageMemory records of an outer stage retaining mb and allocating 2 * mb for a moment, and
+#          of an inner stage allocating 3 * mb for a moment, and the list of (description, expected, measured)
+#          values that differ by more than 5%
+def check_memory_profiler(mb):
+    n = int(mb * 1e6) // 8
+    profiler = MemoryProfiler()
+    try:
+        with profiler.stage("outer"):
+            retained = np.ones(n)
+            transient = np.ones(2 * n)
+            del transient
+            with profiler.stage("inner"):
+                transient = np.ones(3 * n)
+                del transient
+        del retained
+    finally:
+        profiler.close()
+
+    inner, outer = profiler.records
+    expected = [("inner peak", 3 * mb, inner.peak_mb), ("inner retained", 0.0, inner.retained_mb),
+                ("outer peak", 4 * mb, outer.peak_mb), ("outer retained", mb, outer.retained_mb)]
+    if outer.peak_rss_mb is not None:
+        # The outer stage held mb + 3 * mb at the end of the inner stage
+        expected.append(("outer peak RSS above its final RSS", 3 * mb, outer.peak_rss_mb - outer.rss_mb))
+    wrong = [(name, value, measured) for name, value, measured in expected if abs(measured - value) > 0.05 * mb]
+    return profiler.records, wrong
+
+
+def run_memory(args):
+    from project_p1 import load_w2v, w2v_features
+    records, wrong = check_memory_profiler(args.mb)
+    for line in format_table(records):
+        print(line)
+    for name, expected, measured in wrong:
+        print("{0}: expected {1:.1f} MB, measured {2:.1f} MB".format(name, expected, measured))
+    print("Known allocations: {0}".format("{0} wrong".format(len(wrong)) if wrong else "all within 5%"))
+
+    # Each loader in a fresh profiler, the store first so that the dictionary does not inflate its RSS
+    documents = load_as_list("dataset.csv")[0]
+    profiler = MemoryProfiler()
+    try:
+        for name, path in (("store", EMBEDDING_STORE), ("dict", EMBEDDING_FILE)):
+            with profiler.stage("load_w2v " + name):
+                word2vec = load_w2v(path)
+            with profiler.stage("w2v_features " + name):
+                w2v_features(word2vec, documents)
+            del word2vec
+    finally:
+        profiler.close()
+    for line in format_table(profiler.records):
+        print(line)
+    return 1 if wrong else 0
+
+
+# Sizes of the suite corpora, in multiples of dataset.csv
+SUITE_SCALES = [1, 10, 100]
+
+# Largest number of documents the models of the suite are trained on: training
+# the MLP on TF-IDF features takes about 25 seconds on dataset.csv alone
+SUITE_TRAIN_LIMIT = 10000
+
+# Number of documents of the per-document cases (string2vec, predict one, stylistic functions)
+SUITE_SAMPLE = 200
+
+# Names of the models returned by instantiate_models
+MODEL_NAMES = ["Naive Bayes", "Logistic Regression", "SVM", "Multilayer Perceptron"]
+
+# A case is not run again once its runs have taken this many seconds
+SUITE_CASE_BUDGET = 30.0
+
+# A case is reported slower or faster than the baseline when its speed changed by more than this fraction
+REGRESSION_THRESHOLD = 0.10
+
+
+# Function: synthetic_corpus(documents, labels, scale, seed=0)
+# documents, labels: The original corpus, e.g. dataset.csv
+# scale: Number of copies of the corpus size to return
+# seed: OPTIONAL; Seed of the random sentences
+# Returns: The documents and labels of the original corpus followed by (scale - 1) synthetic copies of it; every
+#          synthetic document has the number of sentences and the label of its original, drawn at random from
+#          the sentences of the documents with that label
+def synthetic_corpus(documents, labels, scale, seed=0):
+    tokenizer = WordTokenizer()
+    sentences = [tokenizer.sentences(document) for document in documents]
+    pools = {}
+    for document_sentences, label in zip(sentences, labels):
+        pools.setdefault(label, []).extend(document_sentences)
+
+    rng = np.random.default_rng(seed)
+    synthetic_documents, synthetic_labels = list(documents), list(labels)
+    for _ in range(scale - 1):
+        for document_sentences, label in zip(sentences, labels):
+            pool = pools[label]
+            picks = rng.integers(0, len(pool), size=max(len(document_sentences), 1))
+            synthetic_documents.append(" ".join(pool[i] for i in picks))
+            synthetic_labels.append(label)
+    return synthetic_documents, synthetic_labels
+
+
+# Runs one case of the suite up to repeat times, within SUITE_CASE_BUDGET seconds, and appends its best time
+# to results; returns the value of the last run
+def _suite_case(results, case, scale, function, n_items, unit, repeat):
+    runs, spent = 0, 0.0
+    while runs < repeat and (runs == 0 or spent < SUITE_CASE_BUDGET):
+        elapsed, value = time_call(function, 1)
+        seconds = elapsed if runs == 0 else min(seconds, elapsed)
+        runs, spent = runs + 1, spent + elapsed
+    results.append({"case": case, "scale": scale, "n_items": n_items, "unit": unit, "runs": runs,
+                    "seconds": seconds, "items_per_sec": n_items / seconds if seconds else None})
+    print("{0:<48} {1:>6} {2:>8} {3:<13} {4:10.4f} s {5:14.1f} {3}/sec".format(
+        case, "-" if scale is None else "{0}x".format(scale), n_items, unit, seconds, n_items / seconds if seconds else float("nan")))
+    return value
+
+
+# Function: bench_suite_scale(documents, labels, word2vec, scale, repeat=3, train_limit=SUITE_TRAIN_LIMIT, sample_size=SUITE_SAMPLE)
+# documents, labels: The corpus of this scale
+# word2vec: The pretrained Word2Vec model
+# scale: The scale of the corpus, recorded with every result
+# repeat: OPTIONAL; Timed runs of every case (within SUITE_CASE_BUDGET seconds) except training, which runs once
+# train_limit: OPTIONAL; Largest number of documents the models are trained on
+# sample_size: OPTIONAL; Number of documents of the per-document cases
+# Returns: The list of results, one dictionary per case
+def bench_suite_scale(documents, labels, word2vec, scale, repeat=3, train_limit=SUITE_TRAIN_LIMIT, sample_size=SUITE_SAMPLE):
+    from sklearn.base import clone
+    from sparse_models import predict_sparse
+    results = []
+    n_docs = len(documents)
+    sample = [documents[i] for i in np.linspace(0, n_docs - 1, num=min(sample_size, n_docs)).astype(np.int64)]
+
+    _suite_case(results, "get_tokens", scale, lambda: [get_tokens(document) for document in documents], n_docs, "documents", repeat)
+    _suite_case(results, "string2vec", scale, lambda: [string2vec(word2vec, document) for document in sample],
+                len(sample), "documents", repeat)
+    w2v_matrix = _suite_case(results, "string2vec_batch", scale, lambda: string2vec_batch(word2vec, documents),
+                             n_docs, "documents", repeat)
+    vectorizer, tfidf_matrix = _suite_case(results, "vectorize_train", scale, lambda: vectorize_train(documents),
+                                           n_docs, "documents", repeat)
+
+    n_train = min(n_docs, train_limit)
+    featurizers = {
+        "TFIDF": (lambda document: vectorizer.transform([document]), tfidf_matrix),
+        "w2v": (lambda document: string2vec(word2vec, document).reshape(1, -1), w2v_matrix),
+    }
+    for name, model in zip(MODEL_NAMES, instantiate_models()):
+        trained = {
+            "TFIDF": _suite_case(results, "train_model_tfidf/" + name, scale,
+                                 lambda: train_model_tfidf(clone(model), tfidf_matrix[:n_train], labels[:n_train]),
+                                 n_train, "documents", 1),
+            "w2v": _suite_case(results, "train_model_w2v/" + name, scale,
+                               lambda: train_model_w2v(clone(model), word2vec, documents[:n_train], labels[:n_train]),
+                               n_train, "documents", 1),
+        }
+        for features, (featurize, matrix) in featurizers.items():
+            case = "{0} + {1}".format(name, features)
+            _suite_case(results, "predict_one/" + case, scale,
+                        lambda: [predict_sparse(trained[features], featurize(document)) for document in sample],
+                        len(sample), "documents", repeat)
+            _suite_case(results, "predict_batch/" + case, scale, lambda: predict_sparse(trained[features], matrix),
+                        n_docs, "documents", repeat)
+
+    # The POS tagger cache is emptied before every run, so that repeated runs tag the documents again
+    stylistic_cases = [("count_words", count_words), ("words_per_sentence", words_per_sentence),
+                       ("get_pos_tags", get_pos_tags), ("count_negations", count_negations)]
+    for name, function in stylistic_cases:
+        _suite_case(results, "stylistic/" + name, scale,
+                    lambda: (POS_TAGGER.clear_cache(), [function(document) for document in sample]),
+                    len(sample), "documents", repeat)
+    tagged = [get_pos_tags(document) for document in sample]
+    _suite_case(results, "stylistic/get_pos_categories", scale, lambda: [get_pos_categories(tags) for tags in tagged],
+                len(sample), "documents", repeat)
+    return results
+
+
+# Function: suite_metadata()
+# Returns: A dictionary describing the code and the machine the suite ran on
+def suite_metadata():
+    import datetime
+    import platform
+    import subprocess
+    import sklearn
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "sklearn": sklearn.__version__,
+        "nltk": nltk.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+# Function: compare_suites(baseline, results)
+# baseline, results: The "results" lists of two suite files
+# Returns: A list of (case, scale, baseline items/sec, items/sec, ratio) for the cases of both
+def compare_suites(baseline, results):
+    speeds = {(result["case"], result["scale"]): result["items_per_sec"] for result in baseline}
+    return [(result["case"], result["scale"], speeds[result["case"], result["scale"]], result["items_per_sec"],
+             result["items_per_sec"] / speeds[result["case"], result["scale"]])
+            for result in results
+            if speeds.get((result["case"], result["scale"])) and result["items_per_sec"]]
+
+
+def run_suite(args):
+    import json
+    from project_p3 import load_chatbot_bundle
+    POS_TAGGER.load()
+    documents, labels = load_as_list("dataset.csv")
+    word2vec = open_embeddings(EMBEDDING_FILE, EMBEDDING_STORE)
+
+    results = []
+    for scale in args.scales:
+        scale_documents, scale_labels = synthetic_corpus(documents, labels, scale, args.seed)
+        results.extend(bench_suite_scale(scale_documents, scale_labels, word2vec, scale, args.repeat,
+                                         args.train_limit, args.sample))
+
+    # One conversation of the Part 3 chatbot: name, sentiment analysis, stylistic analysis, quit
+    bundle = load_chatbot_bundle()
+    _suite_case(results, "run_chatbot", None,
+                lambda: (POS_TAGGER.clear_cache(), run_chatbot_transcript(bundle, CHAT_SCRIPTS[1])), 1, "conversations",
+                args.repeat)
+
+    with open(args.output, "w", encoding="utf-8") as fout:
+        json.dump({"metadata": suite_metadata(), "results": results}, fout, indent=2)
+    print("Wrote {0} results to {1}".format(len(results), args.output))
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as fin:
+            baseline = json.load(fin)
+        print("Compared with {0} (commit {1}):".format(args.baseline, baseline["metadata"].get("commit")))
+        for case, scale, before, after, ratio in compare_suites(baseline["results"], results):
+            change = "slower" if ratio < 1 - REGRESSION_THRESHOLD else "faster" if ratio > 1 + REGRESSION_THRESHOLD else ""
+            print("{0:<48} {1:>6} {2:14.1f} {3:14.1f} {4:7.2f}x {5}".format(
+                case, "-" if scale is None else "{0}x".format(scale), before, after, ratio, change))
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks and parity checks for the chatbot pipeline")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    tokenizer_parser = subparsers.add_parser("tokenizer", help="WordTokenizer parity and tokens/sec")
+    tokenizer_parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement")
+    tokenizer_parser.set_defaults(run=run_tokenizer)
+
+    parallel_parser = subparsers.add_parser("parallel", help="Parallel feature extraction scaling and parity")
+    parallel_parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4, 8], help="worker counts to measure")
+    parallel_parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement")
+    parallel_parser.set_defaults(run=run_parallel)
+
+    stylistic_parser = subparsers.add_parser("stylistic", help="StylisticAnalyzer parity and latency")
+    stylistic_parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement")
+    stylistic_parser.set_defaults(run=run_stylistic)
+
+    pos_parser = subparsers.add_parser("pos", help="PosTagger parity and per-call latency")
+    pos_parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement")
+    pos_parser.add_argument("--sentences", type=int, default=2000, help="number of sentences timed")
+    pos_parser.set_defaults(run=run_pos)
+
+    profile_parser = subparsers.add_parser("profile", help="Stylistic profile pipeline parity and documents/sec")
+    profile_parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4], help="worker counts to measure")
+    profile_parser.add_argument("--batch-size", type=int, default=250, help="documents per task")
+    profile_parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement")
+    profile_parser.set_defaults(run=run_profile)
+
+    server_parser = subparsers.add_parser("server", help="Concurrent chatbot sessions over TCP")
+    server_parser.add_argument("--sessions", type=int, nargs="+", default=[1, 100, 1000], help="concurrent sessions to run")
+    server_parser.add_argument("--jobs", type=int, default=None, help="inference processes (threads by default)")
+    server_parser.set_defaults(run=run_server)
+
+    batching_parser = subparsers.add_parser("batching", help="Micro-batched sentiment latency and throughput")
+    batching_parser.add_argument("--messages", type=int, default=4000, help="number of messages sent")
+    batching_parser.add_argument("--clients", type=int, nargs="+", default=[1, 16, 64, 256], help="concurrent clients")
+    batching_parser.add_argument("--settings", type=lambda value: tuple(float(x) for x in value.split(":")), nargs="+",
+                                 default=[(1, 0), (8, 1), (32, 2), (128, 5)], help="max_batch:max_wait_ms pairs")
+    batching_parser.set_defaults(run=run_batching)
+
+    word_scores_parser = subparsers.add_parser("word-scores", help="Per-word score table parity, latency and memory")
+    word_scores_parser.add_argument("--random", type=int, default=2000, help="random token lists checked")
+    word_scores_parser.add_argument("--messages", type=int, default=2000, help="sentences timed")
+    word_scores_parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement")
+    word_scores_parser.set_defaults(run=run_word_scores)
+
+    lean_parser = subparsers.add_parser("lean", help="Lean numpy inference parity and cold start latency")
+    lean_parser.add_argument("--random", type=int, default=2000, help="random token lists checked")
+    lean_parser.add_argument("--repeat", type=int, default=5, help="fresh processes per cold start measurement")
+    lean_parser.set_defaults(run=run_lean)
+
+    evaluation_parser = subparsers.add_parser("evaluation", help="Single-pass metrics parity and speed")
+    evaluation_parser.add_argument("--cases", type=int, default=1000, help="random label sets checked")
+    evaluation_parser.add_argument("--sizes", type=int, nargs="+", default=[150, 10000, 1000000], help="label counts timed")
+    evaluation_parser.add_argument("--repeat", type=int, default=5, help="timed runs per measurement")
+    evaluation_parser.set_defaults(run=run_evaluation)
+
+    suite_parser = subparsers.add_parser("suite", help="Hot path benchmark suite on scaled corpora, written to JSON")
+    suite_parser.add_argument("--scales", type=int, nargs="+", default=SUITE_SCALES, help="corpus sizes, in multiples of dataset.csv")
+    suite_parser.add_argument("--output", default="benchmark_suite.json", help="JSON file to write the results to")
+    suite_parser.add_argument("--baseline", help="earlier JSON file of the suite to compare with")
+    suite_parser.add_argument("--train-limit", type=int, default=SUITE_TRAIN_LIMIT, help="largest number of training documents")
+    suite_parser.add_argument("--sample", type=int, default=SUITE_SAMPLE, help="documents of the per-document cases")
+    suite_parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic corpora")
+    suite_parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement")
+    suite_parser.set_defaults(run=run_suite)
+
+    instrumentation_parser = subparsers.add_parser("instrumentation", help="Cost of the disabled and enabled stage timers")
+    instrumentation_parser.add_argument("--calls", type=int, default=100000, help="timed calls of a disabled stage")
+    instrumentation_parser.add_argument("--conversations", type=int, default=200, help="conversations replayed")
+    instrumentation_parser.add_argument("--repeat", type=int, default=3, help="replays with the instrumentation disabled")
+    instrumentation_parser.set_defaults(run=run_instrumentation)
+
+    memory_parser = subparsers.add_parser("memory", help="MemoryProfiler accuracy and the memory of the embeddings")
+    memory_parser.add_argument("--mb", type=float, default=100, help="size of the known allocations, in MB")
+    memory_parser.set_defaults(run=run_memory)
+
+    args = parser.parse_args()
+    sys.exit(args.run(args))
@@ -0,0 +1,226 @@
+# Asyncio multi-session chatbot server
+#
+# run_chatbot drives the dialogue states of Part 3 with blocking input() and
+# print() calls, so one process talks to a single user.  ChatbotEngine runs the
+# same dialogue (the state and transition tables of project_p3.py) as a coroutine
+# per conversation, so a single event loop serves any number of concurrent users:
+#   - every conversation keeps its own ChatSession (state, name, is_first);
+#   - the CPU-bound steps, sentiment prediction and stylistic analysis, run in an
+#     executor, so the event loop keeps serving the other sessions meanwhile:
+#     a thread pool by default, or with n_jobs a process pool whose workers
+#     inherit the model and embeddings once (see parallel.py);
+#   - the sentiment requests of concurrent sessions are gathered by an
+#     InferenceScheduler (see inference_scheduler.py) and predicted in batches
+#     of up to max_batch messages;
+#   - the front end is a line-based TCP or Unix socket server, one conversation
+#     per connection:
+#       python chatbot_server.py --port 8421         then: nc 127.0.0.1 8421
+#       python chatbot_server.py --unix /tmp/chatbot.sock --jobs 4
+#
+# Run "python benchmarks.py server" to check the transcripts against run_chatbot
+# and measure concurrent sessions.  --metrics and --metrics-port export the
+# latency of every dialogue state and inference step (see instrumentation.py).
+# =========================================================================================================
+
+import asyncio
+import contextlib
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
+import parallel
+from inference_scheduler import MAX_BATCH, MAX_WAIT_MS, InferenceScheduler
+from nltk_resources import require_all
+from parallel import process_pool, resolve_n_jobs
+from pos_tagger import POS_TAGGER
+from project_p3 import MODEL_BUNDLE, DialogueBot, load_chatbot_bundle, predict_sentiment_batch, stylistic_correlates
+
+
+# Default address of the TCP front end
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8421
+
+# Longest accepted user message, in bytes; longer lines close the connection
+MAX_LINE_BYTES = 64 * 1024
+
+# Connections waiting to be accepted by the server socket
+BACKLOG = 1024
+
+ENCODING = "utf-8"
+
+
+# Class: StreamIO(reader, writer)
+# reader, writer: The asyncio streams of a connection
+#
+# The input() and print() of one conversation: say() writes a line, ask() writes
+# a prompt and returns the next line sent by the user, without its line ending.
+class StreamIO:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    # Function: say(text)
+    # text: A line of output, written with a trailing newline like print()
+    async def say(self, text):
+        self.writer.write((text + "\n").encode(ENCODING))
+
+    # Function: ask(prompt)
+    # prompt: Text written before reading the answer, like input(prompt)
+    # Returns: The user's answer; raises EOFError once the user has disconnected
+    async def ask(self, prompt):
+        self.writer.write(prompt.encode(ENCODING))
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise EOFError("connection closed by the user")
+        return line.decode(ENCODING, errors="replace").rstrip("\r\n")
+
+
+# Labels of predict_sentiment_batch, one array of shape (1,) per input like predict_sentiment returns
+def _predict_batch(model, vectorizer, word2vec, user_inputs):
+    return predict_sentiment_batch(model, user_inputs, vectorizer, word2vec).reshape(-1, 1)
+
+
+# Worker of the process pool: the model and embeddings are read from parallel.shared()
+def _predict_batch_shared(user_inputs):
+    shared = parallel.shared()
+    return _predict_batch(shared["model"], shared["vectorizer"], shared["word2vec"], user_inputs)
+
+
+# Class: ChatbotEngine(model, vectorizer=None, word2vec=None, n_jobs=None, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS)
+# model: A trained classification model
+# vectorizer: OPTIONAL; The trained vectorizer, if using TFIDF (leave empty otherwise)
+# word2vec: OPTIONAL; The pretrained Word2Vec model, if using Word2Vec (leave empty otherwise)
+# n_jobs: OPTIONAL; Number of inference processes (-1 for one per CPU); a thread pool when None
+# max_batch: OPTIONAL; Largest number of sentiment requests predicted together (1 disables batching)
+# max_wait_ms: OPTIONAL; Longest time a sentiment request waits for others to join its batch
+#
+# A DialogueBot whose inference runs in an executor.  Used as an async context
+# manager, which starts and stops the executor:
+#   async with ChatbotEngine(model, word2vec=word2vec) as engine:
+#       await engine.converse(io)
+class ChatbotEngine(DialogueBot):
+    def __init__(self, model, vectorizer=None, word2vec=None, n_jobs=None, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        super().__init__(model, vectorizer, word2vec)
+        self.n_jobs = n_jobs
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.scheduler = None
+        self.active_sessions = 0
+        self.total_sessions = 0
+        self._executor = None
+        self._stack = None
+
+    async def __aenter__(self):
+        # Loaded before the workers are forked, so they share the tagger weights
+        POS_TAGGER.load()
+        self._stack = contextlib.ExitStack()
+        if self.n_jobs is None:
+            self._executor = self._stack.enter_context(ThreadPoolExecutor(thread_name_prefix="chatbot-inference"))
+            predict_batch = functools.partial(_predict_batch, self.model, self.vectorizer, self.word2vec)
+        else:
+            shared = {"model": self.model, "vectorizer": self.vectorizer, "word2vec": self.word2vec}
+            self._executor = self._stack.enter_context(process_pool(resolve_n_jobs(self.n_jobs), shared))
+            # Start the workers before any connection is accepted: forked later, they would
+            # inherit the sockets of the open connections and keep them open once closed here
+            await self._run(os.getpid)
+            predict_batch = _predict_batch_shared
+        self.scheduler = InferenceScheduler(predict_batch, self.max_batch, self.max_wait_ms, self._executor)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.scheduler.drain()
+        self._stack.close()
+        self._executor = None
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    # Function: predict(user_input)
+    # user_input: A string of arbitrary length
+    # Returns: The label predicted by predict_sentiment, computed in the executor with the
+    #          messages of other sessions that arrived at the same time
+    async def predict(self, user_input):
+        return await self.scheduler.submit(user_input)
+
+    # Function: analyze(user_input)
+    # user_input: A string of arbitrary length
+    # Returns: The informative correlates returned by stylistic_correlates, computed in the executor
+    async def analyze(self, user_input):
+        return await self._run(stylistic_correlates, user_input)
+
+    # Function: converse(io, session=None)
+    # io: An object with the coroutines say(text) and ask(prompt), e.g. a StreamIO
+    # session: OPTIONAL; The ChatSession of the conversation (a new one by default)
+    # Returns: The ChatSession, once the user has quit
+    async def converse(self, io, session=None):
+        self.active_sessions += 1
+        self.total_sessions += 1
+        try:
+            return await super().converse(io, session)
+        finally:
+            self.active_sessions -= 1
+
+    # Function: handle_connection(reader, writer)
+    # reader, writer: The asyncio streams of a new connection
+    # This function runs one conversation over the connection, then closes it
+    async def handle_connection(self, reader, writer):
+        try:
+            await self.converse(StreamIO(reader, writer))
+            await writer.drain()
+        except (EOFError, ConnectionError, ValueError):
+            # The user disconnected, or sent a line longer than MAX_LINE_BYTES
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+
+# Function: start_server(engine, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None)
+# engine: A started ChatbotEngine
+# host, port: Address of the TCP server (port 0 picks a free port)
+# unix_path: OPTIONAL; Path of a Unix socket to listen on instead of TCP
+# Returns: The asyncio Server
+async def start_server(engine, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+    if unix_path is not None:
+        return await asyncio.start_unix_server(engine.handle_connection, unix_path,
+                                               limit=MAX_LINE_BYTES, backlog=BACKLOG)
+    return await asyncio.start_server(engine.handle_connection, host, port,
+                                      limit=MAX_LINE_BYTES, backlog=BACKLOG)
+
+
+async def _serve(bundle, args):
+    async with ChatbotEngine(bundle.model, bundle.vectorizer, bundle.word2vec, n_jobs=args.jobs,
+                             max_batch=args.max_batch, max_wait_ms=args.max_wait_ms) as engine:
+        server = await start_server(engine, args.host, args.port, args.unix)
+        addresses = ", ".join(str(sock.getsockname()) for sock in server.sockets)
+        print("Chatbot listening on {0}".format(addresses))
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the Part 3 chatbot to many users over TCP or a Unix socket")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="TCP address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="TCP port to listen on")
+    parser.add_argument("--unix", help="path of a Unix socket to listen on instead of TCP")
+    parser.add_argument("--jobs", type=int, default=None, help="inference processes (-1 for one per CPU; threads by default)")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="largest sentiment batch (1 disables batching)")
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS, help="longest wait for a sentiment batch to fill up")
+    parser.add_argument("--bundle", default=MODEL_BUNDLE, help="model bundle directory")
+    parser.add_argument("--metrics", help="JSON file to write the stage latencies to on exit (see instrumentation.py)")
+    parser.add_argument("--metrics-port", type=int, help="HTTP port serving the stage latencies at /metrics")
+    args = parser.parse_args()
+
+    require_all()
+    if args.metrics or args.metrics_port is not None:
+        instrumentation.enable(args.metrics, args.metrics_port)
+    bundle = load_chatbot_bundle(args.bundle)
+    try:
+        asyncio.run(_serve(bundle, args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,180 @@
+# Tokenize-once corpus representation
+#
+# vectorize_train, string2vec, count_words, get_pos_tags and count_negations all
+# tokenize the same documents again.  A TokenizedCorpus tokenizes every document
+# once and stores the result compactly:
+#   vocabulary: every distinct token, stored once as a Python string
+#   token_ids:  one flat int32 array holding the vocabulary id of every token
+#   offsets:    an int64 array of size n_docs + 1; document i owns
+#               token_ids[offsets[i]:offsets[i + 1]]
+#
+# The corpus feeds TF-IDF (as a pre-tokenized analyzer, or directly as a sparse
+# term-count matrix) and Word2Vec averaging (through embedding_store.segment_means)
+# without tokenizing again and without keeping one string object per token.
+# =========================================================================================================
+
+from array import array
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfTransformer
+
+from embedding_store import embedding_table, segment_means
+
+
+# Class: TokenizedCorpus(vocabulary, token_ids, offsets)
+# vocabulary: A list of distinct token strings
+# token_ids: A flat integer array of vocabulary ids
+# offsets: An integer array of size n_docs + 1 delimiting the documents in token_ids
+class TokenizedCorpus:
+    def __init__(self, vocabulary, token_ids, offsets):
+        self.vocabulary = vocabulary
+        self.token_ids = np.asarray(token_ids, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self._index = None
+
+    # Function: from_token_lists(token_lists)
+    # token_lists: An iterable of token lists, one per document
+    # Returns: A TokenizedCorpus holding those tokens
+    @classmethod
+    def from_token_lists(cls, token_lists):
+        index = {}
+        token_ids = array("i")
+        offsets = array("q", [0])
+        for tokens in token_lists:
+            # Interning through the index keeps a single string object per distinct token
+            token_ids.extend([index.setdefault(token, len(index)) for token in tokens])
+            offsets.append(len(token_ids))
+
+        corpus = cls(list(index), np.frombuffer(token_ids, dtype=np.int32), np.frombuffer(offsets, dtype=np.int64))
+        corpus._index = index
+        return corpus
+
+    # Function: from_documents(documents, tokenize)
+    # documents: A list of strings, e.g. the documents returned by load_as_list
+    # tokenize: The tokenizer, a function from a string to a list of tokens (e.g. get_tokens)
+    # Returns: A TokenizedCorpus of the documents
+    @classmethod
+    def from_documents(cls, documents, tokenize):
+        return cls.from_token_lists(tokenize(document) for document in documents)
+
+    # Function: concatenate(corpora)
+    # corpora: A list of TokenizedCorpus, e.g. built from consecutive shards of documents
+    # Returns: One TokenizedCorpus with the documents of all corpora, in order
+    #
+    # The vocabularies are merged in order of first appearance, so the result is
+    # identical to building a single corpus from all documents.
+    @classmethod
+    def concatenate(cls, corpora):
+        index = {}
+        token_ids = []
+        offsets = [np.zeros(1, dtype=np.int64)]
+        n_tokens = 0
+        for corpus in corpora:
+            remap = np.array([index.setdefault(token, len(index)) for token in corpus.vocabulary], dtype=np.int32)
+            token_ids.append(remap[corpus.token_ids])
+            offsets.append(corpus.offsets[1:] + n_tokens)
+            n_tokens += len(corpus.token_ids)
+
+        corpus = cls(list(index), np.concatenate(token_ids) if token_ids else np.zeros(0, dtype=np.int32),
+                     np.concatenate(offsets))
+        corpus._index = index
+        return corpus
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = {token: i for i, token in enumerate(self.vocabulary)}
+        return self._index
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    # Function: lengths()
+    # Returns: An integer array with the number of tokens of every document
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    # Function: doc_ids(i)
+    # Returns: The vocabulary ids of the tokens of document i
+    def doc_ids(self, i):
+        return self.token_ids[self.offsets[i]:self.offsets[i + 1]]
+
+    # Function: tokens(i)
+    # Returns: The tokens of document i, as the tokenizer returned them
+    def tokens(self, i):
+        vocabulary = self.vocabulary
+        return [vocabulary[token_id] for token_id in self.doc_ids(i).tolist()]
+
+    # Function: count_matching(predicate)
+    # predicate: A function from a token to a boolean, evaluated once per vocabulary entry
+    # Returns: An integer array with, for every document, the number of its tokens satisfying predicate
+    def count_matching(self, predicate):
+        mask = np.fromiter((bool(predicate(token)) for token in self.vocabulary), dtype=bool, count=len(self.vocabulary))
+        hits = np.concatenate(([0], np.cumsum(mask[self.token_ids], dtype=np.int64)))
+        return hits[self.offsets[1:]] - hits[self.offsets[:-1]]
+
+    # Function: analyzer(lowercase=True)
+    # lowercase: Whether to lowercase the tokens, like TfidfVectorizer(lowercase=True)
+    # Returns: A function from a document index to its list of tokens
+    #
+    # Use it as TfidfVectorizer(analyzer=corpus.analyzer()) and fit the vectorizer
+    # on range(len(corpus)) to build TF-IDF from the already tokenized documents.
+    def analyzer(self, lowercase=True):
+        vocabulary = [token.lower() for token in self.vocabulary] if lowercase else self.vocabulary
+        token_ids, offsets = self.token_ids, self.offsets
+
+        def analyze(i):
+            return [vocabulary[token_id] for token_id in token_ids[offsets[i]:offsets[i + 1]].tolist()]
+
+        return analyze
+
+    # Function: term_counts(lowercase=True)
+    # lowercase: Whether to lowercase the tokens, like CountVectorizer(lowercase=True)
+    # Returns: The sorted list of terms, and the (n_docs, n_terms) CSR matrix of term counts
+    #
+    # The columns are ordered like the vocabulary_ of a fitted CountVectorizer.
+    # Within every row, the stored entries follow the order of first appearance
+    # of their terms in the corpus, as CountVectorizer.fit_transform leaves them,
+    # so TF-IDF norms are summed in the same order and match to the last bit.
+    def term_counts(self, lowercase=True):
+        tokens = [token.lower() for token in self.vocabulary] if lowercase else self.vocabulary
+        # Vocabulary ids are in order of first appearance; so are the terms in rank_of_term
+        rank_of_term = {}
+        ranks = np.array([rank_of_term.setdefault(token, len(rank_of_term)) for token in tokens], dtype=np.int32)
+        terms = sorted(rank_of_term)
+        column_of_rank = np.empty(len(terms), dtype=np.int32)
+        for column, term in enumerate(terms):
+            column_of_rank[rank_of_term[term]] = column
+
+        counts = sparse.csr_matrix((np.ones(len(self.token_ids), dtype=np.int64), ranks[self.token_ids], self.offsets),
+                                   shape=(len(self), len(terms)))
+        counts.sum_duplicates()
+        counts.indices = column_of_rank[counts.indices]
+        counts.has_sorted_indices = False
+        return terms, counts
+
+    # Function: tfidf(lowercase=True)
+    # lowercase: Whether to lowercase the tokens, like TfidfVectorizer(lowercase=True)
+    # Returns: The sorted list of terms, their idf weights, and the (n_docs, n_terms) TF-IDF CSR matrix
+    #
+    # The weighting is TfidfVectorizer's default one (smooth idf, l2 normalization).
+    def tfidf(self, lowercase=True):
+        terms, counts = self.term_counts(lowercase)
+        transformer = TfidfTransformer()
+        # Counted as float64 like TfidfVectorizer does; astype() or a conversion inside the
+        # transformer would sort the entries of every row
+        counts = sparse.csr_matrix((counts.data.astype(np.float64), counts.indices, counts.indptr), shape=counts.shape)
+        tfidf_matrix = transformer.fit_transform(counts)
+        return terms, transformer.idf_, tfidf_matrix
+
+    # Function: embeddings(word2vec, dtype=np.float32)
+    # word2vec: The pretrained Word2Vec model, as a dictionary or an EmbeddingStore
+    # dtype: OPTIONAL; Type of the returned matrix (np.float64 keeps the averages of string2vec unrounded)
+    # Returns: A (n_docs, dim) matrix of averaged embeddings, as string2vec computes them
+    def embeddings(self, word2vec, dtype=np.float32):
+        return segment_means(embedding_table(word2vec, self.vocabulary), self.token_ids, self.offsets, dtype)
+
+    def __repr__(self):
+        return "TokenizedCorpus(documents={0}, tokens={1}, vocabulary={2})".format(
+            len(self), len(self.token_ids), len(self.vocabulary))
@@ -0,0 +1,79 @@
+# Streaming CSV loader
+#
+# load_as_list reads a whole CSV file into a DataFrame and converts both columns
+# to Python lists, so the corpus is held in memory twice and its size is bounded
+# by RAM.  iter_batches() reads the same files batch by batch instead: only the
+# review and label columns are parsed, with explicit dtypes, and every batch is
+# handed out as (documents, labels) lists of at most batch_size rows, so memory
+# use depends on the batch size and not on the size of the file.
+#
+# The default reader is pandas' C parser.  With engine="pyarrow", the file is
+# read through pyarrow's multithreaded streaming CSV reader instead; pyarrow is
+# an optional dependency, only imported when that engine is requested.
+#   for documents, labels in iter_batches("reviews.csv", batch_size=5000):
+#       ...
+# =========================================================================================================
+
+import numpy as np
+import pandas as pd
+
+
+# Columns read from the CSV files, and their types
+REVIEW_COLUMN = "review"
+LABEL_COLUMN = "label"
+COLUMN_DTYPES = {REVIEW_COLUMN: str, LABEL_COLUMN: np.int64}
+
+# Default number of rows per batch
+BATCH_SIZE = 10000
+
+# Bytes of CSV text decoded at once by the pyarrow reader
+PYARROW_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+# Function: iter_batches(fname, batch_size=BATCH_SIZE, engine=None)
+# fname: A string indicating a filename, in the format read by load_as_list
+# batch_size: Maximum number of rows per batch
+# engine: OPTIONAL; "pyarrow" to use pyarrow's CSV reader, otherwise a pandas read_csv engine ("c" by default)
+# Returns: A generator of (documents, labels) pairs: a list of document strings and a list of integers
+#
+# Concatenating the batches gives the same documents and labels as load_as_list(fname).
+def iter_batches(fname, batch_size=BATCH_SIZE, engine=None):
+    if batch_size < 1:
+        raise ValueError("batch_size must be positive, got {0}".format(batch_size))
+    if engine == "pyarrow":
+        yield from _iter_batches_pyarrow(fname, batch_size)
+        return
+
+    chunks = pd.read_csv(fname, usecols=list(COLUMN_DTYPES), dtype=COLUMN_DTYPES,
+                         chunksize=batch_size, engine=engine or "c")
+    with chunks:
+        for chunk in chunks:
+            yield chunk[REVIEW_COLUMN].values.tolist(), chunk[LABEL_COLUMN].values.tolist()
+
+
+# pandas cannot combine engine="pyarrow" with chunksize, so the pyarrow reader
+# is used directly and its record batches are cut into batches of batch_size rows
+def _iter_batches_pyarrow(fname, batch_size):
+    try:
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+    except ImportError as error:
+        raise ImportError("engine='pyarrow' requires the pyarrow package (pip install pyarrow)") from error
+
+    reader = pa_csv.open_csv(
+        fname,
+        read_options=pa_csv.ReadOptions(block_size=PYARROW_BLOCK_SIZE),
+        convert_options=pa_csv.ConvertOptions(include_columns=list(COLUMN_DTYPES),
+                                              column_types={REVIEW_COLUMN: pa.string(), LABEL_COLUMN: pa.int64()}),
+    )
+
+    documents, labels = [], []
+    for record_batch in reader:
+        columns = record_batch.to_pydict()
+        documents.extend(columns[REVIEW_COLUMN])
+        labels.extend(columns[LABEL_COLUMN])
+        while len(documents) >= batch_size:
+            yield documents[:batch_size], labels[:batch_size]
+            documents, labels = documents[batch_size:], labels[batch_size:]
+    if documents:
+        yield documents, labels
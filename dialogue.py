@@ -0,0 +1,213 @@
+# Replay harness of the chatbot dialogue
+#
+# The dialogue of run_chatbot (Part 3) is the state machine of project_p3.py:
+# STATE_HANDLERS maps every state to a coroutine that talks to the user through
+# an I/O object with two coroutines, say(text) and ask(prompt), and TRANSITIONS
+# maps every (state, outcome) pair to the next state.  ScriptedIO below answers
+# from a list, so a DialogueBot runs headless.
+#
+# The replay harness records conversations of synthetic users (answers and the
+# full transcript) to a JSON lines file, then pushes them through the whole
+# pipeline again, checks every transcript and reports the user turns per second
+# and the latency of every state:
+#   python dialogue.py record conversations.jsonl --conversations 1000
+#   python dialogue.py replay conversations.jsonl [--concurrency 64] [--metrics metrics.json]
+# =========================================================================================================
+
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+
+import numpy as np
+
+import instrumentation
+# The state machine is re-exported for the replay harness and chatbot_server
+from project_p3 import (INITIAL_STATE, MENU_CHOICES, NAME_PROMPT, NEXT_ACTION_PROMPT, STATE_HANDLERS, TRANSITIONS,
+                        ChatSession, ConsoleIO, DialogueBot)
+
+
+# Class: ScriptedIO(answers=None, respond=None)
+# answers: OPTIONAL; The user's answers, in order
+# respond: OPTIONAL; A function from a prompt to the answer, used when answers is None
+#
+# A headless user.  Everything the bot writes, prompts included, is kept in
+# transcript() exactly as the console would show it (without the echo of the
+# answers); the answers given are kept in answers.
+class ScriptedIO:
+    def __init__(self, answers=None, respond=None):
+        if (answers is None) == (respond is None):
+            raise ValueError("ScriptedIO needs either answers or respond")
+        self.answers = list(answers) if answers is not None else []
+        self.respond = respond
+        self._next_answer = 0
+        self._output = []
+
+    async def say(self, text):
+        self._output.append(text + "\n")
+
+    async def ask(self, prompt):
+        self._output.append(prompt)
+        if self.respond is not None:
+            self.answers.append(self.respond(prompt))
+        elif self._next_answer == len(self.answers):
+            raise EOFError("the script has no answer left")
+        self._next_answer += 1
+        return self.answers[self._next_answer - 1]
+
+    # Function: transcript()
+    # Returns: The output of the bot so far, as a single string
+    def transcript(self):
+        return "".join(self._output)
+
+
+# Function: synthetic_user(documents, seed=0, max_rounds=3)
+# documents: A list of strings the user picks messages from
+# seed: Seed of the user's random choices
+# max_rounds: Largest number of menu choices before quitting
+# Returns: A respond function for ScriptedIO, answering every prompt of the dialogue
+def synthetic_user(documents, seed=0, max_rounds=3):
+    rng = random.Random(seed)
+    first, last = rng.choice(["Ann", "Bob", "Carla", "Deniz"]), rng.choice(["Lee", "Diaz", "Smith", "Yilmaz"])
+    rounds = rng.randint(1, max_rounds)
+
+    def respond(prompt):
+        nonlocal rounds
+        if prompt == NAME_PROMPT:
+            return rng.choice(["My name is {0} {1}", "{0} {1}", "I am {0} {1}.", "{0}"]).format(first, last)
+        if prompt == NEXT_ACTION_PROMPT:
+            if rng.random() < 0.1:
+                return rng.choice(["", "b", "maybe (a)"])
+            rounds -= 1
+            return "(a)" if rounds <= 0 else rng.choice(["(b)", "(c)", " (c) "])
+        return rng.choice(documents)
+
+    return respond
+
+
+# Function: record_conversations(bot, documents, n_conversations, seed=0)
+# bot: A DialogueBot
+# documents: A list of strings the synthetic users pick messages from
+# n_conversations: Number of conversations to record
+# seed: Seed of the first synthetic user
+# Returns: A list of {"answers": [...], "transcript": "..."} dictionaries
+def record_conversations(bot, documents, n_conversations, seed=0):
+    async def record():
+        conversations = []
+        for i in range(n_conversations):
+            io = ScriptedIO(respond=synthetic_user(documents, seed + i))
+            await bot.converse(io)
+            conversations.append({"answers": io.answers, "transcript": io.transcript()})
+        return conversations
+
+    return asyncio.run(record())
+
+
+# Function: save_conversations(fname, conversations) / load_conversations(fname)
+# fname: A JSON lines file, one conversation per line
+def save_conversations(fname, conversations):
+    with open(fname, "w", encoding="utf-8") as fout:
+        for conversation in conversations:
+            fout.write(json.dumps(conversation) + "\n")
+
+
+def load_conversations(fname):
+    with open(fname, "r", encoding="utf-8") as fin:
+        return [json.loads(line) for line in fin if line.strip()]
+
+
+# Function: replay(bot, conversations, concurrency=1)
+# bot: A DialogueBot, or a started chatbot_server.ChatbotEngine
+# conversations: A list of recorded conversations, as returned by record_conversations
+# concurrency: Number of conversations running at the same time
+# Returns: A dictionary with the number of conversations, user turns, wrong transcripts, the
+#          elapsed seconds, the turns per second and the p50/p99 latency in ms of every state
+#
+# The bot's on_state hook is replaced during the replay to time the states.
+async def replay(bot, conversations, concurrency=1):
+    latencies = defaultdict(list)
+    previous_hook, bot.on_state = bot.on_state, lambda state, seconds: latencies[state].append(seconds)
+    semaphore = asyncio.Semaphore(concurrency)
+    wrong = 0
+
+    async def run(conversation):
+        nonlocal wrong
+        async with semaphore:
+            io = ScriptedIO(answers=conversation["answers"])
+            await bot.converse(io)
+            if io.transcript() != conversation["transcript"]:
+                wrong += 1
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*[run(conversation) for conversation in conversations])
+    finally:
+        bot.on_state = previous_hook
+    elapsed = time.perf_counter() - start
+
+    turns = sum(len(conversation["answers"]) for conversation in conversations)
+    return {
+        "conversations": len(conversations),
+        "turns": turns,
+        "wrong_transcripts": wrong,
+        "seconds": elapsed,
+        "turns_per_sec": turns / elapsed if elapsed else 0.0,
+        "states": {state: {"count": len(seconds), "p50_ms": 1000 * np.percentile(seconds, 50),
+                           "p99_ms": 1000 * np.percentile(seconds, 99)}
+                   for state, seconds in latencies.items()},
+    }
+
+
+def _print_report(report):
+    print("{conversations} conversations, {turns} user turns in {seconds:.2f} s: {turns_per_sec:.0f} turns/sec, "
+          "{wrong_transcripts} wrong transcripts".format(**report))
+    for state, stats in report["states"].items():
+        print("  {0:<20} {1:>7} runs  p50 {2:8.3f} ms  p99 {3:8.3f} ms".format(
+            state, stats["count"], stats["p50_ms"], stats["p99_ms"]))
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    from project_p1 import load_as_list
+    from project_p3 import load_chatbot_bundle
+
+    parser = argparse.ArgumentParser(description="Record and replay scripted chatbot conversations")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    record_parser = subparsers.add_parser("record", help="record conversations of synthetic users")
+    record_parser.add_argument("output", help="JSON lines file to write")
+    record_parser.add_argument("--conversations", type=int, default=1000, help="number of conversations")
+    record_parser.add_argument("--seed", type=int, default=0, help="seed of the first synthetic user")
+    replay_parser = subparsers.add_parser("replay", help="replay recorded conversations and check their transcripts")
+    replay_parser.add_argument("input", help="JSON lines file written by record")
+    replay_parser.add_argument("--concurrency", type=int, default=1,
+                               help="concurrent conversations; above 1 they run on a ChatbotEngine")
+    replay_parser.add_argument("--metrics", help="JSON file to write the stage latencies to (see instrumentation.py)")
+    args = parser.parse_args()
+
+    bundle = load_chatbot_bundle()
+    if args.command == "record":
+        documents = load_as_list("test.csv")[0]
+        conversations = record_conversations(DialogueBot(bundle.model, bundle.vectorizer, bundle.word2vec),
+                                             documents, args.conversations, args.seed)
+        save_conversations(args.output, conversations)
+        print("{0} conversations written to {1}".format(len(conversations), args.output))
+        sys.exit(0)
+
+    conversations = load_conversations(args.input)
+    if args.metrics:
+        instrumentation.enable(args.metrics)
+    if args.concurrency > 1:
+        from chatbot_server import ChatbotEngine
+
+        async def replay_on_engine():
+            async with ChatbotEngine(bundle.model, bundle.vectorizer, bundle.word2vec) as engine:
+                return await replay(engine, conversations, args.concurrency)
+
+        report = asyncio.run(replay_on_engine())
+    else:
+        report = asyncio.run(replay(DialogueBot(bundle.model, bundle.vectorizer, bundle.word2vec), conversations))
+    _print_report(report)
+    sys.exit(1 if report["wrong_transcripts"] else 0)
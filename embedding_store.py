@@ -0,0 +1,340 @@
+# Memory-mapped Word2Vec store
+#
+# The w2v.pkl file provided with the project is a pickled dictionary holding one
+# (300,) numpy array per word.  Unpickling it creates one Python object per word
+# in every process that needs the embeddings, which is slow and memory hungry.
+#
+# This module converts that dictionary once into a store directory made of:
+#   vectors.npy: a single contiguous float32 matrix, one row per word
+#   vocab.txt:   the words, one per line, in the same order as the matrix rows
+#   meta.json:   the format version, the shape, a checksum of the contents, and
+#                the size, modification time and sha256 of the source pickle
+#
+# open_embeddings() reuses an existing store only while it was converted from
+# the current pickle: a replaced w2v.pkl is converted again, so the old
+# embeddings (and every cache key derived from their checksum) are not served
+# silently.  The sha256 of the pickle is only computed when its size matches
+# but its modification time does not, e.g. after a fresh checkout.
+#
+# load_embedding_store() memory-maps vectors.npy, so opening the store is nearly
+# instant and the pages are shared between every process that opens it.  The
+# returned EmbeddingStore behaves like the original dictionary (token in store,
+# store[token]), so w2v() and string2vec() work unchanged on top of it.
+#
+# Convert the pickle from a terminal with:
+#   python embedding_store.py w2v.pkl w2v_store
+# =========================================================================================================
+
+import hashlib
+import json
+import os
+import pickle as pkl
+from collections.abc import Mapping
+
+import numpy as np
+
+
+STORE_FORMAT = 1
+VECTORS_FILE = "vectors.npy"
+VOCAB_FILE = "vocab.txt"
+META_FILE = "meta.json"
+
+
+# Class: EmbeddingStore(store_dir)
+# store_dir: path of a directory written by convert_w2v_pickle
+#
+# Read-only mapping from words to their embeddings backed by a memory-mapped
+# matrix.  Looking up a word returns a (dim,) float32 row of that matrix.  The
+# word -> row index is only built the first time a word is looked up.
+class EmbeddingStore(Mapping):
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, META_FILE), "r", encoding="utf-8") as fin:
+            self.meta = json.load(fin)
+        if self.meta.get("format") != STORE_FORMAT:
+            raise ValueError("Unsupported embedding store format in {0}: {1}".format(store_dir, self.meta.get("format")))
+
+        self.vectors = np.load(os.path.join(store_dir, VECTORS_FILE), mmap_mode="r")
+        self._words = None
+        self._index = None
+
+    # The vocabulary is read lazily so that opening the store stays cheap
+    def _load_vocab(self):
+        with open(os.path.join(self.store_dir, VOCAB_FILE), "r", encoding="utf-8", newline="\n") as fin:
+            self._words = fin.read().split("\n")[:-1]
+        self._index = dict(zip(self._words, range(len(self._words))))
+
+    @property
+    def words(self):
+        if self._words is None:
+            self._load_vocab()
+        return self._words
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._load_vocab()
+        return self._index
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1]
+
+    # Fingerprint of the store contents, usable as a cache key
+    @property
+    def version(self):
+        return self.meta["checksum"]
+
+    def __getitem__(self, token):
+        return self.vectors[self.index[token]]
+
+    def __contains__(self, token):
+        return token in self.index
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    # Pickling only records the directory, so the store can be handed to worker
+    # processes which then map the same file instead of receiving a copy
+    def __reduce__(self):
+        return (EmbeddingStore, (self.store_dir,))
+
+    def __repr__(self):
+        return "EmbeddingStore({0!r}, size={1}, dim={2})".format(self.store_dir, len(self), self.dim)
+
+
+# Function: hash_file(path)
+# path: A file path
+# Returns: The sha256 hex digest of the file contents
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fin:
+        for block in iter(lambda: fin.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Function: source_info(pickle_path)
+# pickle_path: path of w2v.pkl
+# Returns: The size, modification time and sha256 of the file, as recorded in the store metadata
+def source_info(pickle_path):
+    stat = os.stat(pickle_path)
+    return {"file": os.path.basename(pickle_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "sha256": hash_file(pickle_path)}
+
+
+# Function: is_converted_from(store_dir, pickle_path)
+# store_dir: path of a directory written by convert_w2v_pickle
+# pickle_path: path of w2v.pkl
+# Returns: True if the store was converted from the current contents of pickle_path
+#
+# When only the modification time differs and the contents are the same, the new
+# time is recorded, so that the pickle is not hashed again on the next call.
+def is_converted_from(store_dir, pickle_path):
+    meta_path = os.path.join(store_dir, META_FILE)
+    with open(meta_path, "r", encoding="utf-8") as fin:
+        meta = json.load(fin)
+    source = meta.get("source")
+    if source is None:
+        # Written before the source was recorded
+        return False
+    stat = os.stat(pickle_path)
+    if stat.st_size != source["size"]:
+        return False
+    if stat.st_mtime_ns == source["mtime_ns"]:
+        return True
+    if hash_file(pickle_path) != source["sha256"]:
+        return False
+    source["mtime_ns"] = stat.st_mtime_ns
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as fout:
+        json.dump(meta, fout, indent=2)
+    os.replace(meta_path + ".tmp", meta_path)
+    return True
+
+
+# Function: convert_w2v_pickle(pickle_path, store_dir)
+# pickle_path: path of w2v.pkl
+# store_dir: directory to write the store into (created if needed)
+# Returns: The converted store, opened with load_embedding_store
+#
+# This function writes the pickled dictionary into the store format, one row at
+# a time, so the matrix is never held twice in memory.  meta.json is removed
+# first and written last: a store whose conversion was interrupted has no
+# metadata and is treated as missing.
+def convert_w2v_pickle(pickle_path, store_dir):
+    source = source_info(pickle_path)
+    with open(pickle_path, "rb") as fin:
+        word2vec = pkl.load(fin)
+    if len(word2vec) == 0:
+        raise ValueError("No embeddings found in {0}".format(pickle_path))
+
+    dim = len(next(iter(word2vec.values())))
+    os.makedirs(store_dir, exist_ok=True)
+    if os.path.exists(os.path.join(store_dir, META_FILE)):
+        # Invalidate the previous store until the new one is complete
+        os.remove(os.path.join(store_dir, META_FILE))
+    checksum = hashlib.sha256()
+
+    # Written to temporary files first, then moved into place: processes that still map the
+    # previous vectors keep reading them, and a store file is never left half written
+    paths = {name: os.path.join(store_dir, name) for name in (VECTORS_FILE, VOCAB_FILE, META_FILE)}
+    vectors = np.lib.format.open_memmap(paths[VECTORS_FILE] + ".tmp", mode="w+",
+                                        dtype=np.float32, shape=(len(word2vec), dim))
+    with open(paths[VOCAB_FILE] + ".tmp", "w", encoding="utf-8", newline="\n") as fout:
+        for row, (word, vector) in enumerate(word2vec.items()):
+            if "\n" in word:
+                raise ValueError("Cannot store a word containing a newline: {0!r}".format(word))
+            vectors[row] = vector
+            fout.write(word + "\n")
+            checksum.update(word.encode("utf-8"))
+            checksum.update(vectors[row].tobytes())
+    vectors.flush()
+    del vectors
+
+    meta = {"format": STORE_FORMAT, "size": len(word2vec), "dim": dim, "checksum": checksum.hexdigest(),
+            "source": source}
+    with open(paths[META_FILE] + ".tmp", "w", encoding="utf-8") as fout:
+        json.dump(meta, fout, indent=2)
+    for name in (VECTORS_FILE, VOCAB_FILE, META_FILE):
+        os.replace(paths[name] + ".tmp", paths[name])
+
+    return load_embedding_store(store_dir)
+
+
+# Function: embeddings_version(word2vec)
+# word2vec: The pretrained Word2Vec model, as a dictionary or an EmbeddingStore
+# Returns: A fingerprint of the words and vectors, usable as a cache key
+#
+# For a dictionary, this is the checksum convert_w2v_pickle would store for it
+# (the words and their float32 vectors, in order), so a dictionary and the store
+# converted from it have the same version.  It reads every vector once.
+def embeddings_version(word2vec):
+    if isinstance(word2vec, EmbeddingStore):
+        return word2vec.version
+    checksum = hashlib.sha256()
+    for word, vector in word2vec.items():
+        checksum.update(word.encode("utf-8"))
+        checksum.update(np.asarray(vector, dtype=np.float32).tobytes())
+    return checksum.hexdigest()
+
+
+# Function: segment_means(table, ids, offsets, dtype=np.float32)
+# table: A (n_rows, dim) matrix of embeddings
+# ids: A flat integer array of rows of table, all documents one after the other
+# offsets: An integer array of size n_docs + 1; document i owns ids[offsets[i]:offsets[i + 1]]
+# dtype: OPTIONAL; Type of the returned matrix (np.float64 keeps the averages of string2vec unrounded)
+# Returns: A (n_docs, dim) matrix holding the average row of each document (zeros for empty documents)
+#
+# The segment sums are computed as one sparse product: (ids, offsets) already
+# are the indices and row pointers of a CSR matrix with one column per row of
+# table, so no (n_tokens, dim) matrix of gathered rows is ever materialized.
+# Repeated ids within a document are summed by the product, and the sums are
+# accumulated in float64 like np.mean does.
+def segment_means(table, ids, offsets, dtype=np.float32):
+    # Imported here: opening a store must not pay for importing scipy (see lean_inference.py)
+    from scipy import sparse
+
+    offsets = np.asarray(offsets, dtype=np.int64)
+    ids = np.asarray(ids, dtype=np.int64)
+    n_docs = len(offsets) - 1
+    lengths = np.diff(offsets)
+
+    indicator = sparse.csr_matrix((np.ones(len(ids)), ids, offsets), shape=(n_docs, table.shape[0]))
+    sums = indicator @ np.asarray(table, dtype=np.float64)
+
+    return (sums / np.maximum(lengths, 1)[:, None]).astype(dtype, copy=False)
+
+
+# Function: embedding_table(word2vec, vocabulary, dim=300)
+# word2vec: The pretrained Word2Vec model, as a dictionary or an EmbeddingStore
+# vocabulary: A list of distinct tokens
+# dim: Size of the embeddings, used when no token of vocabulary is known
+# Returns: A (len(vocabulary), dim) float32 matrix whose row i is the embedding of vocabulary[i]
+#
+# Unknown tokens get a zero row, so they still count towards averages exactly as
+# in string2vec.  With an EmbeddingStore, the known rows are gathered from the
+# memory-mapped matrix in one step.
+def embedding_table(word2vec, vocabulary, dim=300):
+    if isinstance(word2vec, EmbeddingStore):
+        index = word2vec.index
+        store_rows = np.array([index.get(token, -1) for token in vocabulary], dtype=np.int64)
+        known = store_rows >= 0
+        table = np.zeros((len(vocabulary), word2vec.dim), dtype=np.float32)
+        table[known] = word2vec.vectors[store_rows[known]]
+        return table
+
+    vectors = [word2vec.get(token) for token in vocabulary]
+    known = next((vector for vector in vectors if vector is not None), None)
+    if known is not None:
+        dim = len(known)
+    table = np.zeros((len(vocabulary), dim), dtype=np.float32)
+    for row, vector in enumerate(vectors):
+        if vector is not None:
+            table[row] = vector
+    return table
+
+
+# Function: embed_token_lists(word2vec, token_lists, dtype=np.float32)
+# word2vec: The pretrained Word2Vec model, as a dictionary or an EmbeddingStore
+# token_lists: A list of token lists, one per document
+# dtype: OPTIONAL; Type of the returned matrix, see segment_means
+# Returns: A (n_docs, dim) matrix of averaged embeddings
+#
+# Every distinct token is looked up once and mapped to an integer row id of a
+# small table of embeddings, then the rows are averaged with segment_means.
+def embed_token_lists(word2vec, token_lists, dtype=np.float32):
+    local_ids = {}
+    flat = []
+    offsets = np.zeros(len(token_lists) + 1, dtype=np.int64)
+    for i, tokens in enumerate(token_lists):
+        for token in tokens:
+            flat.append(local_ids.setdefault(token, len(local_ids)))
+        offsets[i + 1] = len(flat)
+
+    table = embedding_table(word2vec, list(local_ids))
+    return segment_means(table, np.asarray(flat, dtype=np.int64), offsets, dtype)
+
+
+# Function: load_embedding_store(store_dir)
+# store_dir: path of a directory written by convert_w2v_pickle
+# Returns: An EmbeddingStore usable wherever the word2vec dictionary is expected
+def load_embedding_store(store_dir):
+    return EmbeddingStore(store_dir)
+
+
+# Function: is_embedding_store(path)
+# path: A filesystem path
+# Returns: True if path is a directory written by convert_w2v_pickle
+def is_embedding_store(path):
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+# Function: open_embeddings(pickle_path, store_dir)
+# pickle_path: path of w2v.pkl
+# store_dir: path of the store directory
+# Returns: An EmbeddingStore, converting pickle_path into store_dir first if the store does not exist
+#          yet or was converted from another version of pickle_path
+#
+# Without pickle_path (e.g. only the store was deployed), the store is used as is.
+def open_embeddings(pickle_path, store_dir):
+    if is_embedding_store(store_dir):
+        if not os.path.exists(pickle_path) or is_converted_from(store_dir, pickle_path):
+            return load_embedding_store(store_dir)
+        print("{0} has changed since the embedding store {1} was converted....".format(pickle_path, store_dir))
+    print("Converting {0} into the embedding store {1}....".format(pickle_path, store_dir))
+    return convert_w2v_pickle(pickle_path, store_dir)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert a pickled word2vec dictionary into a memory-mapped store")
+    parser.add_argument("pickle_path", help="path of the pickled dictionary, e.g. w2v.pkl")
+    parser.add_argument("store_dir", help="directory to write the store into, e.g. w2v_store")
+    args = parser.parse_args()
+
+    store = convert_w2v_pickle(args.pickle_path, args.store_dir)
+    print("Wrote {0}".format(store))
@@ -0,0 +1,178 @@
+# Single-pass model evaluation
+#
+# test_model_tfidf and test_model_w2v used to call precision_score,
+# recall_score, f1_score and accuracy_score one after the other, so the
+# predictions were validated and scanned four times.  evaluate_predictions()
+# counts the confusion matrix of binary labels once and derives the four
+# metrics from it, with the values (and the 0.0 of undefined metrics) of the
+# scikit-learn functions.
+#
+# evaluate_model() also measures what a model costs to run on a test set:
+#   - the time to featurize the test documents and to predict them, and the
+#     resulting documents per second;
+#   - the p50 and p99 latency of featurizing and predicting one document at a
+#     time, as the chatbot does, on up to LATENCY_SAMPLES documents;
+#   - optionally, the peak memory allocated while predicting the test set,
+#     traced with tracemalloc in a separate pass so that tracing does not slow
+#     down the timed one.
+# The test set is featurized once per feature set by featurize_test_set(),
+# which times the whole test set and every latency document, and the
+# TestFeatures it returns are evaluated with every model of that feature set.
+# The main function of Part 1 writes these columns to classification_report.csv
+# for every model/feature combination (see training_jobs.py).
+# =========================================================================================================
+
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+from memory_profile import MB, MemoryProfiler
+from sparse_models import predict_sparse
+
+
+# Number of test documents whose single-document latency is measured
+LATENCY_SAMPLES = 100
+
+# Label of the positive class, as the pos_label of the scikit-learn metrics
+POSITIVE_LABEL = 1
+
+
+# Class: Evaluation(precision, recall, f1, accuracy, featurize_seconds, predict_seconds, docs_per_sec, p50_ms, p99_ms, peak_memory_mb)
+# featurize_seconds, predict_seconds: Wall-clock time spent featurizing and predicting the whole test set
+# docs_per_sec: Test documents featurized and predicted per second
+# p50_ms, p99_ms: Percentiles of the latency of featurizing and predicting a single document, in milliseconds
+# peak_memory_mb: Largest memory allocated on top of the memory in use while predicting the test set, or None if
+#                 it was not measured
+class Evaluation(NamedTuple):
+    precision: float
+    recall: float
+    f1: float
+    accuracy: float
+    featurize_seconds: float
+    predict_seconds: float
+    docs_per_sec: float
+    p50_ms: float
+    p99_ms: float
+    peak_memory_mb: float
+
+
+# Class: TestFeatures(features, featurize_seconds, positions, featurize_latencies)
+# features: The feature matrix of the test documents
+# featurize_seconds: Wall-clock time spent featurizing the whole test set
+# positions: The positions of the documents whose single-document latency is measured (see latency_sample)
+# featurize_latencies: The time spent featurizing each of these documents alone, in seconds
+class TestFeatures(NamedTuple):
+    features: object
+    featurize_seconds: float
+    positions: list
+    featurize_latencies: list
+
+
+# Function: confusion_counts(labels, predictions, positive=POSITIVE_LABEL)
+# labels: The true labels
+# predictions: The predicted labels, in the same order
+# positive: OPTIONAL; The label of the positive class
+# Returns: The numbers of true positives, false positives, false negatives and true negatives
+def confusion_counts(labels, predictions, positive=POSITIVE_LABEL):
+    cells = 2 * (np.asarray(labels) == positive) + (np.ravel(predictions) == positive)
+    tn, fp, fn, tp = np.bincount(cells, minlength=4).tolist()
+    return tp, fp, fn, tn
+
+
+# Function: scores_from_counts(tp, fp, fn, tn)
+# tp, fp, fn, tn: Numbers of true positives, false positives, false negatives and true negatives
+# Returns: Precision, recall, F1, and accuracy values, as computed by precision_score, recall_score,
+#          f1_score and accuracy_score (0.0 where they are undefined)
+def scores_from_counts(tp, fp, fn, tn):
+    precision = tp / (tp + fp) if tp + fp > 0 else 0.0
+    recall = tp / (tp + fn) if tp + fn > 0 else 0.0
+    f1 = 2 * tp / (2 * tp + fp + fn) if tp + fp + fn > 0 else 0.0
+    accuracy = (tp + tn) / (tp + fp + fn + tn) if tp + fp + fn + tn > 0 else 0.0
+    return precision, recall, f1, accuracy
+
+
+# Function: evaluate_predictions(labels, predictions)
+# labels: The true labels (all 0 or 1)
+# predictions: The predicted labels, in the same order
+# Returns: Precision, recall, F1, and accuracy values, from a single count of the confusion matrix
+def evaluate_predictions(labels, predictions):
+    return scores_from_counts(*confusion_counts(labels, predictions))
+
+
+# Function: latency_sample(n_documents, n_samples=LATENCY_SAMPLES)
+# n_documents: Number of test documents
+# n_samples: OPTIONAL; Largest number of documents timed
+# Returns: The positions of the timed documents, spread evenly over the test set
+def latency_sample(n_documents, n_samples=LATENCY_SAMPLES):
+    return np.unique(np.linspace(0, n_documents - 1, num=min(n_samples, n_documents)).astype(np.int64)).tolist()
+
+
+# Function: peak_memory(function)
+# function: A function of no arguments
+# Returns: The largest number of bytes allocated by function on top of the memory already in use
+#
+# The pass is a stage of its own MemoryProfiler, so it does not reset the peak of
+# a memory profile stage it runs in (see memory_profile.py).
+def peak_memory(function):
+    profiler = MemoryProfiler()
+    try:
+        with profiler.stage("peak_memory"):
+            function()
+    finally:
+        profiler.close()
+    return profiler.records[0].peak_mb * MB
+
+
+# Function: featurize_test_set(featurize, documents, latency_samples=LATENCY_SAMPLES, featurize_all=None)
+# featurize: A function from a list of documents to their feature matrix, e.g. vectorizer.transform
+# documents: A list of test documents
+# latency_samples: OPTIONAL; Largest number of documents featurized one at a time
+# featurize_all: OPTIONAL; The function featurizing the whole test set instead of featurize, e.g. one reading
+#                the matrix from a FeatureStore (the single documents are always featurized with featurize)
+# Returns: The TestFeatures of documents
+def featurize_test_set(featurize, documents, latency_samples=LATENCY_SAMPLES, featurize_all=None):
+    start = time.perf_counter()
+    features = (featurize_all or featurize)(documents)
+    featurize_seconds = time.perf_counter() - start
+
+    positions = latency_sample(len(documents), latency_samples)
+    latencies = []
+    for position in positions:
+        start = time.perf_counter()
+        featurize([documents[position]])
+        latencies.append(time.perf_counter() - start)
+    return TestFeatures(features, featurize_seconds, positions, latencies)
+
+
+# Function: evaluate_model(model, test_features, labels, predict=predict_sparse, memory=False)
+# model: A trained machine learning model
+# test_features: The TestFeatures of the test documents (see featurize_test_set)
+# labels: A list of integers (all 0 or 1)
+# predict: OPTIONAL; A function (model, features) -> labels
+# memory: OPTIONAL; True to measure peak_memory_mb, in one more prediction of the test set
+# Returns: An Evaluation
+#
+# The single-document latency is the time spent featurizing the document, from
+# test_features, plus the time spent predicting its row of the feature matrix.
+def evaluate_model(model, test_features, labels, predict=predict_sparse, memory=False):
+    features = test_features.features
+    start = time.perf_counter()
+    label_predicts = predict(model, features)
+    predict_seconds = time.perf_counter() - start
+    precision, recall, f1, accuracy = evaluate_predictions(labels, label_predicts)
+    del label_predicts
+
+    latencies = []
+    for position, featurize_latency in zip(test_features.positions, test_features.featurize_latencies):
+        start = time.perf_counter()
+        predict(model, features[position:position + 1])
+        latencies.append(featurize_latency + time.perf_counter() - start)
+
+    n_documents = features.shape[0]
+    featurize_seconds = test_features.featurize_seconds
+    return Evaluation(precision, recall, f1, accuracy, featurize_seconds, predict_seconds,
+                      n_documents / (featurize_seconds + predict_seconds) if n_documents else 0.0,
+                      1000 * float(np.percentile(latencies, 50)) if latencies else 0.0,
+                      1000 * float(np.percentile(latencies, 99)) if latencies else 0.0,
+                      peak_memory(lambda: predict(model, features)) / MB if memory else None)
@@ -0,0 +1,138 @@
+# Document-feature cache
+#
+# Building features is the most expensive part of every experiment: the main
+# function of Part 1 averages Word2Vec embeddings over the whole dataset once per
+# classifier, and the TF-IDF matrix is rebuilt on every run.  A FeatureStore
+# keeps each feature matrix it computes, keyed by a content hash of the documents
+# plus a version string describing how the features were made (tokenizer,
+# embeddings, fitted vectorizer...), so any later request for the same features
+# is answered from memory or from disk instead of being recomputed.
+#
+# Dense matrices are saved as .npy files and sparse matrices as .npz files in the
+# cache directory; other artifacts (e.g. a fitted vectorizer) are stored as .npz
+# archives of arrays through put_arrays/get_arrays.
+# =========================================================================================================
+
+import hashlib
+import os
+
+import numpy as np
+from scipy import sparse
+
+
+# Function: hash_documents(documents)
+# documents: A list of strings
+# Returns: A hex string identifying the exact contents and order of documents
+def hash_documents(documents):
+    digest = hashlib.sha256()
+    for document in documents:
+        data = str(document).encode("utf-8")
+        # Prefix each document with its length so that boundaries are part of the hash
+        digest.update(len(data).to_bytes(8, "little"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+# Class: FeatureStore(cache_dir=None)
+# cache_dir: OPTIONAL; directory used to persist the features between runs (memory only if None)
+#
+# Each entry is addressed by a kind (e.g. "w2v", "tfidf-train"), the documents it
+# was computed from and a version string.  Entries requested with persist=False
+# (e.g. when the version only identifies an object of the current process) are
+# only kept in memory for the lifetime of the process.
+class FeatureStore:
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self.memory = {}
+        self.hits = 0
+        self.misses = 0
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    # The key of an entry, combining kind, version and the documents hash
+    def key(self, kind, documents, version):
+        digest = hashlib.sha256()
+        digest.update(kind.encode("utf-8"))
+        digest.update(b"\0" + str(version).encode("utf-8") + b"\0")
+        digest.update(hash_documents(documents).encode("ascii"))
+        return "{0}-{1}".format(kind, digest.hexdigest()[:32])
+
+    def _path(self, key, extension):
+        return os.path.join(self.cache_dir, key + extension)
+
+    def _persistent(self, persist):
+        return self.cache_dir is not None and persist
+
+    # Function: get_dense(kind, documents, version, compute, persist=True)
+    # compute: A function of no arguments returning the numpy matrix when it is not cached
+    # Returns: The cached or freshly computed numpy matrix
+    def get_dense(self, kind, documents, version, compute, persist=True):
+        key = self.key(kind, documents, version)
+        if key in self.memory:
+            self.hits += 1
+            return self.memory[key]
+
+        if self._persistent(persist) and os.path.isfile(self._path(key, ".npy")):
+            self.hits += 1
+            matrix = np.load(self._path(key, ".npy"))
+        else:
+            self.misses += 1
+            matrix = np.asarray(compute())
+            if self._persistent(persist):
+                np.save(self._path(key, ".npy"), matrix)
+
+        self.memory[key] = matrix
+        return matrix
+
+    # Function: get_sparse(kind, documents, version, compute, persist=True)
+    # compute: A function of no arguments returning the scipy sparse matrix when it is not cached
+    # Returns: The cached or freshly computed matrix, in CSR format
+    def get_sparse(self, kind, documents, version, compute, persist=True):
+        key = self.key(kind, documents, version)
+        if key in self.memory:
+            self.hits += 1
+            return self.memory[key]
+
+        if self._persistent(persist) and os.path.isfile(self._path(key, ".npz")):
+            self.hits += 1
+            matrix = sparse.load_npz(self._path(key, ".npz")).tocsr()
+        else:
+            self.misses += 1
+            matrix = sparse.csr_matrix(compute())
+            if self._persistent(persist):
+                sparse.save_npz(self._path(key, ".npz"), matrix)
+
+        self.memory[key] = matrix
+        return matrix
+
+    # Function: get_arrays(kind, documents, version, persist=True)
+    # Returns: A dictionary of named numpy arrays stored with put_arrays, or None if there is no such entry
+    def get_arrays(self, kind, documents, version, persist=True):
+        key = self.key(kind, documents, version)
+        if key in self.memory:
+            self.hits += 1
+            return self.memory[key]
+        if self._persistent(persist) and os.path.isfile(self._path(key, ".npz")):
+            self.hits += 1
+            with np.load(self._path(key, ".npz"), allow_pickle=False) as archive:
+                arrays = {name: archive[name] for name in archive.files}
+            self.memory[key] = arrays
+            return arrays
+        self.misses += 1
+        return None
+
+    # Function: put_arrays(kind, documents, version, arrays, persist=True)
+    # arrays: A dictionary of named numpy arrays
+    def put_arrays(self, kind, documents, version, arrays, persist=True):
+        key = self.key(kind, documents, version)
+        self.memory[key] = arrays
+        if self._persistent(persist):
+            np.savez(self._path(key, ".npz"), **arrays)
+
+    # Drop the in-memory entries; files on disk are kept
+    def clear_memory(self):
+        self.memory.clear()
+
+    def __repr__(self):
+        return "FeatureStore({0!r}, entries={1}, hits={2}, misses={3})".format(
+            self.cache_dir, len(self.memory), self.hits, self.misses)
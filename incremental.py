@@ -0,0 +1,191 @@
+# Out-of-core incremental training
+#
+# train_model_tfidf and train_model_w2v fit a model on the whole training
+# matrix at once, so the matrix (and, for TF-IDF, the corpus used to fit the
+# vectorizer) must fit in memory.  The helpers below train models implementing
+# partial_fit batch by batch from a stream of documents, e.g. the batches of
+# data_stream.iter_batches, so memory only depends on the batch size and the
+# number of features:
+#   - GaussianNB, and SGDClassifier with the logistic ("log_loss") or hinge loss
+#     as incremental counterparts of LogisticRegression and LinearSVC;
+#   - StreamingTfidf computes TF-IDF features in two passes: the first one only
+#     counts document frequencies, the second one transforms batch by batch.  The
+#     "vocabulary" strategy builds the exact vocabulary of vectorize_train; the
+#     "hashing" strategy hashes tokens into a fixed number of columns, so its
+#     state never grows with the corpus.
+#
+# The stream is given as a function returning a new iterator of (documents,
+# labels) batches, since the TF-IDF pass and every training epoch read it again:
+#   make_batches = lambda: iter_batches("dataset.csv", batch_size=5000)
+# =========================================================================================================
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.linear_model import SGDClassifier
+from sklearn.naive_bayes import GaussianNB
+from sklearn.preprocessing import normalize
+from sklearn.utils.sparsefuncs import incr_mean_variance_axis
+
+from sparse_models import accepts_sparse, iter_dense_chunks
+
+
+# Default number of columns of the "hashing" TF-IDF strategy
+HASHING_FEATURES = 2 ** 18
+
+STREAMING_TFIDF_STRATEGIES = ("vocabulary", "hashing")
+
+
+# Function: instantiate_incremental_models()
+# This function does not take any input
+# Returns: Three instantiated machine learning models supporting partial_fit
+#
+# The SGD models optimize the same losses as LogisticRegression and LinearSVC,
+# with the same random_state as instantiate_models.
+def instantiate_incremental_models():
+    nb = GaussianNB()
+    sgd_logistic = SGDClassifier(loss="log_loss", random_state=100)
+    sgd_svm = SGDClassifier(loss="hinge", random_state=100)
+
+    return nb, sgd_logistic, sgd_svm
+
+
+# Class: StreamingTfidf(tokenizer, strategy="vocabulary", n_features=HASHING_FEATURES)
+# tokenizer: The tokenizer, a function from a string to a list of tokens (e.g. get_tokens)
+# strategy: "vocabulary" or "hashing"
+# n_features: Number of columns of the "hashing" strategy
+#
+# TF-IDF vectorizer fitted on a stream of documents, with the weighting of
+# TfidfVectorizer (lowercase, smooth idf, l2 normalization).  With the
+# "vocabulary" strategy, fit() then transform() give the vectorizer and
+# features of vectorize_train on the concatenated documents.
+class StreamingTfidf:
+    def __init__(self, tokenizer, strategy="vocabulary", n_features=HASHING_FEATURES):
+        if strategy not in STREAMING_TFIDF_STRATEGIES:
+            raise ValueError("Unknown TF-IDF strategy {0!r}, expected one of {1}".format(strategy, STREAMING_TFIDF_STRATEGIES))
+        self.tokenizer = tokenizer
+        self.strategy = strategy
+        self.n_features = n_features
+        self.vectorizer = None
+        self.n_documents = 0
+
+    # Function: fit(batches)
+    # batches: An iterable of (documents, labels) pairs; only the documents are read
+    # Returns: The fitted StreamingTfidf
+    #
+    # One pass over the stream counting document frequencies: per term with the
+    # "vocabulary" strategy, per hashed column with the "hashing" strategy.
+    def fit(self, batches):
+        self.n_documents = 0
+        if self.strategy == "hashing":
+            self.vectorizer = HashingVectorizer(tokenizer=self.tokenizer, lowercase=True, token_pattern=None,
+                                                n_features=self.n_features, alternate_sign=False, norm=None)
+            document_frequency = np.zeros(self.n_features, dtype=np.int64)
+            for documents, _ in batches:
+                counts = self.vectorizer.transform(documents)
+                counts.sum_duplicates()
+                document_frequency += np.bincount(counts.indices, minlength=self.n_features)
+                self.n_documents += len(documents)
+            self.idf_ = self._idf(document_frequency)
+            return self
+
+        document_frequency = {}
+        for documents, _ in batches:
+            for document in documents:
+                for term in set(self.tokenizer(document.lower())):
+                    document_frequency[term] = document_frequency.get(term, 0) + 1
+            self.n_documents += len(documents)
+
+        terms = sorted(document_frequency)
+        self.vectorizer = TfidfVectorizer(tokenizer=self.tokenizer, lowercase=True, token_pattern=None)
+        self.vectorizer.vocabulary_ = {term: column for column, term in enumerate(terms)}
+        self.vectorizer.idf_ = self._idf(np.array([document_frequency[term] for term in terms], dtype=np.int64))
+        return self
+
+    # Smooth idf, as computed by TfidfTransformer
+    def _idf(self, document_frequency):
+        return np.log((1 + self.n_documents) / (1 + document_frequency)) + 1
+
+    # Function: transform(documents)
+    # documents: A list of strings
+    # Returns: The (len(documents), n_columns) TF-IDF CSR matrix of documents
+    def transform(self, documents):
+        if self.strategy == "vocabulary":
+            return self.vectorizer.transform(documents)
+        counts = self.vectorizer.transform(documents).astype(np.float64)
+        return normalize(counts @ sparse.diags(self.idf_), norm="l2", copy=False)
+
+    def __repr__(self):
+        return "StreamingTfidf(strategy={0!r}, documents={1})".format(self.strategy, self.n_documents)
+
+
+# Function: partial_fit_batches(model, featurize, batches, classes=(0, 1))
+# model: An instantiated machine learning model implementing partial_fit
+# featurize: A function from a list of documents to their feature matrix (e.g. StreamingTfidf.transform)
+# batches: An iterable of (documents, labels) pairs
+# classes: All labels the stream can contain
+# Returns: The model, updated with one pass over the batches
+#
+# Dense-only models (GaussianNB) receive every batch as bounded dense blocks of
+# rows (see sparse_models.iter_dense_chunks).  GaussianNB's variance smoothing
+# is derived from the variance of all the data, like in fit(): it is disabled
+# during the pass and applied at the end from running per-feature variances.
+def partial_fit_batches(model, featurize, batches, classes=(0, 1)):
+    classes = np.asarray(classes)
+    is_gaussian_nb = isinstance(model, GaussianNB)
+    dense_only = not accepts_sparse(model)
+    if is_gaussian_nb:
+        var_smoothing = model.var_smoothing
+        model.set_params(var_smoothing=0.0)
+        if hasattr(model, "epsilon_"):
+            # Remove the smoothing of previous passes before updating the variances
+            model.var_[:, :] -= model.epsilon_
+        mean, variance, count = None, None, None
+
+    try:
+        for documents, labels in batches:
+            matrix = featurize(documents)
+            labels = np.asarray(labels)
+            if is_gaussian_nb:
+                mean, variance, count = _update_moments(matrix, mean, variance, count)
+            if dense_only:
+                for start, stop, block in iter_dense_chunks(matrix):
+                    model.partial_fit(block, labels[start:stop], classes=classes)
+            else:
+                model.partial_fit(matrix, labels, classes=classes)
+    finally:
+        if is_gaussian_nb:
+            model.set_params(var_smoothing=var_smoothing)
+
+    if is_gaussian_nb and variance is not None:
+        # Smoothing of the data seen by this pass; later passes over the same stream give the same value
+        model.epsilon_ = var_smoothing * np.max(variance)
+        model.var_[:, :] += model.epsilon_
+
+    return model
+
+
+# Running per-feature mean and variance of the rows seen so far
+def _update_moments(matrix, mean, variance, count):
+    matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+    if mean is None:
+        mean = np.zeros(matrix.shape[1])
+        variance = np.zeros(matrix.shape[1])
+        count = np.zeros(matrix.shape[1], dtype=np.int64)
+    return incr_mean_variance_axis(matrix, axis=0, last_mean=mean, last_var=variance, last_n=count)
+
+
+# Function: train_incremental(model, featurize, make_batches, classes=(0, 1), epochs=1)
+# model: An instantiated machine learning model implementing partial_fit
+# featurize: A function from a list of documents to their feature matrix
+# make_batches: A function of no arguments returning a new iterable of (documents, labels) pairs
+# classes: All labels the stream can contain
+# epochs: Number of passes over the stream (GaussianNB is fitted in a single pass)
+# Returns: A trained version of the input model
+def train_incremental(model, featurize, make_batches, classes=(0, 1), epochs=1):
+    if isinstance(model, GaussianNB):
+        # Further passes would count every document again
+        epochs = 1
+    for _ in range(epochs):
+        model = partial_fit_batches(model, featurize, make_batches(), classes)
+    return model
@@ -0,0 +1,101 @@
+# Micro-batching inference scheduler
+#
+# sentiment_analysis_state embeds one message and calls model.predict on a single
+# row, so concurrent sessions of chatbot_server.py make one embedding lookup and
+# one predict call each.  The sklearn models predict a stacked matrix for about
+# the price of a single row, so InferenceScheduler gathers the requests that
+# arrive together and runs them as one batch:
+#   - submit(item) queues the item and waits for its own result;
+#   - the queue is flushed when it holds max_batch items, or max_wait_ms after
+#     its first item arrived, whichever comes first;
+#   - every batch runs predict_batch(items) once, in an executor so the event
+#     loop is never blocked, and hands each caller the result at its position.
+#
+# max_batch=1 disables batching; max_wait_ms bounds the latency added to the
+# first request of a batch.  Run "python benchmarks.py batching" for the p50/p99
+# latency and the throughput of several settings.
+# =========================================================================================================
+
+import asyncio
+
+
+# Default largest batch, and longest wait for a batch to fill up
+MAX_BATCH = 32
+MAX_WAIT_MS = 2.0
+
+
+# Class: InferenceScheduler(predict_batch, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, executor=None)
+# predict_batch: A function from a list of items to the list (or array) of their results, in the same order
+# max_batch: Largest number of items predicted together
+# max_wait_ms: Longest time, in milliseconds, a queued item waits for more items
+# executor: OPTIONAL; The executor running predict_batch (the event loop's default executor when None)
+#
+# Used from coroutines of a single event loop:
+#   scheduler = InferenceScheduler(lambda texts: model.predict(embed(texts)))
+#   label = await scheduler.submit(text)
+class InferenceScheduler:
+    def __init__(self, predict_batch, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, executor=None):
+        if max_batch < 1:
+            raise ValueError("max_batch must be positive, got {0}".format(max_batch))
+        if max_wait_ms < 0:
+            raise ValueError("max_wait_ms must not be negative, got {0}".format(max_wait_ms))
+        self.predict_batch = predict_batch
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor
+        self.batches = 0
+        self.items = 0
+        self._pending = []
+        self._timer = None
+        self._running = set()
+
+    # Function: submit(item)
+    # item: An input of predict_batch, e.g. a user message
+    # Returns: The result of predict_batch for item, once its batch has run
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return await future
+
+    # Starts a batch with the queued items
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch):
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.predict_batch, [item for item, _ in batch])
+        except Exception as error:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    # Function: mean_batch_size()
+    # Returns: The average number of items per batch run so far
+    def mean_batch_size(self):
+        return self.items / self.batches if self.batches else 0.0
+
+    # Function: drain()
+    # This function runs the queued items now and waits for every running batch to finish
+    async def drain(self):
+        self._flush()
+        while self._running:
+            await asyncio.gather(*list(self._running), return_exceptions=True)
@@ -0,0 +1,351 @@
+# Per-stage latency instrumentation
+#
+# When a conversation feels slow, the time of every dialogue state and of the
+# steps inside it tells whether tokenization, the embedding lookup,
+# model.predict, POS tagging or summarize_analysis is responsible.  The code of
+# Part 3 marks these steps with
+#   with stage("sentiment/predict"):
+#       ...
+# or decorates a whole function with @timed("sentiment/predict").  The
+# recorded stages are:
+#   state/<state>           a dialogue state of run_chatbot or of the server,
+#                           without the time the user takes to answer
+#   io/wait                 every wait for an answer of the user (input() or
+#                           a line from the socket)
+#   sentiment/tokenize, sentiment/embed, sentiment/predict
+#                           the steps of predict_sentiment, sentiment/vectorize
+#                           instead of embed for TF-IDF models (sentiment_batch/...
+#                           for predict_sentiment_batch, timed per batch)
+#   stylistic/tokenize, stylistic/pos_tag, stylistic/count, stylistic/summarize
+#                           the steps of stylistic_correlates
+#
+# Instrumentation is off by default: stage() then returns a shared no-op context
+# manager and timed() calls the function directly, which costs well under a
+# microsecond per call.  Once enabled, every stage is added to a histogram with
+# logarithmic buckets (BUCKETS_PER_OCTAVE per doubling of the duration), which
+# keeps the count, sum, minimum and maximum and estimates the p50 and p99.
+# The histograms can be exported:
+#   - to a JSON file, written when the process exits:
+#       CHATBOT_METRICS=metrics.json python project_p3.py
+#       python chatbot_server.py --metrics metrics.json
+#   - over HTTP in the Prometheus text format (/metrics) or as JSON (/metrics.json):
+#       CHATBOT_METRICS_PORT=9421 python project_p3.py
+#       python chatbot_server.py --metrics-port 9421
+# and printed as a table with:
+#   python instrumentation.py metrics.json
+# Stages run by the worker processes of chatbot_server --jobs are recorded in
+# those processes and are not exported.
+# =========================================================================================================
+
+import atexit
+import functools
+import json
+import math
+import os
+import threading
+import time
+
+
+# Environment variables enabling the instrumentation when this module is imported
+METRICS_FILE_ENV = "CHATBOT_METRICS"
+METRICS_PORT_ENV = "CHATBOT_METRICS_PORT"
+
+# Address of the HTTP endpoint
+METRICS_HOST = "127.0.0.1"
+
+# Histogram buckets: the first one ends at MIN_BUCKET_SECONDS, every following
+# one is 2 ** (1 / BUCKETS_PER_OCTAVE) times longer, up to MAX_BUCKET_SECONDS
+MIN_BUCKET_SECONDS = 1e-6
+MAX_BUCKET_SECONDS = 100.0
+BUCKETS_PER_OCTAVE = 2
+BUCKET_BOUNDS = tuple(MIN_BUCKET_SECONDS * 2 ** (i / BUCKETS_PER_OCTAVE)
+                      for i in range(int(math.ceil(BUCKETS_PER_OCTAVE * math.log2(MAX_BUCKET_SECONDS / MIN_BUCKET_SECONDS))) + 1))
+
+# Name of the histogram in the Prometheus export
+PROMETHEUS_METRIC = "chatbot_stage_seconds"
+
+
+# Class: Histogram()
+#
+# The durations of one stage.  counts[i] is the number of durations up to
+# BUCKET_BOUNDS[i] (and above BUCKET_BOUNDS[i - 1]); the last count is for the
+# durations above MAX_BUCKET_SECONDS.
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    # Function: observe(seconds)
+    # seconds: A duration
+    def observe(self, seconds):
+        if seconds <= MIN_BUCKET_SECONDS:
+            bucket = 0
+        else:
+            bucket = min(int(math.ceil(BUCKETS_PER_OCTAVE * math.log2(seconds / MIN_BUCKET_SECONDS))), len(BUCKET_BOUNDS))
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    # Function: percentile(q)
+    # q: A percentile between 0 and 100
+    # Returns: An estimate of the q-th percentile in seconds, interpolated geometrically within the
+    #          bucket holding it and kept within the observed minimum and maximum
+    def percentile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                break
+            seen += count
+        lower = max(BUCKET_BOUNDS[bucket - 1] if bucket else 0.0, self.min)
+        upper = min(BUCKET_BOUNDS[bucket] if bucket < len(BUCKET_BOUNDS) else self.max, self.max)
+        if lower <= 0.0 or lower >= upper:
+            return upper
+        return lower * (upper / lower) ** ((rank - seen) / count)
+
+    # Function: summary()
+    # Returns: A dictionary with the count, and the sum, mean, min, max, p50 and p99 in milliseconds
+    def summary(self):
+        return {
+            "count": self.count,
+            "sum_ms": 1000 * self.total,
+            "mean_ms": 1000 * self.total / self.count if self.count else 0.0,
+            "min_ms": 1000 * self.min if self.count else 0.0,
+            "max_ms": 1000 * self.max,
+            "p50_ms": 1000 * self.percentile(50),
+            "p99_ms": 1000 * self.percentile(99),
+        }
+
+
+# Class: MetricsRegistry()
+#
+# The histograms of all stages, shared by the threads of the process.
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    # Function: observe(name, seconds)
+    # name: The name of the stage
+    # seconds: Its duration
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    # Function: snapshot()
+    # Returns: A dictionary from every stage name to its Histogram.summary(), by name
+    def snapshot(self):
+        with self._lock:
+            return {name: self.histograms[name].summary() for name in sorted(self.histograms)}
+
+    # Function: to_json()
+    # Returns: The metadata and the snapshot of the registry, as a dictionary
+    def to_json(self):
+        return {"pid": os.getpid(), "started": self.started, "written": time.time(), "stages": self.snapshot()}
+
+    # Function: to_prometheus()
+    # Returns: The histograms in the Prometheus text exposition format
+    def to_prometheus(self):
+        lines = ["# HELP {0} Duration of the chatbot stages".format(PROMETHEUS_METRIC),
+                 "# TYPE {0} histogram".format(PROMETHEUS_METRIC)]
+        with self._lock:
+            for name in sorted(self.histograms):
+                histogram = self.histograms[name]
+                label = 'stage="{0}"'.format(name.replace("\\", "\\\\").replace('"', '\\"'))
+                cumulative = 0
+                for bound, count in zip(BUCKET_BOUNDS, histogram.counts):
+                    cumulative += count
+                    lines.append('{0}_bucket{{{1},le="{2:.6g}"}} {3}'.format(PROMETHEUS_METRIC, label, bound, cumulative))
+                lines.append('{0}_bucket{{{1},le="+Inf"}} {2}'.format(PROMETHEUS_METRIC, label, histogram.count))
+                lines.append("{0}_sum{{{1}}} {2!r}".format(PROMETHEUS_METRIC, label, histogram.total))
+                lines.append("{0}_count{{{1}}} {2}".format(PROMETHEUS_METRIC, label, histogram.count))
+        return "\n".join(lines) + "\n"
+
+
+# The registry of the process, None while the instrumentation is disabled
+_registry = None
+
+
+# The context manager returned by stage() while the instrumentation is disabled
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+# Times the body of a with statement into a registry
+class _Stage:
+    __slots__ = ("registry", "name", "start")
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+# Function: is_enabled()
+# Returns: True if the stages are being recorded
+def is_enabled():
+    return _registry is not None
+
+
+# Function: stage(name)
+# name: The name of the stage, e.g. "sentiment/predict"
+# Returns: A context manager timing its body, or a no-op one while the instrumentation is disabled
+def stage(name):
+    registry = _registry
+    return _NULL_STAGE if registry is None else _Stage(registry, name)
+
+
+# Function: record(name, seconds)
+# name: The name of the stage
+# seconds: A duration measured by the caller; ignored while the instrumentation is disabled
+def record(name, seconds):
+    registry = _registry
+    if registry is not None:
+        registry.observe(name, seconds)
+
+
+# Function: timed(name)
+# name: The name of the stage
+# Returns: A decorator timing every call of the decorated function as the stage name
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            registry = _registry
+            if registry is None:
+                return function(*args, **kwargs)
+            with _Stage(registry, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Function: snapshot()
+# Returns: The summary of every recorded stage (see MetricsRegistry.snapshot), empty while disabled
+def snapshot():
+    registry = _registry
+    return registry.snapshot() if registry is not None else {}
+
+
+# Function: write_metrics(fname)
+# fname: The JSON file to write; replaced atomically
+def write_metrics(fname):
+    registry = _registry
+    if registry is None:
+        return
+    with open(fname + ".tmp", "w", encoding="utf-8") as fout:
+        json.dump(registry.to_json(), fout, indent=2)
+    os.replace(fname + ".tmp", fname)
+
+
+# Function: serve_metrics(port, host=METRICS_HOST)
+# port: The TCP port of the endpoint (0 picks a free port)
+# host: OPTIONAL; The address to listen on
+# Returns: The HTTPServer, serving /metrics and /metrics.json from a daemon thread
+def serve_metrics(port, host=METRICS_HOST):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            registry = _registry or MetricsRegistry()
+            if self.path == "/metrics":
+                body, content_type = registry.to_prometheus(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(registry.to_json()), "application/json"
+            else:
+                self.send_error(404)
+                return
+            body = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="chatbot-metrics", daemon=True).start()
+    return server
+
+
+# Function: enable(fname=None, port=None, host=METRICS_HOST)
+# fname: OPTIONAL; A JSON file the metrics are written to when the process exits
+# port: OPTIONAL; A TCP port to serve the metrics on
+# host: OPTIONAL; The address of the HTTP endpoint
+# Returns: The HTTPServer of the endpoint, or None
+#
+# Starts recording the stages; enabling again keeps the histograms recorded so far.
+def enable(fname=None, port=None, host=METRICS_HOST):
+    global _registry
+    if _registry is None:
+        _registry = MetricsRegistry()
+    if fname is not None:
+        atexit.register(write_metrics, fname)
+    return serve_metrics(port, host) if port is not None else None
+
+
+# Function: disable()
+# Returns: The MetricsRegistry recorded so far, or None; the stages are no longer recorded
+def disable():
+    global _registry
+    registry, _registry = _registry, None
+    return registry
+
+
+# Function: format_report(stages)
+# stages: A dictionary from stage names to summaries, as returned by snapshot()
+# Returns: The lines of a table of the stages, by name
+def format_report(stages):
+    lines = ["{0:<28} {1:>8} {2:>12} {3:>10} {4:>10} {5:>10}".format("stage", "count", "total ms", "mean ms", "p50 ms", "p99 ms")]
+    for name, summary in stages.items():
+        lines.append("{0:<28} {1:>8} {2:12.2f} {3:10.3f} {4:10.3f} {5:10.3f}".format(
+            name, summary["count"], summary["sum_ms"], summary["mean_ms"], summary["p50_ms"], summary["p99_ms"]))
+    return lines
+
+
+if os.environ.get(METRICS_FILE_ENV) or os.environ.get(METRICS_PORT_ENV):
+    enable(os.environ.get(METRICS_FILE_ENV) or None,
+           int(os.environ[METRICS_PORT_ENV]) if os.environ.get(METRICS_PORT_ENV) else None)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Print the stage latencies written by the chatbot")
+    parser.add_argument("metrics", help="JSON file written with CHATBOT_METRICS or --metrics")
+    args = parser.parse_args()
+
+    with open(args.metrics, "r", encoding="utf-8") as fin:
+        metrics = json.load(fin)
+    for line in format_report(metrics["stages"]):
+        print(line)
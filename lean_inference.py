@@ -0,0 +1,177 @@
+# Lean inference runtime
+#
+# Importing project_p3 imports pandas, every scikit-learn classifier, the
+# metrics module and NLTK before the chatbot can answer a single message, which
+# dominates the start-up of short-lived worker processes.  Predicting with a
+# trained Word2Vec model only needs its weights and the embeddings, so:
+#   - export_lean_model() saves the weights of a LogisticRegression, LinearSVC
+#     or MLPClassifier as plain numpy arrays (float32 by default) in an .npz
+#     file, together with the location and checksum of its embedding store;
+#   - load_lean_model() reads them back, without scikit-learn or pandas, and
+#     returns a LeanModel whose predict_messages() tokenizes like get_tokens of
+#     Part 3, averages the embeddings like string2vec and runs the forward pass
+#     with numpy.
+# A linear model is a network of a single layer.  Binary models predict the
+# second class when the last output is positive (for an MLP, when its logistic
+# output is above 0.5), other models the class of the largest output.
+#
+#   python lean_inference.py export svm_w2v_bundle svm_w2v_lean.npz
+#   python lean_inference.py predict svm_w2v_lean.npz "What a wonderful day"
+# Run "python benchmarks.py lean" to compare the labels, the import time and the
+# first prediction latency with project_p3.
+# =========================================================================================================
+
+import numpy as np
+
+from embedding_store import load_embedding_store
+
+
+LEAN_FORMAT = 1
+
+# Type of the exported weights
+WEIGHT_DTYPE = np.float32
+
+# Hidden layer activations of MLPClassifier
+ACTIVATIONS = {
+    "identity": lambda x: x,
+    "logistic": lambda x: 1.0 / (1.0 + np.exp(-x)),
+    "tanh": np.tanh,
+    "relu": lambda x: np.maximum(x, 0),
+}
+
+
+# Function: model_layers(model)
+# model: A trained LogisticRegression, LinearSVC or MLPClassifier
+# Returns: The list of (weights, biases) of its layers, the weights of shape (n_in, n_out), and its hidden activation
+def model_layers(model):
+    if hasattr(model, "coefs_"):
+        return list(zip(model.coefs_, model.intercepts_)), model.activation
+    if hasattr(model, "coef_"):
+        return [(np.asarray(model.coef_).T, np.ravel(model.intercept_))], "identity"
+    raise ValueError("Only LogisticRegression, LinearSVC and MLPClassifier models can be exported, "
+                     "got {0}".format(type(model).__name__))
+
+
+# Function: export_lean_model(fname, model, word2vec, dtype=WEIGHT_DTYPE)
+# fname: The .npz file to write
+# model: A LogisticRegression, LinearSVC or MLPClassifier trained on averaged Word2Vec embeddings
+# word2vec: The EmbeddingStore the model was trained with
+# dtype: OPTIONAL; Type of the saved weights
+# Returns: fname
+def export_lean_model(fname, model, word2vec, dtype=WEIGHT_DTYPE):
+    layers, activation = model_layers(model)
+    arrays = {
+        "format": np.array(LEAN_FORMAT),
+        "model": np.array(type(model).__name__),
+        "activation": np.array(activation),
+        "classes": np.asarray(model.classes_),
+        "n_layers": np.array(len(layers)),
+        "store_dir": np.array(word2vec.store_dir),
+        "store_checksum": np.array(word2vec.version),
+    }
+    for i, (weights, biases) in enumerate(layers):
+        arrays["weights_{0}".format(i)] = np.asarray(weights, dtype=dtype)
+        arrays["biases_{0}".format(i)] = np.asarray(biases, dtype=dtype)
+    with open(fname, "wb") as fout:
+        np.savez(fout, **arrays)
+    return fname
+
+
+# Class: LeanModel(layers, activation, classes, word2vec)
+# layers: A list of (weights, biases) numpy arrays, the weights of shape (n_in, n_out)
+# activation: The name of the hidden layer activation, a key of ACTIVATIONS
+# classes: The labels of the model
+# word2vec: The EmbeddingStore of the model
+class LeanModel:
+    def __init__(self, layers, activation, classes, word2vec):
+        self.layers = layers
+        self.activation = ACTIVATIONS[activation]
+        self.classes = np.asarray(classes)
+        self.word2vec = word2vec
+        self.dtype = layers[0][0].dtype
+
+    # Function: embed(messages)
+    # messages: A list of strings
+    # Returns: A (len(messages), dim) matrix of the string2vec embeddings of the messages, in the type of the weights
+    #
+    # Unknown tokens add nothing to the sum but count in the average, like the
+    # zero vector of w2v(); the sum is accumulated in float64 like np.mean.
+    def embed(self, messages):
+        index = self.word2vec.index
+        vectors = self.word2vec.vectors
+        embeddings = np.zeros((len(messages), vectors.shape[1]), dtype=np.float64)
+        for i, message in enumerate(messages):
+            tokens = message.split()
+            rows = [index[token] for token in tokens if token in index]
+            if rows:
+                embeddings[i] = vectors[rows].sum(axis=0, dtype=np.float64) / len(tokens)
+        return embeddings.astype(self.dtype)
+
+    # Function: forward(features)
+    # features: A (n, n_in) matrix
+    # Returns: The (n, n_out) outputs of the last layer, before its output activation
+    def forward(self, features):
+        output = features
+        for i, (weights, biases) in enumerate(self.layers):
+            if i:
+                output = self.activation(output)
+            output = output @ weights + biases
+        return output
+
+    # Function: predict(features)
+    # features: A (n, n_in) matrix
+    # Returns: A numpy array holding the label of every row
+    def predict(self, features):
+        output = self.forward(features)
+        if output.shape[1] == 1:
+            return self.classes[(output[:, 0] > 0).astype(np.int64)]
+        return self.classes[np.argmax(output, axis=1)]
+
+    # Function: predict_messages(messages)
+    # messages: A list of strings
+    # Returns: A numpy array holding the label of every message, like predict_sentiment_batch of Part 3
+    def predict_messages(self, messages):
+        return self.predict(self.embed(messages))
+
+
+# Function: load_lean_model(fname, store_dir=None)
+# fname: An .npz file written by export_lean_model
+# store_dir: OPTIONAL; The embedding store to use instead of the one recorded at export
+# Returns: A LeanModel; raises ValueError if the embedding store changed since the export
+def load_lean_model(fname, store_dir=None):
+    with np.load(fname) as arrays:
+        if int(arrays["format"]) != LEAN_FORMAT:
+            raise ValueError("Unsupported lean model format in {0}: {1}".format(fname, int(arrays["format"])))
+        layers = [(arrays["weights_{0}".format(i)], arrays["biases_{0}".format(i)]) for i in range(int(arrays["n_layers"]))]
+        word2vec = load_embedding_store(store_dir or str(arrays["store_dir"]))
+        if word2vec.version != str(arrays["store_checksum"]):
+            raise ValueError("The embedding store {0} changed since {1} was exported".format(word2vec.store_dir, fname))
+        return LeanModel(layers, str(arrays["activation"]), arrays["classes"], word2vec)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export a Word2Vec model bundle to numpy weights, or predict with them")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="export the model of a bundle")
+    export_parser.add_argument("bundle_dir", help="model bundle directory, e.g. svm_w2v_bundle")
+    export_parser.add_argument("output", help=".npz file to write, e.g. svm_w2v_lean.npz")
+    export_parser.add_argument("--dtype", choices=["float32", "float64"], default=np.dtype(WEIGHT_DTYPE).name,
+                               help="type of the exported weights")
+    predict_parser = subparsers.add_parser("predict", help="predict the sentiment of messages")
+    predict_parser.add_argument("model", help=".npz file written by export")
+    predict_parser.add_argument("messages", nargs="+", help="messages to classify")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        # Only the exporter needs scikit-learn, to unpickle the bundle
+        from model_bundle import load_bundle
+        bundle = load_bundle(args.bundle_dir)
+        if bundle.word2vec is None:
+            parser.error("{0} is not a Word2Vec model bundle".format(args.bundle_dir))
+        print("Wrote {0}".format(export_lean_model(args.output, bundle.model, bundle.word2vec, np.dtype(args.dtype))))
+    else:
+        lean_model = load_lean_model(args.model)
+        for message, label in zip(args.messages, lean_model.predict_messages(args.messages)):
+            print("{0}\t{1}".format(label, message))
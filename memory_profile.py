@@ -0,0 +1,245 @@
+# Per-stage memory profile of the training pipeline
+#
+# The training path of Part 1 allocates large objects that are easy to miss:
+# the document lists, the embeddings, the TF-IDF and Word2Vec matrices, and
+# whatever a model copies while it fits or predicts.  A MemoryProfiler measures,
+# for every stage of the pipeline:
+#   - the peak of the Python and numpy allocations above the memory in use when
+#     the stage started, and the part still allocated when it ends (tracemalloc);
+#   - the resident set size (RSS) of the process at the end of the stage, its
+#     change during the stage, and its peak during the stage.  The RSS also
+#     counts memory-mapped files, such as the embedding store, that tracemalloc
+#     does not see.  The peak is read from /proc/self/status and reset at the
+#     start of every stage through /proc/self/clear_refs (Linux); elsewhere it
+#     is the peak of the whole process so far.
+# Stages can be nested, also across profilers: the peaks of a stage include those
+# of its inner stages.  tracemalloc and the peak RSS belong to the process, so
+# the stack of running stages is shared by all the profilers of a process.
+#
+# Profiling is opt-in: set MEMORY_PROFILE in project_p1.py to a CSV file name
+# and its main function profiles load_as_list, open_embeddings (the embedding
+# store), the tokenization of dataset.csv, vectorize_train, the Word2Vec
+# features, and the fit and evaluation of every model.  The feature matrices are
+# computed, not loaded from the feature cache.  Once the models are trained,
+# load_w2v is profiled on its own, for the memory of the unpickled w2v.pkl
+# dictionary the store replaces.  The table is printed and written to that file,
+# which can be printed again with:
+#   python memory_profile.py memory_profile.csv
+# With TRAIN_JOBS, the fit and evaluation of a model are profiled in the worker
+# process that runs them.  A profiled run also measures the peak memory of every
+# model's prediction of the test set (evaluation.peak_memory), in a stage nested
+# in the evaluation stage of that model.
+# tracemalloc slows down Python allocations while it traces, so the timings of a
+# profiled run are not representative.
+# =========================================================================================================
+
+import contextlib
+import csv
+import os
+import sys
+import time
+import tracemalloc
+from typing import NamedTuple
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+MB = 1e6
+
+# Columns of the memory profile table
+PROFILE_HEADER = ["Stage", "Seconds", "Peak MB", "Retained MB", "RSS MB", "RSS Change MB", "Peak RSS MB"]
+
+
+# Class: StageMemory(stage, seconds, peak_mb, retained_mb, rss_mb, rss_change_mb, peak_rss_mb)
+# stage: The name of the stage
+# seconds: Wall-clock time of the stage
+# peak_mb: Largest traced allocation above the traced memory in use when the stage started
+# retained_mb: Traced memory still allocated at the end of the stage, above the same starting point
+# rss_mb, rss_change_mb: The resident set size at the end of the stage, and its change during the stage
+# peak_rss_mb: The largest resident set size during the stage (see the header of this file)
+#
+# The RSS columns are None where the operating system does not report them.
+class StageMemory(NamedTuple):
+    stage: str
+    seconds: float
+    peak_mb: float
+    retained_mb: float
+    rss_mb: float
+    rss_change_mb: float
+    peak_rss_mb: float
+
+
+# Function: current_rss()
+# Returns: The resident set size of the process in bytes, or None where /proc/self/statm is missing
+def current_rss():
+    try:
+        with open("/proc/self/statm", "r") as fin:
+            return int(fin.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+# Function: peak_rss()
+# Returns: The peak resident set size of the process in bytes since the last reset_peak_rss(), or None
+def peak_rss():
+    try:
+        with open("/proc/self/status", "r") as fin:
+            for line in fin:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+# Function: reset_peak_rss()
+# Returns: True if the peak resident set size was reset to the current one (Linux only)
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as fout:
+            fout.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _mb(value):
+    return None if value is None else value / MB
+
+
+# The running stages of all the profilers of the process, innermost last
+_frames = []
+
+
+# The measurements of a running stage
+class _Frame:
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.traced = tracemalloc.get_traced_memory()[0]
+        self.traced_peak = self.traced
+        self.rss = current_rss()
+        self.rss_peak = self.rss or 0
+
+
+# Class: MemoryProfiler(enabled=True)
+# enabled: OPTIONAL; False makes stage() a no-op, so that the profiled code runs unchanged
+#
+#   profiler = MemoryProfiler()
+#   with profiler.stage("vectorize_train"):
+#       vectorizer, tfidf_train = vectorize_train(documents)
+#   print("\n".join(profiler.table()))
+#
+# tracemalloc is started by the first stage if it is not tracing yet, and
+# stopped by close().
+class MemoryProfiler:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.records = []
+        self._started_tracing = False
+
+    # Function: stage(name)
+    # name: The name of the stage
+    # Returns: A context manager profiling its body; the StageMemory is added to records on exit
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+        # The peaks are reset for the new stage: keep the peaks reached so far by the enclosing one
+        if _frames:
+            _frames[-1].traced_peak = max(_frames[-1].traced_peak, tracemalloc.get_traced_memory()[1])
+            _frames[-1].rss_peak = max(_frames[-1].rss_peak, peak_rss() or 0)
+        tracemalloc.reset_peak()
+        reset_peak_rss()
+        frame = _Frame(name)
+        _frames.append(frame)
+        try:
+            yield
+        finally:
+            traced, traced_peak = tracemalloc.get_traced_memory()
+            rss = current_rss()
+            frame.traced_peak = max(frame.traced_peak, traced_peak)
+            frame.rss_peak = max(frame.rss_peak, peak_rss() or 0)
+            _frames.pop()
+            if _frames:
+                _frames[-1].traced_peak = max(_frames[-1].traced_peak, frame.traced_peak)
+                _frames[-1].rss_peak = max(_frames[-1].rss_peak, frame.rss_peak)
+
+            self.records.append(StageMemory(
+                name, time.perf_counter() - frame.start, _mb(frame.traced_peak - frame.traced),
+                _mb(traced - frame.traced), _mb(rss),
+                _mb(rss - frame.rss) if rss is not None and frame.rss is not None else None,
+                _mb(frame.rss_peak) if frame.rss_peak else None))
+
+    # Function: close()
+    # Stops tracemalloc if the profiler started it
+    def close(self):
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    # Function: table(records=None)
+    # records: OPTIONAL; A list of StageMemory (the records of this profiler by default)
+    # Returns: The lines of a table of the records, in the order the stages ended
+    def table(self, records=None):
+        return format_table(self.records if records is None else records)
+
+
+# Function: format_table(records)
+# records: A list of StageMemory
+# Returns: The lines of a table of the records
+def format_table(records):
+    def cell(value):
+        return "{0:12.1f}".format(value) if value is not None else "{0:>12}".format("N/A")
+
+    width = max([len(PROFILE_HEADER[0])] + [len(record.stage) for record in records])
+    lines = ["{0:<{1}} {2:>9} {3}".format(PROFILE_HEADER[0], width, PROFILE_HEADER[1],
+                                          " ".join("{0:>12}".format(column) for column in PROFILE_HEADER[2:]))]
+    for record in records:
+        lines.append("{0:<{1}} {2:9.2f} {3}".format(record.stage, width, record.seconds,
+                                                    " ".join(cell(value) for value in record[2:])))
+    return lines
+
+
+# Function: write_profile(fname, records)
+# fname: The CSV file to write
+# records: A list of StageMemory
+def write_profile(fname, records):
+    with open(fname, "w", newline="\n") as fout:
+        writer = csv.writer(fout)
+        writer.writerow(PROFILE_HEADER)
+        for record in records:
+            writer.writerow(["N/A" if value is None else value for value in record])
+
+
+# Function: read_profile(fname)
+# fname: A CSV file written by write_profile
+# Returns: The list of StageMemory
+def read_profile(fname):
+    with open(fname, "r", newline="") as fin:
+        rows = list(csv.reader(fin))[1:]
+    return [StageMemory(row[0], *[None if value == "N/A" else float(value) for value in row[1:]]) for row in rows]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Print the memory profile written by the main function of Part 1")
+    parser.add_argument("profile", help="CSV file named by MEMORY_PROFILE in project_p1.py")
+    args = parser.parse_args()
+
+    for line in format_table(read_profile(args.profile)):
+        print(line)
@@ -0,0 +1,156 @@
+# Versioned model bundles
+#
+# The chatbot of Part 3 only needs a trained classifier and the features it was
+# trained on, yet its main function used to reload dataset.csv and retrain the
+# model on every launch.  A model bundle saves the result of training once, in a
+# directory made of:
+#   model.pkl:      the fitted classifier
+#   vectorizer.pkl: the fitted TfidfVectorizer, for TF-IDF models only
+#   meta.json:      the bundle format, the scikit-learn version, the sha256 of the
+#                   training data, the embedding store used by Word2Vec models
+#                   (a reference to its directory and checksum, not a copy) and
+#                   the evaluation metrics measured when the bundle was saved
+#
+# load_bundle() checks the metadata before unpickling anything and raises
+# StaleBundleError when the bundle no longer matches the training data, the
+# embedding store or the installed scikit-learn, so an outdated model is never
+# served silently.  meta.json is written last: a bundle whose saving was
+# interrupted has no metadata and is treated as missing.
+# =========================================================================================================
+
+import json
+import os
+import pickle as pkl
+from typing import NamedTuple
+
+import sklearn
+
+from embedding_store import EmbeddingStore, hash_file, load_embedding_store
+
+
+BUNDLE_FORMAT = 1
+MODEL_FILE = "model.pkl"
+VECTORIZER_FILE = "vectorizer.pkl"
+META_FILE = "meta.json"
+
+
+# Raised by load_bundle when a bundle exists but cannot be used as is: it was
+# trained on other data, against another embedding store, or with another
+# version of the bundle format or of scikit-learn.  Retrain and save it again.
+class StaleBundleError(ValueError):
+    pass
+
+
+# Class: ModelBundle(model, vectorizer, word2vec, meta)
+# model: The fitted classifier
+# vectorizer: The fitted TfidfVectorizer, or None for Word2Vec models
+# word2vec: The EmbeddingStore of Word2Vec models, or None for TF-IDF models
+# meta: The dictionary read from meta.json
+class ModelBundle(NamedTuple):
+    model: object
+    vectorizer: object
+    word2vec: object
+    meta: dict
+
+
+# Write to a temporary file first so that a bundle file is never left half written
+def _dump(path, obj):
+    with open(path + ".tmp", "wb") as fout:
+        pkl.dump(obj, fout, protocol=pkl.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+
+def _load(path):
+    with open(path, "rb") as fin:
+        return pkl.load(fin)
+
+
+# Function: save_bundle(bundle_dir, model, dataset_file, vectorizer=None, word2vec=None, metrics=None)
+# bundle_dir: Directory to write the bundle into (created if needed)
+# model: The fitted classifier
+# dataset_file: The training data file, e.g. "dataset.csv"
+# vectorizer: OPTIONAL; The fitted TfidfVectorizer of a TF-IDF model
+# word2vec: OPTIONAL; The EmbeddingStore of a Word2Vec model
+# metrics: OPTIONAL; A dictionary of evaluation metrics to keep with the model
+# Returns: The metadata written to meta.json
+#
+# The vectorizer is pickled with a reference to its tokenizer function, so the
+# bundle must be loaded by a program defining that function under the same
+# name (e.g. project_p3.py for a vectorizer fitted in project_p3.py).
+def save_bundle(bundle_dir, model, dataset_file, vectorizer=None, word2vec=None, metrics=None):
+    if word2vec is not None and not isinstance(word2vec, EmbeddingStore):
+        raise ValueError("A bundle can only reference an EmbeddingStore, open w2v.pkl with open_embeddings() first")
+
+    os.makedirs(bundle_dir, exist_ok=True)
+    meta_path = os.path.join(bundle_dir, META_FILE)
+    if os.path.exists(meta_path):
+        # Invalidate the previous bundle until the new one is complete
+        os.remove(meta_path)
+
+    _dump(os.path.join(bundle_dir, MODEL_FILE), model)
+    if vectorizer is not None:
+        _dump(os.path.join(bundle_dir, VECTORIZER_FILE), vectorizer)
+    elif os.path.exists(os.path.join(bundle_dir, VECTORIZER_FILE)):
+        os.remove(os.path.join(bundle_dir, VECTORIZER_FILE))
+
+    meta = {
+        "format": BUNDLE_FORMAT,
+        "sklearn_version": sklearn.__version__,
+        "model": type(model).__name__,
+        "features": "tfidf" if vectorizer is not None else "w2v" if word2vec is not None else None,
+        "dataset": {"file": os.path.basename(dataset_file), "sha256": hash_file(dataset_file)},
+        "embedding_store": None if word2vec is None else {"path": word2vec.store_dir, "checksum": word2vec.version},
+        "metrics": dict(metrics or {}),
+    }
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as fout:
+        json.dump(meta, fout, indent=2)
+    os.replace(meta_path + ".tmp", meta_path)
+
+    return meta
+
+
+# Function: load_bundle(bundle_dir, dataset_file=None)
+# bundle_dir: Directory written by save_bundle
+# dataset_file: OPTIONAL; The training data file the bundle must have been trained on
+# Returns: A ModelBundle
+#
+# Raises FileNotFoundError if there is no complete bundle in bundle_dir, and
+# StaleBundleError if the bundle does not match dataset_file, its embedding
+# store or the installed versions.
+def load_bundle(bundle_dir, dataset_file=None):
+    with open(os.path.join(bundle_dir, META_FILE), "r", encoding="utf-8") as fin:
+        meta = json.load(fin)
+
+    if meta.get("format") != BUNDLE_FORMAT:
+        raise StaleBundleError("Unsupported model bundle format in {0}: {1}".format(bundle_dir, meta.get("format")))
+    if meta.get("sklearn_version") != sklearn.__version__:
+        raise StaleBundleError("Model bundle {0} was saved with scikit-learn {1}, {2} is installed".format(
+            bundle_dir, meta.get("sklearn_version"), sklearn.__version__))
+    if dataset_file is not None and hash_file(dataset_file) != meta["dataset"]["sha256"]:
+        raise StaleBundleError("Model bundle {0} was not trained on the current {1}".format(bundle_dir, dataset_file))
+
+    word2vec = None
+    if meta["embedding_store"] is not None:
+        word2vec = load_embedding_store(meta["embedding_store"]["path"])
+        if word2vec.version != meta["embedding_store"]["checksum"]:
+            raise StaleBundleError("The embedding store {0} changed since model bundle {1} was saved".format(
+                word2vec.store_dir, bundle_dir))
+
+    model = _load(os.path.join(bundle_dir, MODEL_FILE))
+    vectorizer = None
+    if meta["features"] == "tfidf":
+        vectorizer = _load(os.path.join(bundle_dir, VECTORIZER_FILE))
+
+    return ModelBundle(model, vectorizer, word2vec, meta)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Show the metadata of a model bundle")
+    parser.add_argument("bundle_dir", help="directory written by save_bundle, e.g. svm_w2v_bundle")
+    parser.add_argument("--dataset", help="training data file to check the bundle against, e.g. dataset.csv")
+    args = parser.parse_args()
+
+    bundle = load_bundle(args.bundle_dir, args.dataset)
+    print(json.dumps(bundle.meta, indent=2))
@@ -0,0 +1,148 @@
+# NLTK data resources
+#
+# Parts 2 and 3 used to call nltk.download('averaged_perceptron_tagger') and
+# nltk.download('punkt') when they were imported, so every import, including
+# the import of every worker process, checked the NLTK index and could try to
+# reach the network.
+#
+# require() looks a resource up the first time it is needed and remembers the
+# answer for the lifetime of the process.  Which package is needed depends on
+# the installed NLTK: recent releases read punkt_tab and
+# averaged_perceptron_tagger_eng, older ones the pickled punkt and
+# averaged_perceptron_tagger models.
+#
+# Offline installs: the resources can be downloaded once into a directory,
+#   python nltk_resources.py --download --dir nltk_bundle
+# and that directory given in the CHATBOT_NLTK_DATA environment variable, which
+# is searched before NLTK's default locations.  A missing resource is downloaded
+# on first use (into that directory, when it is set), unless
+# CHATBOT_NLTK_DOWNLOAD=0; then MissingResourceError explains how to install it.
+# =========================================================================================================
+
+import os
+import threading
+
+import nltk
+from nltk.tag import PerceptronTagger
+
+
+# Environment variable naming an offline directory of NLTK data
+DATA_DIR_ENV = "CHATBOT_NLTK_DATA"
+
+# Environment variable disabling downloads when set to "0"
+DOWNLOAD_ENV = "CHATBOT_NLTK_DOWNLOAD"
+
+
+# Function: _resources()
+# Returns: A dictionary from resource name to the (nltk.data path, package) the installed NLTK reads
+def _resources():
+    try:
+        from nltk.tokenize.punkt import PunktTokenizer  # noqa: F401
+        punkt = ("tokenizers/punkt_tab/english/", "punkt_tab")
+    except ImportError:
+        punkt = ("tokenizers/punkt/english.pickle", "punkt")
+    if hasattr(PerceptronTagger, "load_from_json"):
+        tagger = ("taggers/averaged_perceptron_tagger_eng/", "averaged_perceptron_tagger_eng")
+    else:
+        tagger = ("taggers/averaged_perceptron_tagger/averaged_perceptron_tagger.pickle", "averaged_perceptron_tagger")
+    return {"punkt": punkt, "tagger": tagger}
+
+
+# Resources used by the tokenizer and the POS tagger
+RESOURCES = _resources()
+
+# Paths of the resources found so far
+_found = {}
+_lock = threading.Lock()
+
+
+# Class: MissingResourceError(resource, package, data_dir)
+# resource: The name of the missing resource in RESOURCES
+# package: The NLTK package providing it
+# data_dir: The offline directory that was searched, or None
+class MissingResourceError(LookupError):
+    def __init__(self, resource, package, data_dir):
+        self.resource = resource
+        self.package = package
+        self.data_dir = data_dir
+        target = data_dir or "DIR"
+        super().__init__(
+            "NLTK resource {0!r} (package {1!r}) was not found in {2}. Install it with\n"
+            "  python nltk_resources.py --download --dir {3}\n"
+            "and run with {4}={3}.".format(resource, package, nltk.data.path, target, DATA_DIR_ENV))
+
+
+# Function: data_dir()
+# Returns: The offline directory of NLTK data given in CHATBOT_NLTK_DATA, or None
+def data_dir():
+    return os.environ.get(DATA_DIR_ENV) or None
+
+
+# Function: downloads_enabled()
+# Returns: False if CHATBOT_NLTK_DOWNLOAD is set to "0"
+def downloads_enabled():
+    return os.environ.get(DOWNLOAD_ENV, "1") != "0"
+
+
+def _find(path):
+    directory = data_dir()
+    if directory is not None and directory not in nltk.data.path:
+        nltk.data.path.insert(0, directory)
+    try:
+        return nltk.data.find(path)
+    except LookupError:
+        return None
+
+
+# Function: require(resource, download=None)
+# resource: A name of RESOURCES, "punkt" or "tagger"
+# download: OPTIONAL; Whether a missing resource is downloaded (downloads_enabled() by default)
+# Returns: The location of the resource; only the first call for a resource searches for it
+def require(resource, download=None):
+    location = _found.get(resource)
+    if location is not None:
+        return location
+
+    with _lock:
+        if resource in _found:
+            return _found[resource]
+        path, package = RESOURCES[resource]
+        location = _find(path)
+        if location is None and (downloads_enabled() if download is None else download):
+            print("NLTK resource {0!r} not found, downloading...".format(package))
+            nltk.download(package, download_dir=data_dir(), quiet=True)
+            location = _find(path)
+        if location is None:
+            raise MissingResourceError(resource, package, data_dir())
+        _found[resource] = location
+        return location
+
+
+# Function: require_all(download=None)
+# download: OPTIONAL; Whether missing resources are downloaded (downloads_enabled() by default)
+# Returns: A dictionary from every resource name to its location
+def require_all(download=None):
+    return {resource: require(resource, download) for resource in RESOURCES}
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Check, or download, the NLTK data used by the chatbot")
+    parser.add_argument("--download", action="store_true", help="download the missing resources")
+    parser.add_argument("--dir", help="directory to search and download into (default: " + DATA_DIR_ENV + ")")
+    args = parser.parse_args()
+
+    if args.dir:
+        os.environ[DATA_DIR_ENV] = args.dir
+    missing = 0
+    for name, (_, package) in RESOURCES.items():
+        try:
+            print("{0:<8} {1:<32} {2}".format(name, package, require(name, download=args.download)))
+        except MissingResourceError:
+            print("{0:<8} {1:<32} MISSING".format(name, package))
+            missing += 1
+    if missing:
+        print("Run with --download to install the missing resources.")
+    sys.exit(1 if missing else 0)
@@ -0,0 +1,161 @@
+# Process-pool helpers for feature extraction and training
+#
+# Tokenization and embedding averaging are independent per document, so a list
+# of documents can be cut into contiguous shards processed by a pool of worker
+# processes, and the per-shard results merged back in order (parallel_map).
+# Independent tasks of uneven length, such as training different models, are
+# handed out one at a time instead (parallel_apply).  A stream of tasks too long
+# to hold in memory, such as the batches of a large CSV file, is processed with
+# a bounded number of tasks in flight (parallel_imap).
+#
+# Large read-only objects (the Word2Vec embeddings, shared feature matrices) are
+# handed to the workers through the shared argument, read back in the workers
+# with parallel.shared(), not as task arguments, so they are not pickled with
+# every task:
+#   - with the "fork" start method the workers inherit the object from the parent
+#     process; an EmbeddingStore is memory-mapped, so its pages stay shared, while
+#     a plain dictionary is shared copy-on-write;
+#   - with other start methods the object is pickled once per worker; an
+#     EmbeddingStore pickles as its directory and is mapped again by each worker.
+# =========================================================================================================
+
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+
+# The object shared with the workers of the running pool
+_shared = None
+
+
+def _set_shared(value):
+    global _shared
+    _shared = value
+
+
+# Function: shared()
+# Returns: The object passed to parallel_map as shared, from inside a worker
+def shared():
+    return _shared
+
+
+# Function: resolve_n_jobs(n_jobs)
+# n_jobs: None or 1 for the serial path, a number of processes, or -1 for one per CPU
+# Returns: The number of processes to use
+def resolve_n_jobs(n_jobs):
+    if n_jobs is None:
+        return 1
+    if n_jobs < 0:
+        return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+    return max(1, n_jobs)
+
+
+# Function: shard(items, n_shards)
+# items: A list
+# n_shards: Number of shards wanted
+# Returns: A list of at most n_shards contiguous, non-empty slices of items, in order
+def shard(items, n_shards):
+    n_shards = max(1, min(n_shards, len(items)))
+    size, extra = divmod(len(items), n_shards)
+    shards, start = [], 0
+    for i in range(n_shards):
+        stop = start + size + (1 if i < extra else 0)
+        shards.append(items[start:stop])
+        start = stop
+    return [items_shard for items_shard in shards if len(items_shard) > 0]
+
+
+# Function: process_pool(n_workers, shared=None)
+# n_workers: Number of worker processes
+# shared: OPTIONAL; A read-only object the workers can read with parallel.shared()
+# Returns: A context manager yielding a ProcessPoolExecutor whose workers see shared
+@contextmanager
+def process_pool(n_workers, shared=None):
+    if "fork" in multiprocessing.get_all_start_methods():
+        # Set before the workers are forked, so they inherit it without pickling
+        previous = _shared
+        _set_shared(shared)
+        try:
+            with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("fork")) as pool:
+                yield pool
+        finally:
+            _set_shared(previous)
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_set_shared, initargs=(shared,)) as pool:
+            yield pool
+
+
+# Run function in this process, with shared visible through parallel.shared()
+def _call_serial(function, shared, *args):
+    previous = _shared
+    _set_shared(shared)
+    try:
+        return function(*args)
+    finally:
+        _set_shared(previous)
+
+
+# Function: parallel_map(function, items, n_jobs, shared=None)
+# function: A module-level function applied to every shard of items
+# items: A list, e.g. of documents
+# n_jobs: Number of worker processes (see resolve_n_jobs)
+# shared: OPTIONAL; A read-only object the workers can read with parallel.shared()
+# Returns: The list of results of function, one per shard, in the order of items
+#
+# With a single job, function is called in this process on the whole list.
+def parallel_map(function, items, n_jobs, shared=None):
+    n_jobs = resolve_n_jobs(n_jobs)
+    if n_jobs == 1 or len(items) <= 1:
+        return [_call_serial(function, shared, items)]
+
+    shards = shard(items, n_jobs)
+    with process_pool(len(shards), shared) as pool:
+        return list(pool.map(function, shards))
+
+
+# Function: parallel_apply(function, tasks, n_jobs, shared=None)
+# function: A module-level function applied to every task
+# tasks: A list of task arguments, e.g. independent training jobs
+# n_jobs: Number of worker processes (see resolve_n_jobs)
+# shared: OPTIONAL; A read-only object the workers can read with parallel.shared()
+# Returns: The list of results of function, one per task, in the order of tasks
+#
+# Unlike parallel_map, every task is submitted on its own, so a worker that is
+# done picks up the next task; this balances tasks of very different durations.
+def parallel_apply(function, tasks, n_jobs, shared=None):
+    n_jobs = min(resolve_n_jobs(n_jobs), max(1, len(tasks)))
+    if n_jobs == 1:
+        return [_call_serial(function, shared, task) for task in tasks]
+
+    with process_pool(n_jobs, shared) as pool:
+        return list(pool.map(function, tasks, chunksize=1))
+
+
+# Function: parallel_imap(function, tasks, n_jobs, shared=None, max_pending=None)
+# function: A module-level function applied to every task
+# tasks: An iterable of task arguments, e.g. batches of documents read from a file
+# n_jobs: Number of worker processes (see resolve_n_jobs)
+# shared: OPTIONAL; A read-only object the workers can read with parallel.shared()
+# max_pending: OPTIONAL; Maximum number of tasks submitted and not yet returned (twice the number of workers by default)
+# Returns: A generator of the results of function, one per task, in the order of tasks
+#
+# Unlike parallel_apply, tasks are read from the iterable only as workers become
+# free, so at most max_pending tasks and results are held in memory at once.
+def parallel_imap(function, tasks, n_jobs, shared=None, max_pending=None):
+    n_jobs = resolve_n_jobs(n_jobs)
+    if n_jobs == 1:
+        for task in tasks:
+            yield _call_serial(function, shared, task)
+        return
+
+    max_pending = max(1, max_pending or 2 * n_jobs)
+    with process_pool(n_jobs, shared) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(function, task))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
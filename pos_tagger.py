@@ -0,0 +1,91 @@
+# Part-of-speech tagger engine
+#
+# get_pos_tags called nltk.pos_tag on every stylistic analysis turn.  Depending
+# on the NLTK version, nltk.pos_tag builds a new PerceptronTagger, and so loads
+# its weights from disk, on every call (older releases), or looks up a cached one
+# after validating its arguments (recent releases).
+#
+# PosTagger loads the averaged perceptron tagger once and keeps it for the
+# lifetime of the process; tag() then runs the perceptron directly, and gives the
+# same tags as nltk.pos_tag.  The tagger only reads its weights, so one instance
+# is shared by every session and thread.  Tagged inputs are kept in an optional
+# LRU cache keyed by their tokens, so repeated messages are not tagged again.
+# The perceptron uses the context of neighbouring tokens, so the cache is keyed
+# by the whole token list given to tag(), not by sentence.
+#
+# Run "python benchmarks.py pos" to measure the per-call latency.
+# =========================================================================================================
+
+import threading
+from functools import lru_cache
+
+from nltk.tag import PerceptronTagger
+
+from nltk_resources import require
+
+
+# Default number of tagged token lists kept by the LRU cache
+POS_CACHE_SIZE = 4096
+
+
+# Class: PosTagger(cache_size=POS_CACHE_SIZE)
+# cache_size: OPTIONAL; Number of tagged token lists kept in the LRU cache (0 disables the cache)
+#
+# Drop-in replacement for nltk.pos_tag(tokens).  The tagger is loaded on first use
+# (its data is located by nltk_resources.require), or ahead of time with load().
+class PosTagger:
+    def __init__(self, cache_size=POS_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._tagger = None
+        self._lock = threading.Lock()
+        self._cached_tag = lru_cache(maxsize=cache_size)(self._tag_tuple) if cache_size else None
+
+    @property
+    def tagger(self):
+        if self._tagger is None:
+            with self._lock:
+                if self._tagger is None:
+                    require("tagger")
+                    self._tagger = PerceptronTagger()
+        return self._tagger
+
+    # Function: load()
+    # Returns: The PosTagger, with its model loaded (e.g. at startup, before the first request)
+    def load(self):
+        self.tagger
+        return self
+
+    def _tag_tuple(self, tokens):
+        return tuple(self.tagger.tag(list(tokens)))
+
+    # Function: tag(tokens)
+    # tokens: A list of tokens
+    # Returns: A list of (token, POS) tuples, as returned by nltk.pos_tag(tokens)
+    def tag(self, tokens):
+        if isinstance(tokens, str):
+            raise TypeError("tokens: expected a list of strings, got a string")
+        if self._cached_tag is None:
+            return self.tagger.tag(list(tokens))
+        return list(self._cached_tag(tuple(tokens)))
+
+    # Function: tag_many(token_lists)
+    # token_lists: An iterable of token lists, e.g. one per document
+    # Returns: A list holding the tagged list of every token list
+    def tag_many(self, token_lists):
+        tag = self.tag
+        return [tag(tokens) for tokens in token_lists]
+
+    # Function: cache_info()
+    # Returns: The hits, misses and size of the LRU cache, or None if it is disabled
+    def cache_info(self):
+        return None if self._cached_tag is None else self._cached_tag.cache_info()
+
+    # Function: clear_cache()
+    # This function empties the LRU cache
+    def clear_cache(self):
+        if self._cached_tag is not None:
+            self._cached_tag.cache_clear()
+
+
+# Shared instance used by get_pos_tags and the stylistic analyzer
+POS_TAGGER = PosTagger()
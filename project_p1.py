@@ -21,13 +21,25 @@ import pickle as pkl
 import nltk
 import time
 import csv
+import functools
 
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.naive_bayes import GaussianNB
 from sklearn.linear_model import LogisticRegression
 from sklearn.svm import LinearSVC
 from sklearn.neural_network import MLPClassifier
-from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_score
+
+from corpus import TokenizedCorpus
+from embedding_store import is_embedding_store, load_embedding_store, open_embeddings
+from evaluation import confusion_counts, evaluate_predictions, featurize_test_set, scores_from_counts
+from feature_store import FeatureStore, hash_documents
+from incremental import StreamingTfidf, partial_fit_batches, train_incremental
+from memory_profile import MemoryProfiler, format_table, write_profile
+import parallel
+from parallel import parallel_map, resolve_n_jobs
+from sparse_models import fit_sparse, predict_sparse
+from tokenizer import TOKENIZER
+from training_jobs import TrainingJob, run_training_jobs
 
 
 
@@ -40,11 +52,40 @@ from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_sc
 # file elsewhere, you will need to update the file path accordingly.
 EMBEDDING_FILE = "w2v.pkl"
 
+# Memory-mapped copy of EMBEDDING_FILE (see embedding_store.py).  It is created
+# from EMBEDDING_FILE the first time the main function runs and reused afterwards.
+EMBEDDING_STORE = "w2v_store"
+
+# Directory where computed feature matrices are cached between runs (see feature_store.py).
+# TOKENIZER_VERSION is part of every cache key: change it whenever get_tokens changes
+# so that features built with the old tokenization are not reused.
+FEATURE_CACHE_DIR = ".feature_cache"
+TOKENIZER_VERSION = "nltk.word_tokenize/1"
+
+# Number of worker processes used to compute the TF-IDF and Word2Vec training
+# features (see parallel.py).  None keeps the serial path; -1 uses one per CPU.
+N_JOBS = None
+
+# Number of worker processes training and testing the 8 model/feature combinations
+# in the main function (see training_jobs.py).  None trains them one after another.
+TRAIN_JOBS = None
+
+# CSV file the main function writes the peak and retained memory of every stage
+# to, e.g. "memory_profile.csv" (see memory_profile.py).  None does not profile.
+# A profiled run does not use the FEATURE_CACHE_DIR cache, and also fills the Peak
+# Memory MB column of classification_report.csv.
+MEMORY_PROFILE = None
+
 
 # Function: load_w2v
-# filepath: path of w2v.pkl
+# filepath: path of w2v.pkl, or of an embedding store directory written by embedding_store.py
 # Returns: A dictionary containing words as keys and pre-trained word2vec representations as numpy arrays of shape (300,)
+#
+# An embedding store is memory-mapped instead of unpickled; it answers the same
+# "token in word2vec" and "word2vec[token]" lookups as the dictionary.
 def load_w2v(filepath):
+    if is_embedding_store(filepath):
+        return load_embedding_store(filepath)
     with open(filepath, 'rb') as fin:
         return pkl.load(fin)
 
@@ -66,14 +107,41 @@ def load_as_list(fname):
 # Args:
 #   inp_str: input string 
 # Returns: token list, dtype: list of strings
+#
+# The shared WordTokenizer (tokenizer.py) returns the same tokens as
+# nltk.tokenize.word_tokenize, but resolves the NLTK resources only once.
 def get_tokens(inp_str):
-    # Initialize NLTK tokenizer
-    try:
-        nltk.data.find('tokenizers/punkt')
-    except LookupError:
-        print("NLTK tokenizer not found, downloading...")
-        nltk.download('punkt')
-    return nltk.tokenize.word_tokenize(inp_str)
+    return TOKENIZER.tokenize(inp_str)
+
+
+# Function: get_lowercase_tokens(inp_str)
+# inp_str: input string
+# Returns: The tokens of get_tokens, lowercased
+#
+# Tokenizer of the vectorizers built from a TokenizedCorpus, which lowercases
+# tokens after tokenizing instead of lowercasing the text before tokenizing.
+def get_lowercase_tokens(inp_str):
+    return [token.lower() for token in get_tokens(inp_str)]
+
+
+# Function: build_corpus(documents, n_jobs=None)
+# documents: A list of strings, e.g. the documents returned by load_as_list
+# n_jobs: OPTIONAL; Number of worker processes tokenizing the documents (serial by default)
+# Returns: A TokenizedCorpus of the documents, tokenized once with get_tokens
+#
+# The main function builds the training corpus once for the Word2Vec features
+# (w2v_features).  vectorize_corpus can compute TF-IDF from it as well, but its
+# vocabulary differs a little from that of vectorize_train, so it is only used
+# when a corpus is passed to vectorize_train_cached explicitly.
+def build_corpus(documents, n_jobs=None):
+    if resolve_n_jobs(n_jobs) > 1:
+        return TokenizedCorpus.concatenate(parallel_map(_tokenize_shard, documents, n_jobs))
+    return TokenizedCorpus.from_documents(documents, get_tokens)
+
+
+# Worker of build_corpus: tokenizes a shard of documents with get_tokens
+def _tokenize_shard(documents):
+    return TokenizedCorpus.from_documents(documents, get_tokens)
 
 
 # Function: preprocessing.  See project statement for more details.
@@ -89,8 +157,19 @@ def preprocessing(user_input):
 
 # Function: vectorize_train.  See project statement for more details.
 # training_documents: A list of strings
+# n_jobs: OPTIONAL; Number of worker processes tokenizing the documents (serial by default)
 # Returns: An initialized TfidfVectorizer model, and a document-term matrix, dtype: scipy.sparse.csr.csr_matrix
-def vectorize_train(training_documents):
+#
+# With n_jobs, every worker tokenizes a shard of the documents exactly like the
+# vectorizer would (lowercase, then get_tokens); the shards' vocabularies are
+# merged and the document frequencies computed on the merged term counts, which
+# gives the same vectorizer and matrix as the serial path.
+def vectorize_train(training_documents, n_jobs=None):
+    if resolve_n_jobs(n_jobs) > 1:
+        shards = parallel_map(_tokenize_shard_lowercase, training_documents, n_jobs)
+        terms, idf, tfidf_train = TokenizedCorpus.concatenate(shards).tfidf(lowercase=False)
+        return rebuild_vectorizer(terms, idf), tfidf_train
+
     # Initialize the TfidfVectorizer model and document-term matrix
     # Update the vectorizer and tfidf_train
     vectorizer  = TfidfVectorizer(tokenizer=get_tokens, lowercase=True)
@@ -99,6 +178,98 @@ def vectorize_train(training_documents):
     return vectorizer, tfidf_train
 
 
+# Worker of vectorize_train: tokenizes a shard of documents the way TfidfVectorizer(lowercase=True) does
+def _tokenize_shard_lowercase(documents):
+    return TokenizedCorpus.from_documents(documents, lambda document: get_tokens(document.lower()))
+
+
+# Function: rebuild_vectorizer(terms, idf, tokenizer=get_tokens, lowercase=True)
+# terms: The vocabulary of a fitted vectorizer, in column order
+# idf: The idf_ vector of that vectorizer
+# tokenizer, lowercase: OPTIONAL; The tokenization settings of that vectorizer
+# Returns: A TfidfVectorizer equivalent to the one returned by vectorize_train
+def rebuild_vectorizer(terms, idf, tokenizer=get_tokens, lowercase=True):
+    vectorizer = TfidfVectorizer(tokenizer=tokenizer, lowercase=lowercase)
+    vectorizer.vocabulary_ = {str(term): column for column, term in enumerate(terms)}
+    vectorizer.idf_ = idf
+    return vectorizer
+
+
+# Function: vectorizer_version(vectorizer)
+# vectorizer: A fitted TfidfVectorizer
+# Returns: A string identifying the vocabulary and idf weights of the vectorizer, used as a cache key
+def vectorizer_version(vectorizer):
+    terms = vectorizer.get_feature_names_out().tolist()
+    return "{0}/{1}".format(hash_documents(terms)[:16], hash_documents([vectorizer.idf_.tobytes().hex()])[:16])
+
+
+# Function: vectorize_train_cached(training_documents, feature_store=None, n_jobs=None, corpus=None)
+# training_documents: A list of strings
+# feature_store: OPTIONAL; A FeatureStore holding previously fitted TF-IDF features
+# n_jobs: OPTIONAL; Number of worker processes used by vectorize_train on a cache miss
+# corpus: OPTIONAL; A function of no arguments returning the TokenizedCorpus of training_documents
+#         (see build_corpus), called only on a cache miss
+# Returns: The same vectorizer and document-term matrix as vectorize_train, or as vectorize_corpus
+#          when corpus is given
+#
+# The fitted vocabulary, idf weights and training matrix are kept in the store,
+# so later calls on the same documents skip fitting altogether.  Passing corpus
+# saves tokenizing the documents again, at the price of the slightly different
+# vocabulary of vectorize_corpus (cached under its own key); the default keeps
+# the features, and hence the reported results, of vectorize_train.
+def vectorize_train_cached(training_documents, feature_store=None, n_jobs=None, corpus=None):
+    if corpus is not None:
+        fit = lambda: vectorize_corpus(corpus())
+        version, tokenizer, lowercase = TOKENIZER_VERSION + "/corpus", get_lowercase_tokens, False
+    else:
+        fit = lambda: vectorize_train(training_documents, n_jobs)
+        version, tokenizer, lowercase = TOKENIZER_VERSION, get_tokens, True
+    if feature_store is None:
+        return fit()
+
+    arrays = feature_store.get_arrays("tfidf-vectorizer", training_documents, version)
+    if arrays is None:
+        vectorizer, tfidf_train = fit()
+        feature_store.put_arrays("tfidf-vectorizer", training_documents, version,
+                                 {"terms": vectorizer.get_feature_names_out().astype(str), "idf": vectorizer.idf_})
+    else:
+        vectorizer = rebuild_vectorizer(arrays["terms"], arrays["idf"], tokenizer, lowercase)
+        tfidf_train = None
+
+    tfidf_train = feature_store.get_sparse("tfidf-train", training_documents, version,
+                                           lambda: tfidf_train if tfidf_train is not None
+                                           else vectorizer.transform(training_documents))
+    return vectorizer, tfidf_train
+
+
+# Function: vectorize_corpus(corpus)
+# corpus: A TokenizedCorpus built with build_corpus
+# Returns: An initialized TfidfVectorizer model, and a document-term matrix, dtype: scipy.sparse.csr.csr_matrix
+#
+# This function builds TF-IDF from the already tokenized corpus instead of
+# tokenizing the documents again.  The corpus holds tokens of the original text,
+# which are lowercased afterwards, whereas vectorize_train tokenizes lowercased
+# text; Punkt uses capitalization to find sentence ends, so both can differ on a
+# few tokens (e.g. "1941." at the end of a sentence followed by a lowercase word).
+# The returned vectorizer tokenizes new documents the same way as the corpus.
+def vectorize_corpus(corpus):
+    terms, idf, tfidf_train = corpus.tfidf(lowercase=True)
+    vectorizer = rebuild_vectorizer(terms, idf, tokenizer=get_lowercase_tokens, lowercase=False)
+    return vectorizer, tfidf_train
+
+
+# Function: tfidf_features(vectorizer, documents, feature_store=None)
+# vectorizer: An initialized TfidfVectorizer model
+# documents: A list of strings
+# feature_store: OPTIONAL; A FeatureStore caching the transformed documents
+# Returns: The document-term matrix of documents, dtype: scipy.sparse.csr.csr_matrix
+def tfidf_features(vectorizer, documents, feature_store=None):
+    if feature_store is None:
+        return vectorizer.transform(documents)
+    version = "{0}/{1}".format(TOKENIZER_VERSION, vectorizer_version(vectorizer))
+    return feature_store.get_sparse("tfidf", documents, version, lambda: vectorizer.transform(documents))
+
+
 # Function: w2v(word2vec, token)
 # word2vec: The pretrained Word2Vec representations as dictionary
 # token: A string containing a single token
@@ -147,6 +318,59 @@ def string2vec(word2vec, user_input):
     return avg_embed
 
 
+# Function: string2vec_batch(word2vec, documents, n_jobs=None)
+# word2vec: The pretrained Word2Vec model
+# documents: A list of strings of arbitrary length
+# n_jobs: OPTIONAL; Number of worker processes (serial by default)
+# Returns: A (len(documents), 300) float64 matrix whose rows are the string2vec embeddings of the documents
+#
+# This function is the vectorized form of string2vec for whole corpora: every
+# token is mapped to an integer row id, the rows are gathered in one step and
+# averaged per document with segment sums instead of per-token Python lists.
+# The averages are kept in float64 like string2vec's, so that the models are
+# trained and tested on the same features as the chatbot predicts from; the
+# float32 embeddings are only stored.  With n_jobs, every worker embeds a shard
+# of the documents and the row blocks are concatenated; word2vec is shared with
+# the workers rather than copied into every task (see parallel.py).
+def string2vec_batch(word2vec, documents, n_jobs=None):
+    if resolve_n_jobs(n_jobs) > 1:
+        return np.concatenate(parallel_map(_embed_shard, documents, n_jobs, shared=word2vec))
+    return build_corpus(documents).embeddings(word2vec, np.float64)
+
+
+# Worker of string2vec_batch: embeds a shard of documents with the shared word2vec model
+def _embed_shard(documents):
+    return build_corpus(documents).embeddings(parallel.shared(), np.float64)
+
+
+# Function: w2v_features(word2vec, documents, feature_store=None, corpus=None, n_jobs=None)
+# word2vec: The pretrained Word2Vec model
+# documents: A list of strings of arbitrary length
+# feature_store: OPTIONAL; A FeatureStore caching the embedding matrices
+# corpus: OPTIONAL; A function of no arguments returning the TokenizedCorpus of documents (see
+#         build_corpus), called only if the matrix is not cached, instead of tokenizing the documents again
+# n_jobs: OPTIONAL; Number of worker processes computing the matrix (serial by default)
+# Returns: The string2vec_batch matrix of documents
+#
+# Matrices built from an embedding store are also cached on disk, keyed by the
+# store checksum.  A plain word2vec dictionary cannot be fingerprinted cheaply,
+# so its matrices are only cached in memory.
+def w2v_features(word2vec, documents, feature_store=None, corpus=None, n_jobs=None):
+    def compute():
+        if corpus is not None:
+            return corpus().embeddings(word2vec, np.float64)
+        return string2vec_batch(word2vec, documents, n_jobs)
+
+    if feature_store is None:
+        return compute()
+
+    persist = hasattr(word2vec, "version")
+    embedding_version = word2vec.version if persist else "dict-{0}".format(id(word2vec))
+    # Cached in float64: float32 matrices would round the averages the models are trained on
+    version = "{0}/{1}/float64".format(TOKENIZER_VERSION, embedding_version)
+    return feature_store.get_dense("w2v", documents, version, compute, persist=persist)
+
+
 # Function: instantiate_models()
 # This function does not take any input
 # Returns: Three instantiated machine learning models
@@ -170,119 +394,196 @@ def instantiate_models():
 # Returns: A trained version of the input model
 #
 # This function trains an input machine learning model using TFIDF
-# embeddings for the training documents.
+# embeddings for the training documents.  The document-term matrix stays sparse;
+# dense-only models (GaussianNB) are fitted on bounded dense chunks of it.
 def train_model_tfidf(model, tfidf_train, training_labels):
-    # Convert the training data to a numpy_array and apply the labels
-    return model.fit(tfidf_train.toarray(), training_labels)
+    # Fit on the sparse matrix and apply the labels
+    return fit_sparse(model, tfidf_train, training_labels)
 
 
-# Function: train_model_w2v(model, word2vec, training_documents, training_labels)
+# Function: train_model_w2v(model, word2vec, training_documents, training_labels, feature_store=None, n_jobs=None)
 # model: An instantiated machine learning model
 # word2vec: A pretrained Word2Vec model
 # training_data: A list of training documents
 # training_labels: A list of integers (all 0 or 1)
+# feature_store: OPTIONAL; A FeatureStore sharing the embedding matrix across models
+# n_jobs: OPTIONAL; Number of worker processes computing the embeddings (serial by default)
 # Returns: A trained version of the input model
 #
 # This function trains an input machine learning model using averaged Word2Vec
 # embeddings for the training documents.
-def train_model_w2v(model, word2vec, training_documents, training_labels):
-    # Convert training_document to embedding w2v
-    embedding_lst = []
-    for document in training_documents:
-        word2vec_converter = string2vec(word2vec, document)
-        embedding_lst.append(word2vec_converter)
+def train_model_w2v(model, word2vec, training_documents, training_labels, feature_store=None, n_jobs=None):
+    # Convert training_document to embedding w2v, as one matrix
+    embedding_matrix = w2v_features(word2vec, training_documents, feature_store, n_jobs=n_jobs)
 
-    # Casting embedding to a matrix array and return fit model
-    return model.fit(np.array(embedding_lst), training_labels)
+    # Fit the model on the embedding matrix
+    return model.fit(embedding_matrix, training_labels)
 
 
-# Function: test_model_tfidf(model, word2vec, training_documents, training_labels)
+# Function: test_model_tfidf(model, word2vec, training_documents, training_labels, feature_store=None)
 # model: An instantiated machine learning model
 # vectorizer: An initialized TfidfVectorizer model
 # test_data: A list of test documents
 # test_labels: A list of integers (all 0 or 1)
+# feature_store: OPTIONAL; A FeatureStore sharing the test document-term matrix across models
 # Returns: Precision, recall, F1, and accuracy values for the test data
 #
 # This function tests an input machine learning model by extracting features
 # for each preprocessed test document and then predicting an output label for
 # that document.  It compares the predicted and actual test labels and returns
 # precision, recall, f1, and accuracy scores.
-def test_model_tfidf(model, vectorizer, test_documents, test_labels):
+def test_model_tfidf(model, vectorizer, test_documents, test_labels, feature_store=None):
     precision = None
     recall = None
     f1 = None
     accuracy = None
 
     # Vectorizing to normalize each word from the test document
-    # Convert to array type to apply for model prediction
-    model_test_vector = vectorizer.transform(test_documents).toarray()
+    # The matrix stays sparse; dense-only models predict on bounded dense chunks
+    model_test_vector = tfidf_features(vectorizer, test_documents, feature_store)
 
     # Predict labels
-    label_predicts = model.predict(model_test_vector)
+    label_predicts = predict_sparse(model, model_test_vector)
 
-    # Statistical performing calculation
+    # Statistical performing calculation, from a single count of the confusion matrix
     # Update variables above to appropriate type
-    precision = precision_score(test_labels, label_predicts)
-    recall    = recall_score(test_labels, label_predicts)
-    f1        = f1_score(test_labels, label_predicts)
-    accuracy  = accuracy_score(test_labels, label_predicts)
+    precision, recall, f1, accuracy = evaluate_predictions(test_labels, label_predicts)
 
     return precision, recall, f1, accuracy
 
 
-# Function: test_model_w2v(model, word2vec, training_documents, training_labels)
+# Function: test_model_w2v(model, word2vec, training_documents, training_labels, feature_store=None)
 # model: An instantiated machine learning model
 # word2vec: A pretrained Word2Vec model
 # test_data: A list of test documents
 # test_labels: A list of integers (all 0 or 1)
+# feature_store: OPTIONAL; A FeatureStore sharing the test embedding matrix across models
 # Returns: Precision, recall, F1, and accuracy values for the test data
 #
 # This function tests an input machine learning model by extracting features
 # for each preprocessed test document and then predicting an output label for
 # that document.  It compares the predicted and actual test labels and returns
 # precision, recall, f1, and accuracy scores.
-def test_model_w2v(model, word2vec, test_documents, test_labels):
+def test_model_w2v(model, word2vec, test_documents, test_labels, feature_store=None):
     precision = None
     recall = None
     f1 = None
     accuracy = None
 
-    # Convert training_document to embedding w2v
-    model_test_vector = []
-    for document in test_documents:
-        word2vec_converter = string2vec(word2vec, document)
-        model_test_vector.append(word2vec_converter)
+    # Convert test_documents to embedding w2v, as one matrix
+    model_test_vector = w2v_features(word2vec, test_documents, feature_store)
 
     # Predict labels
     label_predicts = model.predict(model_test_vector)
 
-    # Statistical performing calculation
+    # Statistical performing calculation, from a single count of the confusion matrix
     # Update variables above to appropriate type
-    precision = precision_score(test_labels, label_predicts)
-    recall = recall_score(test_labels, label_predicts)
-    f1 = f1_score(test_labels, label_predicts)
-    accuracy = accuracy_score(test_labels, label_predicts)
+    precision, recall, f1, accuracy = evaluate_predictions(test_labels, label_predicts)
 
     return precision, recall, f1, accuracy
 
 
+# Function: train_model_w2v_stream(model, word2vec, batches)
+# model: An instantiated machine learning model implementing partial_fit (see incremental.instantiate_incremental_models)
+# word2vec: A pretrained Word2Vec model
+# batches: An iterable of (documents, labels) pairs, e.g. data_stream.iter_batches("dataset.csv")
+# Returns: A trained version of the input model
+#
+# Like train_model_w2v, but the model is updated with partial_fit batch by
+# batch, in a single pass over the stream: only the embeddings of one batch are
+# held at a time.  For several epochs, use train_model_w2v_incremental.  TF-IDF
+# features cannot be trained in one pass, since the document frequencies must be
+# counted over the whole stream first: see train_model_tfidf_incremental.
+def train_model_w2v_stream(model, word2vec, batches):
+    if not hasattr(model, "partial_fit"):
+        raise TypeError("{0} does not implement partial_fit, train it with train_model_w2v".format(type(model).__name__))
+    return partial_fit_batches(model, lambda documents: string2vec_batch(word2vec, documents), batches)
+
+
+# Function: train_model_tfidf_incremental(model, make_batches, strategy="vocabulary", epochs=1, tfidf=None)
+# model: An instantiated machine learning model implementing partial_fit (see incremental.instantiate_incremental_models)
+# make_batches: A function of no arguments returning a new iterable of (documents, labels) pairs,
+#               e.g. lambda: iter_batches("dataset.csv")
+# strategy: OPTIONAL; "vocabulary" (the features of vectorize_train) or "hashing" (fixed-size features)
+# epochs: OPTIONAL; Number of passes over the training stream
+# tfidf: OPTIONAL; A StreamingTfidf already fitted on the stream, e.g. shared by several models
+# Returns: A trained version of the input model, and the fitted StreamingTfidf to featurize test documents
+#
+# Out-of-core counterpart of vectorize_train + train_model_tfidf: the stream is
+# read once to fit the TF-IDF weights, then once per epoch to train the model.
+def train_model_tfidf_incremental(model, make_batches, strategy="vocabulary", epochs=1, tfidf=None):
+    if tfidf is None:
+        tfidf = StreamingTfidf(get_tokens, strategy).fit(make_batches())
+    return train_incremental(model, tfidf.transform, make_batches, epochs=epochs), tfidf
+
+
+# Function: train_model_w2v_incremental(model, word2vec, make_batches, epochs=1)
+# model: An instantiated machine learning model implementing partial_fit
+# word2vec: A pretrained Word2Vec model
+# make_batches: A function of no arguments returning a new iterable of (documents, labels) pairs
+# epochs: OPTIONAL; Number of passes over the training stream
+# Returns: A trained version of the input model
+#
+# Out-of-core counterpart of train_model_w2v: only the embeddings of one batch
+# are held at a time.
+def train_model_w2v_incremental(model, word2vec, make_batches, epochs=1):
+    return train_incremental(model, lambda documents: string2vec_batch(word2vec, documents), make_batches, epochs=epochs)
+
+
+# Function: test_model_stream(model, featurize, batches)
+# model: A trained machine learning model
+# featurize: A function from a list of documents to their feature matrix,
+#            e.g. vectorizer.transform or lambda documents: string2vec_batch(word2vec, documents)
+# batches: An iterable of (documents, labels) pairs, e.g. data_stream.iter_batches("test.csv")
+# Returns: Precision, recall, F1, and accuracy values for the test data
+#
+# Like test_model_tfidf and test_model_w2v, but only one batch of documents is
+# held at a time: the predictions are folded into confusion counts as they come,
+# so arbitrarily large test files are scored in constant memory.
+def test_model_stream(model, featurize, batches):
+    tp = fp = fn = tn = 0
+    for documents, labels in batches:
+        batch_tp, batch_fp, batch_fn, batch_tn = confusion_counts(labels, predict_sparse(model, featurize(documents)))
+        tp, fp, fn, tn = tp + batch_tp, fp + batch_fp, fn + batch_fn, tn + batch_tn
+
+    return scores_from_counts(tp, fp, fn, tn)
+
+
 # Use this main function to test your code. Sample code is provided to assist with the assignment;
 # feel free to change/remove it. Some of the provided sample code will help you in answering
 # project questions, but it won't work correctly until all functions have been implemented.
 if __name__ == "__main__":
+    # Every stage is memory-profiled only if MEMORY_PROFILE is set
+    profiler = MemoryProfiler(enabled=MEMORY_PROFILE is not None)
+
     print("*************** Loading data & processing *****************")
     # Load the dataset
     print("Loading dataset.csv....")
-    documents, labels = load_as_list("dataset.csv")
+    with profiler.stage("load_as_list dataset.csv"):
+        documents, labels = load_as_list("dataset.csv")
     
 
     # Load the Word2Vec representations so that you can make use of it later
     print("Loading Word2Vec representations....")
-    word2vec = load_w2v(EMBEDDING_FILE)
+    with profiler.stage("open_embeddings " + EMBEDDING_STORE):
+        word2vec = open_embeddings(EMBEDDING_FILE, EMBEDDING_STORE)
+
+    # Every feature matrix is computed once and shared by all models (and cached for later runs).
+    # A memory-profiled run computes all of them: loading them from the cache is not what it measures.
+    feature_store = FeatureStore(FEATURE_CACHE_DIR) if MEMORY_PROFILE is None else None
+
+    # dataset.csv is tokenized for the Word2Vec features the first time they are not found in
+    # the cache.  TF-IDF keeps vectorize_train, which tokenizes the lowercased text: building it
+    # from this corpus would change a few terms, and with them the reported results.
+    corpus = functools.lru_cache(maxsize=None)(lambda: build_corpus(documents, N_JOBS))
+    if MEMORY_PROFILE is not None:
+        with profiler.stage("build_corpus dataset.csv"):
+            corpus()
 
     # Compute TFIDF representations so that you can make use of them later
     print("Computing TFIDF representations....")
-    vectorizer, tfidf_train = vectorize_train(documents)
+    with profiler.stage("vectorize_train"):
+        vectorizer, tfidf_train = vectorize_train_cached(documents, feature_store, N_JOBS)
 
     # print(tfidf_train)
     # exit(0)
@@ -294,82 +595,80 @@ if __name__ == "__main__":
     nb_tfidf, logistic_tfidf, svm_tfidf, mlp_tfidf = instantiate_models()
     nb_w2v, logistic_w2v, svm_w2v, mlp_w2v = instantiate_models()
 
-    print("Training Naive Bayes models....")
-    start = time.time() # This will help you monitor training times (useful once training functions are implemented!)
-    nb_tfidf = train_model_tfidf(nb_tfidf, tfidf_train, labels)
-    end = time.time()
-    print("Naive Bayes + TFIDF trained in {0} seconds".format(end - start))
-
-    start = time.time()
-    nb_w2v = train_model_w2v(nb_w2v, word2vec, documents, labels)
-    end = time.time()
-    print("Naive Bayes + w2v trained in {0} seconds".format(end - start))
-
-    print("Training Logistic Regression models....")
-    start = time.time()
-    logistic_tfidf = train_model_tfidf(logistic_tfidf, tfidf_train, labels)
-    end = time.time()
-    print("Logistic Regression + TFIDF trained in {0} seconds".format(end - start))
-
-    start = time.time()
-    logistic_w2v = train_model_w2v(logistic_w2v, word2vec, documents, labels)
-    end = time.time()
-    print("Logistic Regression + w2v trained in {0} seconds".format(end - start))
-
-    print("Training SVM models....")
-    start = time.time()
-    svm_tfidf = train_model_tfidf(svm_tfidf, tfidf_train, labels)
-    end = time.time()
-    print("SVM + TFIDF trained in {0} seconds".format(end - start))
-
-    start = time.time()
-    svm_w2v = train_model_w2v(svm_w2v, word2vec, documents, labels)
-    end = time.time()
-    print("SVM + w2v trained in {0} seconds".format(end - start))
-
-    print("Training Multilayer Perceptron models....")
-    start = time.time()
-    mlp_tfidf = train_model_tfidf(mlp_tfidf, tfidf_train, labels)
-    end = time.time()
-    print("Multilayer Perceptron + TFIDF trained in {0} seconds".format(end - start))
-
-    start = time.time()
-    mlp_w2v = train_model_w2v(mlp_w2v, word2vec, documents, labels)
-    end = time.time()
-    print("Multilayer Perceptron + w2v trained in {0} seconds".format(end - start))
-
-    # Uncomment the line below to test out the w2v() function.  Make sure to try a few words that are unlikely to
-    # exist in its dictionary (e.g., "covid") to see how it handles those.
-    #print("Word2Vec embedding for {0}:\t{1}".format("vaccine", w2v(word2vec, "vaccine")))
-
-    # Test the machine learning models to see how they perform on the small test set provided.
-    # Write a classification report to a CSV file with this information.
-    print("\n***************** Testing models ***************************")
-    test_documents, test_labels = load_as_list("test.csv")  # Loading the dataset
+    with profiler.stage("load_as_list test.csv"):
+        test_documents, test_labels = load_as_list("test.csv")  # Loading the dataset
+    with profiler.stage("w2v_features"):
+        w2v_train = w2v_features(word2vec, documents, feature_store, corpus=corpus, n_jobs=N_JOBS)
+
+    # The test set is featurized once per feature set (through the feature cache) and shared by the four
+    # models of that set; the report shows the time this took and the latency of single documents
+    featurizers = {
+        "TFIDF": functools.partial(tfidf_features, vectorizer),
+        "w2v": functools.partial(w2v_features, word2vec),
+    }
+    features = {}
+    for name, train in (("TFIDF", tfidf_train), ("w2v", w2v_train)):
+        featurize = featurizers[name]
+        with profiler.stage("featurize test.csv " + name):
+            test = featurize_test_set(featurize, test_documents,
+                                      featurize_all=functools.partial(featurize, feature_store=feature_store))
+        features[name] = (train, test)
 
     models_tfidf = [nb_tfidf, logistic_tfidf, svm_tfidf, mlp_tfidf]
     models_w2v = [nb_w2v, logistic_w2v, svm_w2v, mlp_w2v]
     model_names = ["Naive Bayes", "Logistic Regression", "SVM", "Multilayer Perceptron"]
+    jobs = []
+    for name, model_tfidf, model_w2v in zip(model_names, models_tfidf, models_w2v):
+        jobs.append(TrainingJob(name + " + TFIDF", model_tfidf, "TFIDF"))
+        jobs.append(TrainingJob(name + " + w2v", model_w2v, "w2v"))
+
+    # Train and test the 8 models, on TRAIN_JOBS processes
+    print("Training and testing {0} models on {1} process(es)....".format(len(jobs), min(resolve_n_jobs(TRAIN_JOBS), len(jobs))))
+    results, total_seconds = run_training_jobs(jobs, features, labels, test_labels, TRAIN_JOBS,
+                                               memory_profile=MEMORY_PROFILE is not None)
+    for result in results:
+        print("{0} trained in {1} seconds".format(result.name, result.train_seconds))
+    print("All models trained and tested in {0} seconds".format(total_seconds))
+
+    if MEMORY_PROFILE is not None:
+        profiler.close()
+        # The memory of the unpickled dictionary, for comparison with the embedding store used above.
+        # Measured last: the freed dictionary would otherwise stay in the RSS of every later stage.
+        pickle_profiler = MemoryProfiler()
+        with pickle_profiler.stage("load_w2v " + EMBEDDING_FILE):
+            word2vec_dict = load_w2v(EMBEDDING_FILE)
+        del word2vec_dict
+        pickle_profiler.close()
+        print("\n***************** Memory profile ***************************")
+        memory_records = (profiler.records + [record for result in results for record in result.memory]
+                          + pickle_profiler.records)
+        for line in format_table(memory_records):
+            print(line)
+        write_profile(MEMORY_PROFILE, memory_records)
+
+    nb_tfidf, nb_w2v, logistic_tfidf, logistic_w2v, svm_tfidf, svm_w2v, mlp_tfidf, mlp_w2v = [result.model for result in results]
 
+    # Uncomment the line below to test out the w2v() function.  Make sure to try a few words that are unlikely to
+    # exist in its dictionary (e.g., "covid") to see how it handles those.
+    #print("Word2Vec embedding for {0}:\t{1}".format("vaccine", w2v(word2vec, "vaccine")))
+
+    # Write a classification report to a CSV file with the test results, the time taken by every job and the
+    # cost of running every model on the test set (see evaluation.py).  The peak memory is measured only
+    # by a memory-profiled run (MEMORY_PROFILE).
+    print("\n***************** Classification report ***************************")
     outfile = open("classification_report.csv", "w", newline='\n')
     outfile_writer = csv.writer(outfile)
-    outfile_writer.writerow(["Name", "Precision", "Recall", "F1", "Accuracy"]) # Header row
-
-    i = 0
-    while i < len(models_tfidf): # Loop through models
-        print("Making predictions for " + model_names[i] + "....")
-        p, r, f, a = test_model_tfidf(models_tfidf[i], vectorizer, test_documents, test_labels)
-        if models_tfidf[i] is None:  # Models will be None if functions have not yet been implemented
-            outfile_writer.writerow([model_names[i] + " + TFIDF", "N/A", "N/A", "N/A", "N/A"])
-        else:
-            outfile_writer.writerow([model_names[i] + " + TFIDF", p, r, f, a])
-
-        p, r, f, a = test_model_w2v(models_w2v[i], word2vec, test_documents, test_labels)
-        if models_w2v[i] is None: # Models will be None if functions have not yet been implemented
-            outfile_writer.writerow([model_names[i]+" + w2v","N/A", "N/A", "N/A", "N/A"])
-        else:
-            outfile_writer.writerow([model_names[i]+" + w2v", p, r, f, a])
-        i += 1
+    outfile_writer.writerow(["Name", "Precision", "Recall", "F1", "Accuracy", "Train Seconds", "Test Seconds",
+                             "Featurize Seconds", "Predict Seconds", "Docs/sec", "P50 Latency ms", "P99 Latency ms",
+                             "Peak Memory MB"]) # Header row
+
+    for result in results:
+        outfile_writer.writerow([result.name, result.precision, result.recall, result.f1, result.accuracy,
+                                 result.train_seconds, result.test_seconds, result.featurize_seconds,
+                                 result.predict_seconds, result.docs_per_sec, result.p50_ms, result.p99_ms,
+                                 "N/A" if result.peak_memory_mb is None else result.peak_memory_mb])
+    # Wall-clock time of all jobs together, which is less than the sum of the jobs when they run in parallel
+    outfile_writer.writerow(["Total", "N/A", "N/A", "N/A", "N/A", total_seconds] + ["N/A"] * 7)
     outfile.close()
 
 
@@ -36,7 +36,14 @@ from sklearn.naive_bayes import GaussianNB
 from sklearn.linear_model import LogisticRegression
 from sklearn.svm import LinearSVC
 from sklearn.neural_network import MLPClassifier
-from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_score
+
+from embedding_store import embed_token_lists, is_embedding_store, load_embedding_store, open_embeddings
+from evaluation import evaluate_predictions
+from nltk_resources import require
+from pos_tagger import POS_TAGGER
+from sparse_models import fit_sparse, predict_sparse
+from stylistic import STYLISTIC_ANALYZER, count_pos_categories
+from tokenizer import TOKENIZER
 
 
 # Before running code that makes use of Word2Vec, you will need to download the provided w2v.pkl file
@@ -47,11 +54,20 @@ from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_sc
 # file elsewhere, you will need to update the file path accordingly.
 EMBEDDING_FILE = "w2v.pkl"
 
+# Memory-mapped copy of EMBEDDING_FILE (see embedding_store.py).  It is created
+# from EMBEDDING_FILE the first time the main function runs and reused afterwards.
+EMBEDDING_STORE = "w2v_store"
+
 
 # Function: load_w2v
-# filepath: path of w2v.pkl
+# filepath: path of w2v.pkl, or of an embedding store directory written by embedding_store.py
 # Returns: A dictionary containing words as keys and pre-trained word2vec representations as numpy arrays of shape (300,)
+#
+# An embedding store is memory-mapped instead of unpickled; it answers the same
+# "token in word2vec" and "word2vec[token]" lookups as the dictionary.
 def load_w2v(filepath):
+    if is_embedding_store(filepath):
+        return load_embedding_store(filepath)
     with open(filepath, 'rb') as fin:
         return pkl.load(fin)
 
@@ -84,14 +100,11 @@ def extract_user_info(user_input):
 # Args:
 #   inp_str: input string
 # Returns: token list, dtype: list of strings
+#
+# The shared WordTokenizer (tokenizer.py) returns the same tokens as
+# nltk.tokenize.word_tokenize, but resolves the NLTK resources only once.
 def get_tokens(inp_str):
-    # Initialize NLTK tokenizer
-    try:
-        nltk.data.find('tokenizers/punkt')
-    except LookupError:
-        print("NLTK tokenizer not found, downloading...")
-        nltk.download('punkt')
-    return nltk.tokenize.word_tokenize(inp_str)
+    return TOKENIZER.tokenize(inp_str)
 
 
 # Function: vectorize_train, see project statement for more details
@@ -154,6 +167,20 @@ def string2vec(word2vec, user_input):
     return avg_embed
 
 
+# Function: string2vec_batch(word2vec, documents)
+# word2vec: The pretrained Word2Vec model
+# documents: A list of strings of arbitrary length
+# Returns: A (len(documents), 300) float64 matrix whose rows are the string2vec embeddings of the documents
+#
+# This function is the vectorized form of string2vec for whole corpora: every
+# token is mapped to an integer row id, the rows are gathered in one step and
+# averaged per document with segment sums instead of per-token Python lists.
+# The averages stay in float64 like string2vec's, so that the models see the same
+# features in training, testing and the chatbot.
+def string2vec_batch(word2vec, documents):
+    return embed_token_lists(word2vec, TOKENIZER.tokenize_many(documents), dtype=np.float64)
+
+
 # Function: instantiate_models()
 # This function does not take any input
 # Returns: Four instantiated machine learning models
@@ -177,10 +204,11 @@ def instantiate_models():
 # Returns: A trained version of the input model
 #
 # This function trains an input machine learning model using TFIDF
-# embeddings for the training documents.
+# embeddings for the training documents.  The document-term matrix stays sparse;
+# dense-only models (GaussianNB) are fitted on bounded dense chunks of it.
 def train_model_tfidf(model, tfidf_train, training_labels):
-    # Convert the training data to a numpy_array and apply the labels
-    return model.fit(tfidf_train.toarray(), training_labels)
+    # Fit on the sparse matrix and apply the labels
+    return fit_sparse(model, tfidf_train, training_labels)
 
 
 # Function: train_model_w2v(model, word2vec, training_documents, training_labels)
@@ -193,14 +221,11 @@ def train_model_tfidf(model, tfidf_train, training_labels):
 # This function trains an input machine learning model using averaged Word2Vec
 # embeddings for the training documents.
 def train_model_w2v(model, word2vec, training_documents, training_labels):
-    # Convert training_document to embedding w2v
-    embedding_lst = []
-    for document in training_documents:
-        word2vec_converter = string2vec(word2vec, document)
-        embedding_lst.append(word2vec_converter)
+    # Convert training_document to embedding w2v, as one matrix
+    embedding_matrix = string2vec_batch(word2vec, training_documents)
 
-    # Casting embedding to a matrix array and return fit model
-    return model.fit(np.array(embedding_lst), training_labels)
+    # Fit the model on the embedding matrix
+    return model.fit(embedding_matrix, training_labels)
 
 
 # Function: test_model_tfidf(model, word2vec, training_documents, training_labels)
@@ -216,18 +241,15 @@ def train_model_w2v(model, word2vec, training_documents, training_labels):
 # precision, recall, f1, and accuracy scores.
 def test_model_tfidf(model, vectorizer, test_documents, test_labels):
     # Vectorizing to normalize each word from the test document
-    # Convert to array type to apply for model prediction
-    model_test_vector = vectorizer.transform(test_documents).toarray()
+    # The matrix stays sparse; dense-only models predict on bounded dense chunks
+    model_test_vector = vectorizer.transform(test_documents)
 
     # Predict labels
-    label_predicts = model.predict(model_test_vector)
+    label_predicts = predict_sparse(model, model_test_vector)
 
-    # Statistical performing calculation
+    # Statistical performing calculation, from a single count of the confusion matrix
     # Update variables above to appropriate type
-    precision = precision_score(test_labels, label_predicts)
-    recall    = recall_score(test_labels, label_predicts)
-    f1        = f1_score(test_labels, label_predicts)
-    accuracy  = accuracy_score(test_labels, label_predicts)
+    precision, recall, f1, accuracy = evaluate_predictions(test_labels, label_predicts)
 
     return precision, recall, f1, accuracy
 
@@ -244,30 +266,24 @@ def test_model_tfidf(model, vectorizer, test_documents, test_labels):
 # that document.  It compares the predicted and actual test labels and returns
 # precision, recall, f1, and accuracy scores.
 def test_model_w2v(model, word2vec, test_documents, test_labels):
-    # Convert training_document to embedding w2v
-    model_test_vector = []
-    for document in test_documents:
-        word2vec_converter = string2vec(word2vec, document)
-        model_test_vector.append(word2vec_converter)
+    # Convert test_documents to embedding w2v, as one matrix
+    model_test_vector = string2vec_batch(word2vec, test_documents)
 
     # Predict labels
     label_predicts = model.predict(model_test_vector)
 
-    # Statistical performing calculation
+    # Statistical performing calculation, from a single count of the confusion matrix
     # Update variables above to appropriate type
-    precision = precision_score(test_labels, label_predicts)
-    recall = recall_score(test_labels, label_predicts)
-    f1 = f1_score(test_labels, label_predicts)
-    accuracy = accuracy_score(test_labels, label_predicts)
+    precision, recall, f1, accuracy = evaluate_predictions(test_labels, label_predicts)
 
     return precision, recall, f1, accuracy
 
 
 # -------------------------- New in Project Part 2! --------------------------
 
-# Import and download required mode for nltk module
-nltk.download('averaged_perceptron_tagger')
-nltk.download('punkt')  # Download "punkt" mode from nltk for word tokenizer
+# The NLTK data used below (Punkt for the tokenizers, the perceptron tagger for
+# get_pos_tags) is located on first use by nltk_resources.require, and only
+# downloaded if it is missing, instead of being downloaded on every import
 
 
 # Helper function: count_punc(str_lst, punc, num)
@@ -291,6 +307,7 @@ def count_punc(str_lst: list, punc: list, num: int = 0) -> int:
 #
 # This function counts the number of words in the input string.
 def count_words(user_input):
+    require("punkt")
     word_list = nltk.tokenize.word_tokenize(user_input)   # Auto tokenizer
 
     # Get num word and substract with num punctuation
@@ -307,6 +324,7 @@ def count_words(user_input):
 #
 # This function computes the average number of words per sentence
 def words_per_sentence(user_input):
+    require("punkt")
     sentences = nltk.tokenize.sent_tokenize(user_input)
 
     # Edge cases when user entering no input
@@ -329,10 +347,12 @@ def get_pos_tags(user_input):
     tagged_input = []
 
     # Tokenize into words
+    require("punkt")
     tokens = nltk.word_tokenize(user_input)
 
     # Perform the tag with each token appropriately
-    pos_tags = nltk.pos_tag(tokens)
+    # POS_TAGGER is loaded once and shared, unlike nltk.pos_tag which may reload the tagger (see pos_tagger.py)
+    pos_tags = POS_TAGGER.tag(tokens)
     for token, pos in pos_tags:
         pair_tag = (token, pos)
         tagged_input.append(pair_tag)
@@ -350,29 +370,9 @@ def get_pos_tags(user_input):
 # groups, and returns those values.  The Penn Treebag tags corresponding that
 # belong to each category can be found in Table 2 of the project statement.
 def get_pos_categories(tagged_input):
-
-    ''' Defined a helper function to check each case of tag'''
-    # Helper function: _get_pos_categories(tagged_lst, num)
-    # Parameter(s):
-    #     + tagged_lst: list[str]: A list of all possible tagged
-    #     + num: (int): By default = 0 to calculate the number of appropriate tag
-    # Return: (int)
-    # This function checked whether the tag appeared correctly or not
-    # If yes, the enumerator will increment by 1
-    def _get_pos_categories(tagged_lst: list[str], num: int = 0) -> int:
-      # Check whether the tagged is in the expected
-      # If yes, increment by 1
-      for token, pos in tagged_input:
-          num += (1 if pos in tagged_lst else 0)
-      return num
-
-    # Calculating number of each tag in the group
-    num_pronouns = _get_pos_categories(['PRP', 'PRP$', 'WP', 'WP$'])
-    num_prp = _get_pos_categories(['PRP'])
-    num_articles = _get_pos_categories(['DT'])
-    num_past = _get_pos_categories(['VBD', 'VBN'])
-    num_future = _get_pos_categories(['MD'])
-    num_prep = _get_pos_categories(['IN'])
+    # Count every category in a single pass over the tags, through the precomputed
+    # tag -> categories table of stylistic.py (POS_CATEGORIES lists the tags of each group)
+    num_pronouns, num_prp, num_articles, num_past, num_future, num_prep = count_pos_categories(tagged_input)
 
     return num_pronouns, num_prp, num_articles, num_past, num_future, num_prep
 
@@ -384,6 +384,7 @@ def get_pos_categories(tagged_input):
 # This function counts the number of negation terms in a user input string
 def count_negations(user_input):
     num_negations = 0
+    require("punkt")
     word_splitLst = nltk.word_tokenize(user_input) # Split data
     negation_list = ['no', 'not', 'never', 'n\'t'] # Declare constant negation
 
@@ -482,7 +483,7 @@ if __name__ == "__main__":
     documents, labels = load_as_list("dataset.csv")
 
     # Load the Word2Vec representations so that you can make use of it later
-    word2vec = load_w2v(EMBEDDING_FILE)  # Use if you selected a Word2Vec model
+    word2vec = open_embeddings(EMBEDDING_FILE, EMBEDDING_STORE)  # Use if you selected a Word2Vec model
 
     # Compute TFIDF representations so that you can make use of them later
     # vectorizer, tfidf_train = vectorize_train(documents)  # Use if you selected a TFIDF model
@@ -539,11 +540,10 @@ if __name__ == "__main__":
 
     # -------------------------- New in Project Part 2! --------------------------
     user_input = input("I'd also like to do a quick stylistic analysis. What's on your mind today?\n")
-    num_words = count_words(user_input)
-    wps = words_per_sentence(user_input)
-    pos_tags = get_pos_tags(user_input)
-    num_pronouns, num_prp, num_articles, num_past, num_future, num_prep = get_pos_categories(pos_tags)
-    num_negations = count_negations(user_input)
+    # Same values as count_words, words_per_sentence, get_pos_categories(get_pos_tags(...)) and
+    # count_negations, with the input tokenized and tagged only once (see stylistic.py)
+    num_words, wps, num_pronouns, num_prp, num_articles, num_past, num_future, num_prep, num_negations = \
+        STYLISTIC_ANALYZER.analyze(user_input)
 
     # Uncomment the code below to view your output from each individual function
     # print("num_words:\t{0}\nwps:\t{1}\npos_tags:\t{2}\nnum_pronouns:\t{3}\nnum_prp:\t{4}"
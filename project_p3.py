@@ -19,11 +19,22 @@ import pickle as pkl
 from sklearn.linear_model import LogisticRegression
 from sklearn.svm import LinearSVC
 from sklearn.neural_network import MLPClassifier
-from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_score
 import string
 import re
 import csv
 import nltk
+import asyncio
+import time
+
+from embedding_store import embed_token_lists, is_embedding_store, load_embedding_store, open_embeddings
+from evaluation import evaluate_predictions
+from instrumentation import is_enabled, record, stage
+from model_bundle import StaleBundleError, load_bundle, save_bundle
+from nltk_resources import require, require_all
+from pos_tagger import POS_TAGGER
+from sparse_models import fit_sparse, predict_sparse
+from stylistic import STYLISTIC_ANALYZER, count_pos_categories
+from word_scores import WordScoreModel, open_word_scores
 
 #-----------------------------------CODE FROM PART 1--------------------------------------------------
 
@@ -35,11 +46,30 @@ import nltk
 # file elsewhere, you will need to update the file path accordingly.
 EMBEDDING_FILE = "w2v.pkl"
 
+# Memory-mapped copy of EMBEDDING_FILE (see embedding_store.py).  It is created
+# from EMBEDDING_FILE the first time the main function runs and reused afterwards.
+EMBEDDING_STORE = "w2v_store"
+
+# Trained chatbot model saved by the main function (see model_bundle.py).  The
+# model is trained and saved on the first run, then loaded by later runs as long
+# as dataset.csv, the embedding store and scikit-learn stay the same.
+MODEL_BUNDLE = "svm_w2v_bundle"
+
+# Per-word scores of the linear model of MODEL_BUNDLE (see word_scores.py).  The
+# main function exports them from the bundle and classifies with them, which
+# needs one score per token instead of averaging 300-dimensional embeddings.
+WORD_SCORES = "svm_w2v_scores"
+
 
 # Function: load_w2v
-# filepath: path of w2v.pkl
+# filepath: path of w2v.pkl, or of an embedding store directory written by embedding_store.py
 # Returns: A dictionary containing words as keys and pre-trained word2vec representations as numpy arrays of shape (300,)
+#
+# An embedding store is memory-mapped instead of unpickled; it answers the same
+# "token in word2vec" and "word2vec[token]" lookups as the dictionary.
 def load_w2v(filepath):
+    if is_embedding_store(filepath):
+        return load_embedding_store(filepath)
     with open(filepath, 'rb') as fin:
         return pkl.load(fin)
 
@@ -135,6 +165,20 @@ def string2vec(word2vec, user_input):
     return avg_embed
 
 
+# Function: string2vec_batch(word2vec, documents)
+# word2vec: The pretrained Word2Vec model
+# documents: A list of strings of arbitrary length
+# Returns: A (len(documents), 300) float64 matrix whose rows are the string2vec embeddings of the documents
+#
+# This function is the vectorized form of string2vec for whole corpora: every
+# token is mapped to an integer row id, the rows are gathered in one step and
+# averaged per document with segment sums instead of per-token Python lists.
+# The averages stay in float64 like string2vec's, so that the models see the same
+# features in training, testing and the chatbot.
+def string2vec_batch(word2vec, documents):
+    return embed_token_lists(word2vec, [get_tokens(document) for document in documents], dtype=np.float64)
+
+
 # Function: instantiate_models()
 # This function does not take any input
 # Returns: Four instantiated machine learning models
@@ -160,8 +204,8 @@ def instantiate_models():
 # This function trains an input machine learning model using averaged Word2Vec
 # embeddings for the training documents.
 def train_model_tfidf(model, tfidf_train, training_labels):
-    # Convert the training data to a numpy_array and apply the labels
-    return model.fit(tfidf_train.toarray(), training_labels)
+    # Fit on the sparse matrix; dense-only models (GaussianNB) are fitted on bounded dense chunks
+    return fit_sparse(model, tfidf_train, training_labels)
 
 
 # Function: train_model_w2v(model, word2vec, training_documents, training_labels)
@@ -174,14 +218,11 @@ def train_model_tfidf(model, tfidf_train, training_labels):
 # This function trains an input machine learning model using averaged Word2Vec
 # embeddings for the training documents.
 def train_model_w2v(model, word2vec, training_documents, training_labels):
-    # Convert training_document to embedding w2v
-    embedding_lst = []
-    for document in training_documents:
-        word2vec_converter = string2vec(word2vec, document)
-        embedding_lst.append(word2vec_converter)
+    # Convert training_document to embedding w2v, as one matrix
+    embedding_matrix = string2vec_batch(word2vec, training_documents)
 
-    # Casting embedding to a matrix array and return fit model
-    return model.fit(np.array(embedding_lst), training_labels)
+    # Fit the model on the embedding matrix
+    return model.fit(embedding_matrix, training_labels)
 
 
 # Function: test_model_tfidf(model, word2vec, training_documents, training_labels)
@@ -202,18 +243,15 @@ def test_model_tfidf(model, vectorizer, test_documents, test_labels):
     accuracy = None
 
     # Vectorizing to normalize each word from the test document
-    # Convert to array type to apply for model prediction
-    model_test_vector = vectorizer.transform(test_documents).toarray()
+    # The matrix stays sparse; dense-only models predict on bounded dense chunks
+    model_test_vector = vectorizer.transform(test_documents)
 
     # Predict labels
-    label_predicts = model.predict(model_test_vector)
+    label_predicts = predict_sparse(model, model_test_vector)
 
-    # Statistical performing calculation
+    # Statistical performing calculation, from a single count of the confusion matrix
     # Update variables above to appropriate type
-    precision = precision_score(test_labels, label_predicts)
-    recall = recall_score(test_labels, label_predicts)
-    f1 = f1_score(test_labels, label_predicts)
-    accuracy = accuracy_score(test_labels, label_predicts)
+    precision, recall, f1, accuracy = evaluate_predictions(test_labels, label_predicts)
 
     return precision, recall, f1, accuracy
 
@@ -235,30 +273,24 @@ def test_model_w2v(model, word2vec, test_documents, test_labels):
     f1 = None
     accuracy = None
 
-    # Convert training_document to embedding w2v
-    model_test_vector = []
-    for document in test_documents:
-        word2vec_converter = string2vec(word2vec, document)
-        model_test_vector.append(word2vec_converter)
+    # Convert test_documents to embedding w2v, as one matrix
+    model_test_vector = string2vec_batch(word2vec, test_documents)
 
     # Predict labels
     label_predicts = model.predict(model_test_vector)
 
-    # Statistical performing calculation
+    # Statistical performing calculation, from a single count of the confusion matrix
     # Update variables above to appropriate type
-    precision = precision_score(test_labels, label_predicts)
-    recall = recall_score(test_labels, label_predicts)
-    f1 = f1_score(test_labels, label_predicts)
-    accuracy = accuracy_score(test_labels, label_predicts)
+    precision, recall, f1, accuracy = evaluate_predictions(test_labels, label_predicts)
 
     return precision, recall, f1, accuracy
 
 #-----------------------------------CODE FROM PART 2--------------------------------------------------
 
 
-# Import and download required mode for nltk module
-nltk.download('averaged_perceptron_tagger')
-nltk.download('punkt')  # Download "punkt" mode from nltk for word tokenizer
+# The NLTK data used below (Punkt for the tokenizers, the perceptron tagger for
+# get_pos_tags) is located on first use by nltk_resources.require, and only
+# downloaded if it is missing, instead of being downloaded on every import
 
 
 # Helper function: count_punc(str_lst, punc, num)
@@ -282,6 +314,7 @@ def count_punc(str_lst: list, punc: list, num: int = 0) -> int:
 #
 # This function counts the number of words in the input string.
 def count_words(user_input):
+    require("punkt")
     word_list = nltk.tokenize.word_tokenize(user_input)  # Auto tokenizer
 
     # Get num word and substract with num punctuation
@@ -298,6 +331,7 @@ def count_words(user_input):
 #
 # This function computes the average number of words per sentence
 def words_per_sentence(user_input):
+    require("punkt")
     sentences = nltk.tokenize.sent_tokenize(user_input)
 
     # Edge cases when user entering no input
@@ -320,10 +354,12 @@ def get_pos_tags(user_input):
     tagged_input = []
 
     # Tokenize into words
+    require("punkt")
     tokens = nltk.word_tokenize(user_input)
 
     # Perform the tag with each token appropriately
-    pos_tags = nltk.pos_tag(tokens)
+    # POS_TAGGER is loaded once and shared, unlike nltk.pos_tag which may reload the tagger (see pos_tagger.py)
+    pos_tags = POS_TAGGER.tag(tokens)
     for token, pos in pos_tags:
         pair_tag = (token, pos)
         tagged_input.append(pair_tag)
@@ -341,30 +377,9 @@ def get_pos_tags(user_input):
 # groups, and returns those values.  The Penn Treebag tags corresponding that
 # belong to each category can be found in Table 2 of the project statement.
 def get_pos_categories(tagged_input):
-
-    ''' Defined a helper function to check each case of tag'''
-
-    # Helper function: _get_pos_categories(tagged_lst, num)
-    # Parameter(s):
-    #     + tagged_lst: list[str]: A list of all possible tagged
-    #     + num: (int): By default = 0 to calculate the number of appropriate tag
-    # Return: (int)
-    # This function checked whether the tag appeared correctly or not
-    # If yes, the enumerator will increment by 1
-    def _get_pos_categories(tagged_lst: list[str], num: int = 0) -> int:
-        # Check whether the tagged is in the expected
-        # If yes, increment by 1
-        for token, pos in tagged_input:
-            num += (1 if pos in tagged_lst else 0)
-        return num
-
-    # Calculating number of each tag in the group
-    num_pronouns = _get_pos_categories(['PRP', 'PRP$', 'WP', 'WP$'])
-    num_prp = _get_pos_categories(['PRP'])
-    num_articles = _get_pos_categories(['DT'])
-    num_past = _get_pos_categories(['VBD', 'VBN'])
-    num_future = _get_pos_categories(['MD'])
-    num_prep = _get_pos_categories(['IN'])
+    # Count every category in a single pass over the tags, through the precomputed
+    # tag -> categories table of stylistic.py (POS_CATEGORIES lists the tags of each group)
+    num_pronouns, num_prp, num_articles, num_past, num_future, num_prep = count_pos_categories(tagged_input)
 
     return num_pronouns, num_prp, num_articles, num_past, num_future, num_prep
 
@@ -376,6 +391,7 @@ def get_pos_categories(tagged_input):
 # This function counts the number of negation terms in a user input string
 def count_negations(user_input):
     num_negations = 0
+    require("punkt")
     word_splitLst = nltk.word_tokenize(user_input)  # Split data
     negation_list = ['no', 'not', 'never', 'n\'t']  # Declare constant negation
 
@@ -468,17 +484,351 @@ def summarize_analysis(num_words, wps, num_pronouns, num_prp, num_articles, num_
 # Import module for regular expression
 import re
 
+# Prompts and replies of the dialogue states.  They are shared with the asyncio
+# engine of chatbot_server.py, which runs the same dialogue for many users at once.
+WELCOME_MESSAGE = "Welcome to the CS 421 chatbot!  "
+NAME_PROMPT = "What is your name?\n"
+SENTIMENT_PROMPT = "Thanks {0}!  What do you want to talk about today?\n"
+STYLISTIC_PROMPT = "I'd also like to do a quick stylistic analysis. What's on your mind today?\n"
+STYLISTIC_HEADER = "Thanks!  Based on my stylistic analysis, I've identified the following psychological correlates in your response:"
+NEXT_ACTION_MENU = (
+    "\nOut ChatBot follows a structure allow the user to have Sentiment or Stylistic Analysis\n \
+                  or you could terminate the ChatBot immediately from this step",
+    "Which action state would you like to enter next? Below are 3 possible options:",
+    "\t\t(a) Quit",
+    "\t\t(b) Redo Sentiment Analysis",
+    "\t\t(c) Redo Stylistic Analysis",
+)
+NEXT_ACTION_PROMPT = "Enter your choice, only type (a) or (b) or (c) format: "
+QUIT_MESSAGE = (
+    "",
+    "************************************",
+    "Thank you for choosing the ChatBot!!",
+    "************************************",
+)
+
+
+# Function: predict_sentiment(model, user_input, vectorizer=None, word2vec=None)
+# model: The trained classification model used for predicting sentiment
+# user_input: A string of arbitrary length
+# vectorizer: OPTIONAL; The trained vectorizer, if using TFIDF (leave empty otherwise)
+# word2vec: OPTIONAL; The pretrained Word2Vec model, if using Word2Vec (leave empty otherwise)
+# Returns: The label predicted by the model, as a numpy array of shape (1,)
+#
+# model can also be the WordScoreModel of a linear Word2Vec model, which predicts
+# the same label from per-word scores.  The steps are timed as the
+# sentiment/tokenize, sentiment/embed (sentiment/vectorize for a TF-IDF model)
+# and sentiment/predict stages (see instrumentation.py); string2vec and the
+# vectorizer tokenize the input within sentiment/embed and sentiment/vectorize.
+def predict_sentiment(model, user_input, vectorizer=None, word2vec=None):
+    if isinstance(model, WordScoreModel):
+        with stage("sentiment/tokenize"):
+            tokens = get_tokens(user_input)
+        with stage("sentiment/predict"):
+            return model.predict_token_lists([tokens])
+
+    if vectorizer is not None:
+        with stage("sentiment/vectorize"):
+            test = vectorizer.transform([user_input])  # TFIDF model
+        with stage("sentiment/predict"):
+            return predict_sparse(model, test)
+
+    with stage("sentiment/embed"):
+        test = string2vec(word2vec, user_input)  # w2v model
+
+    with stage("sentiment/predict"):
+        return model.predict(test.reshape(1, -1))
+
+
+# Function: predict_sentiment_batch(model, user_inputs, vectorizer=None, word2vec=None)
+# model: The trained classification model used for predicting sentiment
+# user_inputs: A list of strings of arbitrary length
+# vectorizer: OPTIONAL; The trained vectorizer, if using TFIDF (leave empty otherwise)
+# word2vec: OPTIONAL; The pretrained Word2Vec model, if using Word2Vec (leave empty otherwise)
+# Returns: A numpy array holding the label of every input, equal to predict_sentiment on each of them
+#
+# The inputs are embedded together, averaged in float64 like string2vec, and
+# the model predicts the stacked matrix with a single call.  The steps are timed
+# per batch as the sentiment_batch/tokenize, sentiment_batch/embed and
+# sentiment_batch/predict stages.  With a TF-IDF model, the vectorizer transforms
+# all the inputs at once in the sentiment_batch/vectorize stage.
+def predict_sentiment_batch(model, user_inputs, vectorizer=None, word2vec=None):
+    if vectorizer is not None and not isinstance(model, WordScoreModel):
+        with stage("sentiment_batch/vectorize"):
+            test = vectorizer.transform(user_inputs)  # TFIDF model
+        with stage("sentiment_batch/predict"):
+            return predict_sparse(model, test)
+
+    with stage("sentiment_batch/tokenize"):
+        token_lists = [get_tokens(user_input) for user_input in user_inputs]
+    if isinstance(model, WordScoreModel):
+        with stage("sentiment_batch/predict"):
+            return model.predict_token_lists(token_lists)
+
+    with stage("sentiment_batch/embed"):
+        test = embed_token_lists(word2vec, token_lists, dtype=np.float64)  # w2v model
+
+    with stage("sentiment_batch/predict"):
+        return model.predict(test)
+
+
+# Function: sentiment_reply(label)
+# label: The label returned by predict_sentiment
+# Returns: The chatbot's answer to that label
+def sentiment_reply(label):
+    if label == 0:
+        return "Hmm, it seems like you're feeling a bit down."
+    elif label == 1:
+        return "It sounds like you're in a positive mood!"
+    return "Hmm, that's weird.  My classifier predicted a value of: {0}".format(label)
+
+
+# Function: stylistic_correlates(user_input)
+# user_input: A string of arbitrary length
+# Returns: The list of informative psychological correlates returned by summarize_analysis
+def stylistic_correlates(user_input):
+    # Same values as count_words, words_per_sentence, get_pos_categories(get_pos_tags(...)) and
+    # count_negations, with the input tokenized and tagged only once (see stylistic.py)
+    num_words, wps, num_pronouns, num_prp, num_articles, num_past, num_future, num_prep, num_negations = \
+        STYLISTIC_ANALYZER.analyze(user_input)
+
+    # Uncomment the code below to view your output from each individual function
+    # print("num_words:\t{0}\nwps:\t{1}\npos_tags:\t{2}\nnum_pronouns:\t{3}\nnum_prp:\t{4}"
+    #      "\nnum_articles:\t{5}\nnum_past:\t{6}\nnum_future:\t{7}\nnum_prep:\t{8}\nnum_negations:\t{9}".format(
+    #    num_words, wps, pos_tags, num_pronouns, num_prp, num_articles, num_past, num_future, num_prep, num_negations))
+
+    # Generate a stylistic analysis of the user's input
+    with stage("stylistic/summarize"):
+        return summarize_analysis(num_words, wps, num_pronouns,
+                                  num_prp, num_articles, num_past,
+                                  num_future, num_prep, num_negations)
+
+
+# Function: stylistic_reply(informative_correlates)
+# informative_correlates: The list returned by stylistic_correlates
+# Returns: The lines of the chatbot's answer
+def stylistic_reply(informative_correlates):
+    return [STYLISTIC_HEADER] + ["- {0}".format(correlate) for correlate in informative_correlates]
+
+
+# Table-driven dialogue state machine
+#
+# The dialogue of run_chatbot is described by two tables instead of an if/elif
+# chain:
+#   - STATE_HANDLERS maps every state to a coroutine that talks to the user and
+#     returns an outcome, e.g. "first" or "again" for sentiment_analysis, or the
+#     menu choice "(a)", "(b)" or "(c)" for the next-action states;
+#   - TRANSITIONS maps every (state, outcome) pair to the next state.
+# The handlers only talk to the user through an I/O object with two coroutines,
+# say(text) and ask(prompt): ConsoleIO uses print() and input() (run_chatbot and
+# the state functions below), chatbot_server.StreamIO a socket, and
+# dialogue.ScriptedIO a list of answers, so the bot runs headless.
+
+
+# Class: ChatSession()
+#
+# The per-conversation state of run_chatbot: the current state, the user's name
+# and whether the first sentiment/stylistic round is still running.
+class ChatSession:
+    def __init__(self):
+        self.state = None
+        self.name = ""
+        self.is_first = True
+
+
+# Class: ConsoleIO()
+#
+# The I/O of run_chatbot: print() and input().
+class ConsoleIO:
+    async def say(self, text):
+        print(text)
+
+    async def ask(self, prompt):
+        return input(prompt)
+
+
+# The I/O of one state, with the time spent waiting in ask() (for the user's answer) kept apart
+class _TimedIO:
+    __slots__ = ("io", "wait")
+
+    def __init__(self, io):
+        self.io = io
+        self.wait = 0.0
+
+    async def say(self, text):
+        await self.io.say(text)
+
+    async def ask(self, prompt):
+        start = time.perf_counter()
+        try:
+            return await self.io.ask(prompt)
+        finally:
+            seconds = time.perf_counter() - start
+            self.wait += seconds
+            if is_enabled():
+                record("io/wait", seconds)
+
+
+# State handlers: handler(bot, session, io) talks to the user and returns the outcome of the state
+async def handle_welcome(bot, session, io):
+    await io.say(WELCOME_MESSAGE)
+    return "done"
+
+
+async def handle_get_user_info(bot, session, io):
+    session.name = extract_user_info(await io.ask(NAME_PROMPT))
+    return "done"
+
+
+async def handle_sentiment_analysis(bot, session, io):
+    user_input = await io.ask(SENTIMENT_PROMPT.format(session.name))
+    await io.say(sentiment_reply(await bot.predict(user_input)))
+    # After the first round, the user chooses what comes next right away
+    return "first" if session.is_first else "again"
+
+
+async def handle_stylistic_analysis(bot, session, io):
+    user_input = await io.ask(STYLISTIC_PROMPT)
+    for line in stylistic_reply(await bot.analyze(user_input)):
+        await io.say(line)
+    return "done"
+
+
+# The menu is repeated until the answer is valid
+async def handle_check_next_state(bot, session, io):
+    user_input = ""
+    while not valid_nextAction(user_input):
+        for line in NEXT_ACTION_MENU:
+            await io.say(line)
+        user_input = await io.ask(NEXT_ACTION_PROMPT)
+    return user_input.strip()
+
+
+# The menu shown after a stylistic analysis also ends the first round
+async def handle_check_next_action(bot, session, io):
+    choice = await handle_check_next_state(bot, session, io)
+    session.is_first = not session.is_first
+    return choice
+
+
+async def handle_quit(bot, session, io):
+    for line in QUIT_MESSAGE:
+        await io.say(line)
+    return None
+
+
+INITIAL_STATE = "welcome"
+
+STATE_HANDLERS = {
+    "welcome": handle_welcome,
+    "get_user_info": handle_get_user_info,
+    "sentiment_analysis": handle_sentiment_analysis,
+    "stylistic_analysis": handle_stylistic_analysis,
+    "check_next_action": handle_check_next_action,
+    "check_next_state": handle_check_next_state,
+    "quit": handle_quit,
+}
+
+# (state, outcome) -> next state; a handler returning None ends the conversation
+MENU_CHOICES = {"(a)": "quit", "(b)": "sentiment_analysis", "(c)": "stylistic_analysis"}
+TRANSITIONS = {
+    ("welcome", "done"): "get_user_info",
+    ("get_user_info", "done"): "sentiment_analysis",
+    ("sentiment_analysis", "first"): "stylistic_analysis",
+    ("sentiment_analysis", "again"): "check_next_state",
+    ("stylistic_analysis", "done"): "check_next_action",
+}
+TRANSITIONS.update({("check_next_action", choice): state for choice, state in MENU_CHOICES.items()})
+TRANSITIONS.update({("check_next_state", choice): state for choice, state in MENU_CHOICES.items()})
+
+
+# Class: DialogueBot(model, vectorizer=None, word2vec=None, on_state=None)
+# model: A trained classification model
+# vectorizer: OPTIONAL; The trained vectorizer, if using TFIDF (leave empty otherwise)
+# word2vec: OPTIONAL; The pretrained Word2Vec model, if using Word2Vec (leave empty otherwise)
+# on_state: OPTIONAL; A function called with (state, seconds) after every state, seconds excluding io.ask()
+#
+# Runs STATE_HANDLERS and TRANSITIONS with the inference done in the calling
+# thread.  Every state is also recorded as the stage state/<state> while the
+# instrumentation is enabled (see instrumentation.py), without the time spent
+# waiting for the user's answers, which is recorded as the stage io/wait.
+# chatbot_server.ChatbotEngine overrides predict and analyze to run them in an
+# executor.
+class DialogueBot:
+    handlers = STATE_HANDLERS
+    transitions = TRANSITIONS
+
+    def __init__(self, model, vectorizer=None, word2vec=None, on_state=None):
+        self.model = model
+        self.vectorizer = vectorizer
+        self.word2vec = word2vec
+        self.on_state = on_state
+
+    # Function: predict(user_input)
+    # user_input: A string of arbitrary length
+    # Returns: The label returned by predict_sentiment
+    async def predict(self, user_input):
+        return predict_sentiment(self.model, user_input, self.vectorizer, self.word2vec)
+
+    # Function: analyze(user_input)
+    # user_input: A string of arbitrary length
+    # Returns: The informative correlates returned by stylistic_correlates
+    async def analyze(self, user_input):
+        return stylistic_correlates(user_input)
+
+    # Function: run_state(io, session)
+    # io: An object with the coroutines say(text) and ask(prompt)
+    # session: The ChatSession of the conversation, in the state to run
+    # Returns: The next state, or None once the conversation has ended
+    #
+    # The state is timed, for on_state and the instrumentation, without the time
+    # spent in io.ask().
+    async def run_state(self, io, session):
+        io = _TimedIO(io)
+        start = time.perf_counter()
+        outcome = await self.handlers[session.state](self, session, io)
+        seconds = time.perf_counter() - start - io.wait
+        if self.on_state is not None:
+            self.on_state(session.state, seconds)
+        if is_enabled():
+            record("state/" + session.state, seconds)
+        return None if outcome is None else self.transitions[(session.state, outcome)]
+
+    # Function: converse(io, session=None)
+    # io: An object with the coroutines say(text) and ask(prompt)
+    # session: OPTIONAL; The ChatSession of the conversation (a new one by default)
+    # Returns: The ChatSession, once the user has quit
+    async def converse(self, io, session=None):
+        session = session if session is not None else ChatSession()
+        session.state = INITIAL_STATE
+        while session.state is not None:
+            session.state = await self.run_state(io, session)
+        return session
+
+    # Function: run(io, session=None)
+    # Runs converse() to completion from synchronous code, e.g. run_chatbot with a ConsoleIO
+    def run(self, io, session=None):
+        return asyncio.run(self.converse(io, session))
+
+
+# Runs a single state of the console dialogue for the state functions below, and returns the next state
+def _run_console_state(state, session=None, bot=None):
+    session = session if session is not None else ChatSession()
+    session.state = state
+    bot = bot if bot is not None else DialogueBot(None)
+    return asyncio.run(bot.run_state(ConsoleIO(), session))
+
+
 # Function: welcome_state()
 # This function does not take any input
 # Returns: A string indicating the next state
 #
 # This function implements the chatbot's welcome states.  Feel free to customize
-# the welcome message!  In this state, the chatbot greets the user.
+# the welcome message!  In this state, the chatbot greets the user.  It runs the
+# "welcome" state of STATE_HANDLERS on the console.
 def welcome_state():
     # Display a welcome message to the user
-    user_input = print("Welcome to the CS 421 chatbot!  ")
-
-    return "get_user_info"
+    return _run_console_state("welcome")
 
 
 # Function: get_info_state()
@@ -490,13 +840,11 @@ def welcome_state():
 # the user's response to extract that information.
 def get_info_state():
     # Request the user's name, and accept a user response of
-    # arbitrary length.  Feel free to customize this!
-    user_input = input("What is your name?\n")
-
-    # Extract the user's name
-    name = extract_user_info(user_input)
+    # arbitrary length, with the "get_user_info" state
+    session = ChatSession()
+    next_state = _run_console_state("get_user_info", session)
 
-    return "sentiment_analysis", name
+    return next_state, session.name
 
 
 # Function: sentiment_analysis_state(name, model, vectorizer, word2vec)
@@ -509,24 +857,12 @@ def get_info_state():
 # This function implements a state that asks the user what they want to talk about,
 # and then processes their response to predict their current sentiment.
 def sentiment_analysis_state(name, model, vectorizer=None, word2vec=None):
-    # Check the user's sentiment
-    user_input = input("Thanks {0}!  What do you want to talk about today?\n".format(name))
+    # Check and predict the user's sentiment with the "sentiment_analysis" state,
+    # as in the first round of the dialogue
+    session = ChatSession()
+    session.name = name
 
-    # Predict the user's sentiment
-    # test = vectorizer.transform([user_input])  # Use if you selected a TFIDF model
-    test = string2vec(word2vec, user_input)  # Use if you selected a w2v model
-
-    label = None
-    label = model.predict(test.reshape(1, -1))
-
-    if label == 0:
-        print("Hmm, it seems like you're feeling a bit down.")
-    elif label == 1:
-        print("It sounds like you're in a positive mood!")
-    else:
-        print("Hmm, that's weird.  My classifier predicted a value of: {0}".format(label))
-
-    return "stylistic_analysis"
+    return _run_console_state("sentiment_analysis", session, DialogueBot(model, vectorizer, word2vec))
 
 
 # Function: stylistic_analysis_state()
@@ -536,28 +872,8 @@ def sentiment_analysis_state(name, model, vectorizer=None, word2vec=None):
 # This function implements a state that asks the user what's on their mind, and
 # then analyzes their response to identify informative psycholinguistic correlates.
 def stylistic_analysis_state():
-    user_input = input("I'd also like to do a quick stylistic analysis. What's on your mind today?\n")
-    num_words = count_words(user_input)
-    wps = words_per_sentence(user_input)
-    pos_tags = get_pos_tags(user_input)
-    num_pronouns, num_prp, num_articles, num_past, num_future, num_prep = get_pos_categories(pos_tags)
-    num_negations = count_negations(user_input)
-
-    # Uncomment the code below to view your output from each individual function
-    # print("num_words:\t{0}\nwps:\t{1}\npos_tags:\t{2}\nnum_pronouns:\t{3}\nnum_prp:\t{4}"
-    #      "\nnum_articles:\t{5}\nnum_past:\t{6}\nnum_future:\t{7}\nnum_prep:\t{8}\nnum_negations:\t{9}".format(
-    #    num_words, wps, pos_tags, num_pronouns, num_prp, num_articles, num_past, num_future, num_prep, num_negations))
-
-    # Generate a stylistic analysis of the user's input
-    informative_correlates = summarize_analysis(num_words, wps, num_pronouns,
-                                                num_prp, num_articles, num_past,
-                                                num_future, num_prep, num_negations)
-    print(
-        "Thanks!  Based on my stylistic analysis, I've identified the following psychological correlates in your response:")
-    for correlate in informative_correlates:
-        print("- {0}".format(correlate))
-
-    return "check_next_action"
+    # Generate a stylistic analysis of the user's input with the "stylistic_analysis" state
+    return _run_console_state("stylistic_analysis")
 
 
 ''''''''''''''''''''''''''''''''''''''''''''''''
@@ -579,37 +895,19 @@ def valid_nextAction(user_input=""):
 
 
 def user_prompt(user_input=""):
-    # Loop until user enter a valid prompt/ action choice
-    # Eliminate all invalid input from choice
-    while not valid_nextAction(user_input):
-        print("\nOut ChatBot follows a structure allow the user to have Sentiment or Stylistic Analysis\n \
-                  or you could terminate the ChatBot immediately from this step")
-        print("Which action state would you like to enter next? Below are 3 possible options:")
-        print("\t\t(a) Quit")
-        print("\t\t(b) Redo Sentiment Analysis")
-        print("\t\t(c) Redo Stylistic Analysis")
-
-        # Prompt the user input
-        user_input = input("Enter your choice, only type (a) or (b) or (c) format: ")
-
-    return user_input.strip() # Eliminate leading and trailing spaces
+    # Loop until user enter a valid prompt/ action choice, with the menu of the
+    # "check_next_state" state
+    if valid_nextAction(user_input):
+        return user_input.strip() # Eliminate leading and trailing spaces
+    return asyncio.run(handle_check_next_state(None, ChatSession(), ConsoleIO()))
 
 
 def next_state(user_input="(a)"):
-    if user_input=="(a)":
-        return "quit"
-    elif user_input=="(b)":
-        return "sentiment_analysis"
-    return "stylistic_analysis"
+    return MENU_CHOICES.get(user_input, "stylistic_analysis")
 
 
 def chatbot_quit():
-    print()
-    print("************************************")
-    print("Thank you for choosing the ChatBot!!")
-    print("************************************")
-
-    return None
+    return _run_console_state("quit")
 
 
 ''''''''''''''''''''''''''''''''''''''''''''''''
@@ -629,11 +927,9 @@ def chatbot_quit():
 # ("sentiment_analysis"), or redo the stylistic analysis
 # ("stylistic_analysis").
 def check_next_state():
-    # Prompt the user which state they would like to perform
-    user_choice = str(user_prompt())
-
-    # Return the next action appropriately from user_choice
-    return next_state(user_input=user_choice)
+    # Prompt the user which state they would like to perform, and return the
+    # next action from the transitions of the "check_next_state" state
+    return _run_console_state("check_next_state")
 
 
 # Function: run_chatbot(model, vectorizer=None):
@@ -655,60 +951,27 @@ def check_next_state():
 # check_next_state() (IN STATE) -> sentiment_analysis_state() (OUT STATE option 1) or
 #                                  stylistic_analysis_state() (OUT STATE option 2) or
 #                                  terminate chatbot
+#
+# The dialogue management logic is the state and transition tables above
+# (STATE_HANDLERS and TRANSITIONS), run here with input() and print().
 def run_chatbot(model, vectorizer=None, word2vec=None):
-    # Write your code here:
-    # print("First function run successfully")
-
-    # Chatbot starting with initial state by welcome message
-    next_state = welcome_state()
-    name = ""        # Define and initialize user_name
-    is_first = True  # Define whether chat is first time running or not
-
-    # Infinite loop for the automata representing chatbot structure
-    # until user_input requests to the exit states:
-    while (1):
-        # 1st transition:
-        # Update curr_state from welcome() --> get_name()
-        if next_state == "get_user_info":
-            next_state, name = get_info_state()
-
-        # 2nd transition:
-        # Update curr_state from get_name() --> sentiment_analysis_state()
-        elif next_state == "sentiment_analysis":
-            # if the chatbot has just performed sentiment analysis for the first time,
-            # the chatbot should move forward to stylistic_analysis_state
-            next_state = sentiment_analysis_state(name, model, vectorizer, word2vec)
-
-            # Right-now it is standing on Sentiment Analysis
-            # We should perform user_input to make the appropriate transitive
-            if not is_first:
-                next_state = check_next_state()
-
-        # 3rd transition:
-        # Update curr_state from sentiment_analysis_state() --> stylistic_analysis_state()
-        elif next_state == "stylistic_analysis":
-            next_state = stylistic_analysis_state()
-
-        # 4th transition
-        # Update curr_state from stylistic_analysis_state() --> check_next_action()
-        elif next_state == "check_next_action":
-            next_state = check_next_state()
-            is_first = not is_first     # When touching here, it means chat-box finish 1st iteration
-
-        elif next_state == "quit":
-            return chatbot_quit()
-
-    return chatbot_quit()
+    DialogueBot(model, vectorizer, word2vec).run(ConsoleIO())
+    return None
 
 
-# This is your main() function.  Use this space to try out and debug your code
-# using your terminal.  The code you include in this space will not be graded.
-if __name__ == "__main__":
+# Function: train_chatbot_bundle(bundle_dir)
+# bundle_dir: Directory to save the model bundle into
+# Returns: The saved ModelBundle
+#
+# Trains the chatbot's sentiment model on dataset.csv, measures it on test.csv
+# and saves both in bundle_dir.  Update this function (and MODEL_BUNDLE) to use a
+# different sentiment analysis model.
+def train_chatbot_bundle(bundle_dir):
     # Set things up ahead of time by training the TfidfVectorizer and Naive Bayes model
     documents, labels = load_as_list("dataset.csv")
 
     # Load the Word2Vec representations so that you can make use of it later
-    word2vec = load_w2v(EMBEDDING_FILE)  # Use if you selected a Word2Vec model
+    word2vec = open_embeddings(EMBEDDING_FILE, EMBEDDING_STORE)  # Use if you selected a Word2Vec model
 
     # Compute TFIDF representations so that you can make use of them later
     # vectorizer, tfidf_train = vectorize_train(documents)  # Use if you selected a TFIDF model
@@ -728,6 +991,39 @@ if __name__ == "__main__":
     # mlp_tfidf = train_model_tfidf(mlp_tfidf, tfidf_train, labels)
     # mlp_w2v = train_model_w2v(mlp_w2v, word2vec, documents, labels)
 
+    test_documents, test_labels = load_as_list("test.csv")
+    precision, recall, f1, accuracy = test_model_w2v(svm_w2v, word2vec, test_documents, test_labels)
+    metrics = {"precision": precision, "recall": recall, "f1": f1, "accuracy": accuracy}
+
+    save_bundle(bundle_dir, svm_w2v, "dataset.csv", word2vec=word2vec, metrics=metrics)
+    return load_bundle(bundle_dir)
+
+
+# Function: load_chatbot_bundle(bundle_dir=MODEL_BUNDLE)
+# bundle_dir: OPTIONAL; Directory of the model bundle
+# Returns: The ModelBundle of the chatbot, trained and saved first if there is no up-to-date bundle
+def load_chatbot_bundle(bundle_dir=MODEL_BUNDLE):
+    try:
+        return load_bundle(bundle_dir, "dataset.csv")
+    except (FileNotFoundError, StaleBundleError) as error:
+        print("Training the chatbot model ({0})....".format(error))
+        return train_chatbot_bundle(bundle_dir)
+
+
+# This is your main() function.  Use this space to try out and debug your code
+# using your terminal.  The code you include in this space will not be graded.
+if __name__ == "__main__":
+    # Start from the saved model, training it only when there is no up-to-date bundle
+    bundle = load_chatbot_bundle(MODEL_BUNDLE)
+    svm_w2v, word2vec = bundle.model, bundle.word2vec
+
+    # Classify with the per-word scores of the linear model, exported once from the bundle
+    svm_w2v_scores = open_word_scores(WORD_SCORES, svm_w2v, word2vec)
+
+    # Locate the NLTK data and load the POS tagger now rather than during the first stylistic analysis
+    require_all()
+    POS_TAGGER.load()
+
     # ***** New in Project Part 3! *****
     # next_state = welcome_state() # Uncomment to check how this works
     # next_state, name = get_info_state() # Uncomment to check how this works
@@ -738,4 +1034,4 @@ if __name__ == "__main__":
     # run_chatbot(mlp, word2vec=word2vec) # Example for running the chatbot with
                                         # MLP (make sure to comment/uncomment
                                         # properties of other functions as needed)
-    run_chatbot(svm_w2v, word2vec=word2vec) # Example for running the chatbot with SVM and Word2Vec---make sure your earlier functions are copied over for this to work correctly!
+    run_chatbot(svm_w2v_scores, word2vec=word2vec) # Example for running the chatbot with SVM and Word2Vec---make sure your earlier functions are copied over for this to work correctly!
@@ -0,0 +1,117 @@
+# Sparse-aware fitting and prediction helpers
+#
+# TF-IDF document-term matrices are very sparse: densifying them with .toarray()
+# allocates n_docs x vocabulary float64 values, which quickly reaches gigabytes as
+# the corpus grows.  LogisticRegression, LinearSVC and MLPClassifier accept CSR
+# matrices directly, so they are given the sparse matrix as is.  Dense-only models
+# such as GaussianNB are trained with partial_fit on dense blocks of rows instead,
+# so only one block is ever materialized at a time.
+# =========================================================================================================
+
+import numpy as np
+from scipy import sparse
+from sklearn.naive_bayes import GaussianNB
+from sklearn.utils.sparsefuncs import mean_variance_axis
+
+
+# Upper bound, in bytes, of a dense block of rows materialized from a sparse matrix
+DENSE_CHUNK_BYTES = 64 * 1024 * 1024
+
+
+# Function: accepts_sparse(model)
+# model: An instantiated machine learning model
+# Returns: True if the model can be fitted and can predict on scipy sparse matrices
+def accepts_sparse(model):
+    try:
+        return model.__sklearn_tags__().input_tags.sparse
+    except AttributeError:
+        # scikit-learn < 1.6 has no input tags; GaussianNB is the dense-only model used here
+        return not isinstance(model, GaussianNB)
+
+
+# Function: chunk_rows(matrix, chunk_bytes=DENSE_CHUNK_BYTES)
+# matrix: A 2-D matrix
+# Returns: The number of rows of matrix that fit into chunk_bytes once densified as float64
+def chunk_rows(matrix, chunk_bytes=DENSE_CHUNK_BYTES):
+    return max(1, chunk_bytes // (8 * max(1, matrix.shape[1])))
+
+
+# Function: iter_dense_chunks(matrix, chunk_bytes=DENSE_CHUNK_BYTES)
+# matrix: A 2-D sparse or dense matrix
+# Returns: A generator of (start, stop, dense block of rows start:stop)
+def iter_dense_chunks(matrix, chunk_bytes=DENSE_CHUNK_BYTES):
+    step = chunk_rows(matrix, chunk_bytes)
+    for start in range(0, matrix.shape[0], step):
+        stop = min(start + step, matrix.shape[0])
+        block = matrix[start:stop]
+        yield start, stop, block.toarray() if sparse.issparse(block) else np.asarray(block)
+
+
+# Function: fit_in_chunks(model, matrix, labels, chunk_bytes=DENSE_CHUNK_BYTES)
+# model: An instantiated machine learning model implementing partial_fit
+# matrix: A 2-D sparse or dense matrix of training features
+# labels: A list of integers (all 0 or 1)
+# Returns: The model, trained on every row of matrix
+#
+# GaussianNB derives its variance smoothing from the variance of the data passed
+# to each partial_fit call, which would make the result depend on the chunking.
+# The chunks are therefore fitted without smoothing, and the smoothing of a
+# single fit on the whole matrix is added at the end.
+def fit_in_chunks(model, matrix, labels, chunk_bytes=DENSE_CHUNK_BYTES):
+    labels = np.asarray(labels)
+    classes = np.unique(labels)
+
+    is_gaussian_nb = isinstance(model, GaussianNB)
+    if is_gaussian_nb:
+        var_smoothing = model.var_smoothing
+        model.set_params(var_smoothing=0.0)
+        # Start from scratch like fit() does
+        for attribute in ("classes_", "theta_", "var_", "class_count_", "class_prior_"):
+            if hasattr(model, attribute):
+                delattr(model, attribute)
+
+    try:
+        for start, stop, block in iter_dense_chunks(matrix, chunk_bytes):
+            model.partial_fit(block, labels[start:stop], classes=classes)
+    finally:
+        if is_gaussian_nb:
+            model.set_params(var_smoothing=var_smoothing)
+
+    if is_gaussian_nb:
+        if sparse.issparse(matrix):
+            variances = mean_variance_axis(sparse.csr_matrix(matrix, dtype=np.float64), axis=0)[1]
+        else:
+            variances = np.var(matrix, axis=0)
+        model.epsilon_ = var_smoothing * np.max(variances)
+        model.var_[:, :] += model.epsilon_
+
+    return model
+
+
+# Function: fit_sparse(model, matrix, labels)
+# model: An instantiated machine learning model
+# matrix: A 2-D scipy sparse matrix of training features
+# labels: A list of integers (all 0 or 1)
+# Returns: A trained version of the input model
+#
+# Models accepting sparse input are fitted on the CSR matrix directly; dense-only
+# models are fitted chunk by chunk with partial_fit when they support it, and on
+# the densified matrix as a last resort.
+def fit_sparse(model, matrix, labels):
+    if not sparse.issparse(matrix) or accepts_sparse(model):
+        return model.fit(matrix, labels)
+    if hasattr(model, "partial_fit"):
+        return fit_in_chunks(model, matrix, labels)
+    return model.fit(matrix.toarray(), labels)
+
+
+# Function: predict_sparse(model, matrix)
+# model: A trained machine learning model
+# matrix: A 2-D scipy sparse matrix of features
+# Returns: A numpy array of predicted labels
+#
+# Dense-only models predict one dense block of rows at a time.
+def predict_sparse(model, matrix):
+    if not sparse.issparse(matrix) or accepts_sparse(model):
+        return model.predict(matrix)
+    return np.concatenate([model.predict(block) for _, _, block in iter_dense_chunks(matrix)])
@@ -0,0 +1,203 @@
+# Single-pass stylistic analysis
+#
+# The stylistic analysis state of Parts 2 and 3 calls count_words,
+# words_per_sentence, get_pos_tags, get_pos_categories and count_negations on
+# the same input.  Each of them tokenizes the text again with word_tokenize, and
+# words_per_sentence tokenizes every sentence once more through count_words.
+#
+# StylisticAnalyzer.analyze() splits the text into sentences once, tokenizes
+# every sentence once and tags the tokens once, then derives all nine features
+# used by summarize_analysis from those tokens:
+#   analysis = STYLISTIC_ANALYZER.analyze(user_input)
+#   informative_correlates = summarize_analysis(*analysis)
+#
+# word_tokenize(text) is the concatenation of the Treebank tokens of the Punkt
+# sentences of text, so the per-sentence tokens give both the words of the whole
+# text and the words of every sentence, exactly as the Part 2 functions count them.
+# "python -m pytest test_stylistic.py" checks parity with the Part 2 functions;
+# run "python benchmarks.py stylistic" to measure latency.
+# =========================================================================================================
+
+import string
+from array import array
+from collections import Counter
+from typing import NamedTuple
+
+import numpy as np
+from scipy import sparse
+
+from instrumentation import stage
+from pos_tagger import POS_TAGGER
+from tokenizer import TOKENIZER
+
+
+# Tokens that count_negations counts
+NEGATIONS = frozenset(["no", "not", "never", "n't"])
+
+# Penn Treebank tags of each POS category returned by get_pos_categories, in order
+POS_CATEGORIES = (
+    ("num_pronouns", ("PRP", "PRP$", "WP", "WP$")),
+    ("num_prp", ("PRP",)),
+    ("num_articles", ("DT",)),
+    ("num_past", ("VBD", "VBN")),
+    ("num_future", ("MD",)),
+    ("num_prep", ("IN",)),
+)
+POS_CATEGORY_NAMES = tuple(name for name, _ in POS_CATEGORIES)
+
+# The categories table, precomputed once: TAG_COLUMNS maps every tag belonging to
+# a category to the columns (category indices) it counts towards, and
+# TAG_CATEGORY_MATRIX holds the same table as a 0/1 matrix, one row per tag of
+# TAG_ROWS plus a last row of zeros (OTHER_TAG_ROW) for every other tag.
+def _build_tag_table(categories):
+    tag_columns = {}
+    for column, (_, tags) in enumerate(categories):
+        for tag in tags:
+            tag_columns[tag] = tag_columns.get(tag, ()) + (column,)
+
+    tag_rows = {tag: row for row, tag in enumerate(tag_columns)}
+    matrix = np.zeros((len(tag_rows) + 1, len(categories)), dtype=np.int64)
+    for tag, columns in tag_columns.items():
+        matrix[tag_rows[tag], list(columns)] = 1
+    return tag_columns, tag_rows, matrix
+
+
+TAG_COLUMNS, TAG_ROWS, TAG_CATEGORY_MATRIX = _build_tag_table(POS_CATEGORIES)
+OTHER_TAG_ROW = len(TAG_ROWS)
+
+
+# Function: is_punctuation(token)
+# token: A string
+# Returns: True if count_words does not count token as a word
+#
+# count_punc tests "word in string.punctuation", a substring test on the string
+# of punctuation characters; this keeps the same definition.
+def is_punctuation(token):
+    return token in string.punctuation
+
+
+# Function: count_pos_categories(tagged_input)
+# tagged_input: A list of (token, POS) tuples
+# Returns: Six integers, the number of pronouns, personal pronouns, articles, past
+#          tense verbs, future tense verbs and prepositions, like get_pos_categories
+#
+# The tags are counted in one pass, then every distinct tag adds its count to
+# its categories through TAG_COLUMNS.
+def count_pos_categories(tagged_input):
+    counts = [0] * len(POS_CATEGORIES)
+    for tag, count in Counter(pos for _, pos in tagged_input).items():
+        for column in TAG_COLUMNS.get(tag, ()):
+            counts[column] += count
+    return tuple(counts)
+
+
+# Function: pos_category_matrix(tagged_documents)
+# tagged_documents: An iterable of lists of (token, POS) tuples, one per document
+# Returns: A (n_docs, 6) integer matrix; row i holds count_pos_categories(tagged_documents[i])
+#
+# Every tag is mapped to its row of TAG_CATEGORY_MATRIX, the (n_docs, n_tags)
+# tag counts are gathered into a sparse matrix, and a single product with
+# TAG_CATEGORY_MATRIX gives the category counts of all documents.
+def pos_category_matrix(tagged_documents):
+    tag_rows = array("i")
+    offsets = array("q", [0])
+    for tagged_input in tagged_documents:
+        tag_rows.extend([TAG_ROWS.get(pos, OTHER_TAG_ROW) for _, pos in tagged_input])
+        offsets.append(len(tag_rows))
+
+    tag_rows = np.frombuffer(tag_rows, dtype=np.int32)
+    tag_counts = sparse.csr_matrix((np.ones(len(tag_rows), dtype=np.int64), tag_rows, np.frombuffer(offsets, dtype=np.int64)),
+                                   shape=(len(offsets) - 1, len(TAG_CATEGORY_MATRIX)))
+    return np.asarray(tag_counts @ TAG_CATEGORY_MATRIX, dtype=np.int64)
+
+
+# Class: StylisticAnalysis(num_words, wps, num_pronouns, num_prp, num_articles, num_past, num_future, num_prep, num_negations)
+#
+# The nine features of summarize_analysis, in the order of its parameters.
+class StylisticAnalysis(NamedTuple):
+    num_words: int
+    wps: float
+    num_pronouns: int
+    num_prp: int
+    num_articles: int
+    num_past: int
+    num_future: int
+    num_prep: int
+    num_negations: int
+
+
+# Class: StylisticAnalyzer(tokenizer=TOKENIZER, tagger=POS_TAGGER)
+# tokenizer: OPTIONAL; The WordTokenizer used to split sentences and words
+# tagger: OPTIONAL; The PosTagger used to tag the tokens
+class StylisticAnalyzer:
+    def __init__(self, tokenizer=TOKENIZER, tagger=POS_TAGGER):
+        self.tokenizer = tokenizer
+        self.tagger = tagger
+
+    # Function: tokenize(text)
+    # text: A string of arbitrary length
+    # Returns: The list of sentences of text, each one as its list of tokens
+    def tokenize(self, text):
+        tokenize_sentence = self.tokenizer.tokenize_sentence
+        return [tokenize_sentence(sentence) for sentence in self.tokenizer.sentences(text)]
+
+    # Function: tag(tokens)
+    # tokens: A list of tokens
+    # Returns: A list of (token, POS) tuples, as returned by get_pos_tags
+    def tag(self, tokens):
+        return self.tagger.tag(tokens)
+
+    # Number of words, words per sentence and negations of the tokenized sentences and their tokens
+    def _count(self, sentences, tokens):
+        words_per_sentence = [sum(1 for token in sentence if not is_punctuation(token)) for sentence in sentences]
+        num_words = sum(words_per_sentence)
+        wps = num_words / len(sentences) if sentences else 0.0
+        num_negations = sum(1 for token in tokens if token in NEGATIONS)
+
+        return num_words, wps, num_negations
+
+    # Function: analyze(text)
+    # text: A string of arbitrary length
+    # Returns: A StylisticAnalysis equal to the values returned by count_words, words_per_sentence,
+    #          get_pos_categories(get_pos_tags(text)) and count_negations
+    #
+    # Tokenizing, tagging and counting are timed as the stylistic/tokenize,
+    # stylistic/pos_tag and stylistic/count stages (see instrumentation.py).
+    def analyze(self, text):
+        with stage("stylistic/tokenize"):
+            sentences = self.tokenize(text)
+            tokens = [token for sentence in sentences for token in sentence]
+        with stage("stylistic/pos_tag"):
+            tagged_input = self.tag(tokens)
+        with stage("stylistic/count"):
+            num_words, wps, num_negations = self._count(sentences, tokens)
+            categories = count_pos_categories(tagged_input)
+
+        return StylisticAnalysis(num_words, wps, *categories, num_negations)
+
+    # Function: analyze_many(texts)
+    # texts: A list of strings
+    # Returns: A dictionary from every StylisticAnalysis field to a numpy array holding its value for
+    #          every text (float64 for wps, int64 otherwise); row i is analyze(texts[i])
+    #
+    # The POS categories of all texts are counted at once with pos_category_matrix.
+    def analyze_many(self, texts):
+        num_words = np.zeros(len(texts), dtype=np.int64)
+        wps = np.zeros(len(texts), dtype=np.float64)
+        num_negations = np.zeros(len(texts), dtype=np.int64)
+        tagged_texts = []
+        for row, text in enumerate(texts):
+            sentences = self.tokenize(text)
+            tokens = [token for sentence in sentences for token in sentence]
+            num_words[row], wps[row], num_negations[row] = self._count(sentences, tokens)
+            tagged_texts.append(self.tag(tokens))
+
+        categories = pos_category_matrix(tagged_texts)
+        columns = {"num_words": num_words, "wps": wps}
+        columns.update((name, categories[:, column]) for column, name in enumerate(POS_CATEGORY_NAMES))
+        columns["num_negations"] = num_negations
+        return columns
+
+
+# Shared instance used by the stylistic analysis states
+STYLISTIC_ANALYZER = StylisticAnalyzer()
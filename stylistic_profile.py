@@ -0,0 +1,232 @@
+# Corpus-scale stylistic profiling
+#
+# The stylistic analysis of Parts 2 and 3 works on one interactive message at a
+# time.  The pipeline below computes the same nine features (count_words,
+# words_per_sentence, the POS categories and count_negations) for every document
+# of a corpus, e.g. a CSV file of logged messages read by data_stream.iter_batches:
+#   - every batch of documents is analyzed by StylisticAnalyzer.analyze_many on a
+#     process pool (parallel.parallel_imap), with a bounded number of batches in
+#     flight, so memory does not grow with the size of the file;
+#   - the result is a columnar table, a DataFrame with one column per feature,
+#     written to a .csv or .npz file (one array per column);
+#   - summarize_profile() applies summarize_analysis to every row of the table
+#     at once with numpy, and returns the three psychological correlates of each row.
+#
+#   python stylistic_profile.py dataset.csv dataset_profile.csv --jobs 4 --summaries
+# Run "python benchmarks.py profile" to check parity and measure documents per second.
+# =========================================================================================================
+
+import contextlib
+import os
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from data_stream import BATCH_SIZE, iter_batches
+from parallel import parallel_imap
+from pos_tagger import PosTagger
+from stylistic import StylisticAnalysis, StylisticAnalyzer
+
+
+# Columns of the profile table, in the order of the summarize_analysis parameters
+PROFILE_COLUMNS = StylisticAnalysis._fields
+
+# Psychological correlate of every column, as listed in summarize_analysis
+PSYCHOLOGICAL_CORRELATES = {
+    "num_words": "Talkativeness, verbal fluency",
+    "wps": "Verbal fluency, cognitive complexity",
+    "num_pronouns": "Informal, personal",
+    "num_prp": "Personal, social",
+    "num_articles": "Use of concrete nouns, interest in objects/things",
+    "num_past": "Focused on the past",
+    "num_future": "Future and goal-oriented",
+    "num_prep": "Education, concern with precision",
+    "num_negations": "Inhibition",
+}
+
+# Thresholds of summarize_analysis
+NUM_WORDS_THRESHOLD = 100
+WPS_THRESHOLD = 20
+
+# Number of correlates returned for every row
+N_CORRELATES = 3
+
+# Analyzer of the workers.  Corpus documents are seldom repeated, so the tagger
+# does not keep an LRU cache of them.
+PROFILE_ANALYZER = StylisticAnalyzer(tagger=PosTagger(cache_size=0))
+
+
+# Worker of profile_batches: the feature columns of one batch of documents
+def _profile_batch(documents):
+    return pd.DataFrame(PROFILE_ANALYZER.analyze_many(documents), columns=list(PROFILE_COLUMNS))
+
+
+# Function: profile_batches(batches, n_jobs=None)
+# batches: An iterable of lists of documents
+# n_jobs: OPTIONAL; Number of worker processes (serial by default, -1 for one per CPU)
+# Returns: A generator of DataFrames, the profile table of every batch, in order
+def profile_batches(batches, n_jobs=None):
+    # Loaded before the workers are forked, so they share the tagger weights
+    PROFILE_ANALYZER.tagger.load()
+    yield from parallel_imap(_profile_batch, batches, n_jobs)
+
+
+# Function: profile_corpus(documents, n_jobs=None, batch_size=BATCH_SIZE)
+# documents: A list of strings
+# n_jobs: OPTIONAL; Number of worker processes (serial by default, -1 for one per CPU)
+# batch_size: Number of documents per task
+# Returns: A DataFrame with one row per document and one column per PROFILE_COLUMNS entry;
+#          row i equals STYLISTIC_ANALYZER.analyze(documents[i])
+def profile_corpus(documents, n_jobs=None, batch_size=BATCH_SIZE):
+    batches = (documents[start:start + batch_size] for start in range(0, len(documents), batch_size))
+    return _concat(profile_batches(batches, n_jobs))
+
+
+# Function: profile_file(fname, n_jobs=None, batch_size=BATCH_SIZE)
+# fname: A CSV file in the load_as_list format
+# n_jobs: OPTIONAL; Number of worker processes (serial by default, -1 for one per CPU)
+# batch_size: Number of documents read and analyzed at once
+# Returns: The profile table of the reviews of fname, as returned by profile_corpus
+def profile_file(fname, n_jobs=None, batch_size=BATCH_SIZE):
+    batches = (documents for documents, _ in iter_batches(fname, batch_size))
+    return _concat(profile_batches(batches, n_jobs))
+
+
+def _concat(tables):
+    tables = list(tables)
+    if not tables:
+        return pd.DataFrame({name: np.zeros(0, dtype=np.float64 if name == "wps" else np.int64) for name in PROFILE_COLUMNS})
+    return pd.concat(tables, ignore_index=True)
+
+
+# Function: top_correlates(table)
+# table: A profile table, e.g. returned by profile_corpus
+# Returns: A (n_rows, 3) integer matrix of column indices in PROFILE_COLUMNS, the correlates
+#          chosen by summarize_analysis for every row, in the same order
+#
+# summarize_analysis first picks num_words and wps when they exceed their
+# thresholds, then the other features by decreasing value; sorted() is stable,
+# so ties keep the order of the parameters.  The same choice is made for all rows
+# at once: a stable argsort of the negated counts orders the features, and a
+# second stable argsort moves the candidates of every row in front of the
+# features that are not picked.
+def top_correlates(table):
+    counts = table[list(PROFILE_COLUMNS[2:])].to_numpy(dtype=np.int64)
+    order = np.argsort(-counts, axis=1, kind="stable") + 2
+
+    over_threshold = np.column_stack([table["num_words"].to_numpy() > NUM_WORDS_THRESHOLD,
+                                      table["wps"].to_numpy() > WPS_THRESHOLD])
+    thresholded = np.where(over_threshold, np.arange(2), -1)
+    candidates = np.hstack([thresholded, order])
+    first = np.argsort(candidates < 0, axis=1, kind="stable")[:, :N_CORRELATES]
+    return np.take_along_axis(candidates, first, axis=1)
+
+
+# Function: summarize_profile(table)
+# table: A profile table, e.g. returned by profile_corpus
+# Returns: A (n_rows, 3) array of strings; row i holds the list returned by summarize_analysis
+#          for the features of row i
+def summarize_profile(table):
+    correlates = np.array([PSYCHOLOGICAL_CORRELATES[name] for name in PROFILE_COLUMNS], dtype=object)
+    return correlates[top_correlates(table)]
+
+
+# Function: write_profile(table, fname)
+# table: A DataFrame, e.g. returned by profile_corpus
+# fname: The output file; ".npz" for a numpy archive with one array per column, otherwise CSV
+# Returns: fname
+def write_profile(table, fname):
+    if os.path.splitext(fname)[1] == ".npz":
+        # Text columns (the correlates) are stored as unicode arrays, which load without pickle
+        np.savez(fname, **{name: _column_array(table, name) for name in table.columns})
+    else:
+        table.to_csv(fname, index=False)
+    return fname
+
+
+# Function: write_profile_batches(tables, fname)
+# tables: An iterable of DataFrames with the same columns, e.g. returned by profile_batches
+# fname: The output file; ".npz" for a numpy archive with one array per column, otherwise CSV
+# Returns: The number of rows written
+#
+# Writes the same file as write_profile(pd.concat(tables), fname), holding one
+# table at a time: CSV rows are appended batch by batch.  For .npz files, every
+# column is appended to a raw file in a temporary directory next to fname, and
+# the columns are copied batch by batch into the archive once their lengths and
+# types are known (the widths of text columns can differ between batches).
+def write_profile_batches(tables, fname):
+    if os.path.splitext(fname)[1] != ".npz":
+        n_rows, n_tables = 0, 0
+        with open(fname, "w", newline="") as fout:
+            for table in tables:
+                table.to_csv(fout, header=n_tables == 0, index=False)
+                n_rows, n_tables = n_rows + len(table), n_tables + 1
+            if n_tables == 0:
+                _concat([]).to_csv(fout, index=False)
+        return n_rows
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(fname))) as directory:
+        columns, chunks = None, []
+        with contextlib.ExitStack() as stack:
+            for table in tables:
+                if columns is None:
+                    columns = list(table.columns)
+                    files = [stack.enter_context(open(os.path.join(directory, str(index)), "wb"))
+                             for index in range(len(columns))]
+                arrays = [_column_array(table, name) for name in columns]
+                for fout, array in zip(files, arrays):
+                    array.tofile(fout)
+                chunks.append([array.dtype for array in arrays] + [len(table)])
+        if columns is None:
+            write_profile(_concat([]), fname)
+            return 0
+
+        with zipfile.ZipFile(fname, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for index, name in enumerate(columns):
+                dtype = np.result_type(*[chunk[index] for chunk in chunks])
+                header = {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False,
+                          "shape": (sum(chunk[-1] for chunk in chunks),)}
+                with open(files[index].name, "rb") as fin, archive.open(name + ".npy", "w", force_zip64=True) as member:
+                    np.lib.format.write_array_header_1_0(member, header)
+                    for chunk in chunks:
+                        member.write(np.fromfile(fin, chunk[index], chunk[-1]).astype(dtype, copy=False).tobytes())
+        return sum(chunk[-1] for chunk in chunks)
+
+
+# A column of a profile table as a numpy array, text columns as unicode arrays as in write_profile
+def _column_array(table, name):
+    return table[name].to_numpy(dtype=None if pd.api.types.is_numeric_dtype(table[name]) else str)
+
+
+# Function: add_summaries(table)
+# table: A profile table, e.g. returned by profile_corpus
+# Returns: The table, with the columns correlate_1 to correlate_3 returned by summarize_profile
+def add_summaries(table):
+    summaries = summarize_profile(table)
+    for column in range(N_CORRELATES):
+        table["correlate_{0}".format(column + 1)] = summaries[:, column]
+    return table
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compute the stylistic profile of every review of a CSV file")
+    parser.add_argument("input", help="CSV file in the load_as_list format, e.g. dataset.csv")
+    parser.add_argument("output", help="profile table to write, .csv or .npz")
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes (-1 for one per CPU)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="documents per batch")
+    parser.add_argument("--summaries", action="store_true", help="add the three psychological correlates of every row")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    tables = profile_batches((documents for documents, _ in iter_batches(args.input, args.batch_size)), args.jobs)
+    if args.summaries:
+        tables = (add_summaries(table) for table in tables)
+    n_rows = write_profile_batches(tables, args.output)
+    elapsed = time.perf_counter() - start
+    print("{0} documents profiled in {1:.1f} s ({2:.0f} documents/sec), written to {3}".format(
+        n_rows, elapsed, n_rows / elapsed if elapsed else 0.0, args.output))
@@ -0,0 +1,99 @@
+# Parity tests of the single-pass stylistic analysis
+#
+# StylisticAnalyzer (stylistic.py) must return the nine features that the Part 2
+# functions count_words, words_per_sentence, get_pos_tags, get_pos_categories and
+# count_negations computed one after another, and the categories table
+# (count_pos_categories, pos_category_matrix) the counts of the nested scans of
+# the original get_pos_categories.  The references below tag with nltk.pos_tag
+# and scan the tags once per category, as those functions did.  Run them with:
+#   python -m pytest test_stylistic.py
+# =========================================================================================================
+
+import os
+
+import nltk
+import pytest
+
+from nltk_resources import require
+from project_p1 import load_as_list
+from project_p2 import count_negations, count_words, words_per_sentence
+from stylistic import POS_CATEGORY_NAMES, StylisticAnalyzer, count_pos_categories, pos_category_matrix
+
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_FILES = ["dataset.csv", "test.csv"]
+
+# Texts without words, sentences or tags of some categories
+EDGE_CASES = ["", "   ", "...", "!!! ??", "no", "I will not go.  Never!  We can't, can we?"]
+
+
+# Function: load_texts(fname)
+# fname: One of DATA_FILES
+# Returns: The reviews of fname
+def load_texts(fname):
+    return load_as_list(os.path.join(DATA_DIR, fname))[0]
+
+
+# Function: reference_pos_categories(tagged_input)
+# tagged_input: A list of (token, POS) tuples
+# Returns: The six POS category counts, scanning the tags once per category like the original get_pos_categories
+def reference_pos_categories(tagged_input):
+    def count(tags):
+        return sum(1 for _, pos in tagged_input if pos in tags)
+    return (count(['PRP', 'PRP$', 'WP', 'WP$']), count(['PRP']), count(['DT']), count(['VBD', 'VBN']),
+            count(['MD']), count(['IN']))
+
+
+# Function: reference_analysis(text)
+# text: A string of arbitrary length
+# Returns: The nine summarize_analysis features, computed by the Part 2 functions one after another
+def reference_analysis(text):
+    tagged_input = nltk.pos_tag(nltk.word_tokenize(text))
+    return (count_words(text), words_per_sentence(text), *reference_pos_categories(tagged_input),
+            count_negations(text))
+
+
+@pytest.fixture(scope="module", autouse=True)
+def nltk_data():
+    # word_tokenize and pos_tag read the same resources as the analyzer
+    require("punkt")
+    require("tagger")
+
+
+@pytest.fixture(scope="module")
+def tagged_documents():
+    return [nltk.pos_tag(nltk.word_tokenize(text)) for fname in DATA_FILES for text in load_texts(fname)]
+
+
+@pytest.mark.parametrize("fname", DATA_FILES)
+def test_analyze_matches_part2_functions(fname):
+    texts = load_texts(fname)
+    analyzer = StylisticAnalyzer()
+    cases = [(text, reference_analysis(text), tuple(analyzer.analyze(text))) for text in texts]
+    different = [case for case in cases if case[1] != case[2]]
+    assert not different, "{0} of {1} texts analyzed differently, e.g. {2!r}".format(
+        len(different), len(texts), different[0])
+
+
+@pytest.mark.parametrize("text", EDGE_CASES)
+def test_analyze_edge_cases(text):
+    assert tuple(StylisticAnalyzer().analyze(text)) == reference_analysis(text)
+
+
+def test_analyze_many_matches_analyze():
+    texts = load_texts("test.csv") + EDGE_CASES
+    analyzer = StylisticAnalyzer()
+    columns = analyzer.analyze_many(texts)
+    for row, text in enumerate(texts):
+        assert tuple(columns[name][row] for name in columns) == tuple(analyzer.analyze(text))
+
+
+def test_count_pos_categories_matches_nested_scans(tagged_documents):
+    for tagged_input in tagged_documents + [[]]:
+        assert tuple(count_pos_categories(tagged_input)) == reference_pos_categories(tagged_input)
+
+
+def test_pos_category_matrix_matches_nested_scans(tagged_documents):
+    matrix = pos_category_matrix(tagged_documents + [[]])
+    assert matrix.shape == (len(tagged_documents) + 1, len(POS_CATEGORY_NAMES))
+    assert matrix.tolist() == [list(reference_pos_categories(tagged)) for tagged in tagged_documents + [[]]]
@@ -0,0 +1,101 @@
+# Parity tests of the WordTokenizer engine
+#
+# WordTokenizer (tokenizer.py) replaces nltk.tokenize.word_tokenize in get_tokens
+# and must return exactly the same tokens.  These tests compare both on every
+# review of dataset.csv and test.csv, as written and lowercased (TfidfVectorizer
+# lowercases the documents before handing them to get_tokens), and on a few
+# texts aimed at the fast paths of tokenize_sentence.  Run them with:
+#   python -m pytest test_tokenizer.py
+# =========================================================================================================
+
+import os
+
+import nltk
+import pytest
+
+from nltk_resources import require
+from project_p1 import get_tokens, load_as_list
+from tokenizer import TOKENIZER, WordTokenizer
+
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_FILES = ["dataset.csv", "test.csv"]
+
+# Texts on the edges of the fast paths: no sentence end, blank text, contractions,
+# commas followed by digits, several sentences and non-ASCII punctuation
+EDGE_CASES = [
+    "",
+    "   ",
+    "no sentence end here",
+    "A plain sentence, with commas, and a period.",
+    "Trailing spaces before the end   !",
+    "I'm gonna say it cannot be, and I wanna leave",
+    "It cost 3,36 dollars,, or so",
+    "First sentence. Second one? Third!",
+    "Mr. Smith went to Washington. He arrived at 10 a.m.",
+    "\"Quoted\" text (with brackets) -- and dashes...",
+    "Ünïcode “quotes” and café’s accents.",
+]
+
+
+# Function: load_texts(fname, lowercase)
+# fname: One of DATA_FILES
+# lowercase: True to return the lowercased reviews
+# Returns: The reviews of fname
+def load_texts(fname, lowercase):
+    documents = load_as_list(os.path.join(DATA_DIR, fname))[0]
+    return [document.lower() for document in documents] if lowercase else documents
+
+
+# Function: mismatches(texts, tokenize)
+# texts: A list of strings
+# tokenize: A function from a string to its list of tokens
+# Returns: A list of (text, expected tokens, actual tokens) for every text tokenized unlike word_tokenize
+def mismatches(texts, tokenize):
+    different = []
+    for text in texts:
+        expected, actual = nltk.tokenize.word_tokenize(text), tokenize(text)
+        if actual != expected:
+            different.append((text, expected, actual))
+    return different
+
+
+@pytest.fixture(scope="module", autouse=True)
+def nltk_data():
+    # word_tokenize and sent_tokenize read the same Punkt data as WordTokenizer
+    require("punkt")
+
+
+@pytest.mark.parametrize("lowercase", [False, True], ids=["original", "lowercased"])
+@pytest.mark.parametrize("fname", DATA_FILES)
+def test_tokenize_matches_word_tokenize(fname, lowercase):
+    texts = load_texts(fname, lowercase)
+    different = mismatches(texts, WordTokenizer().tokenize)
+    assert not different, "{0} of {1} texts tokenized differently, e.g. {2!r}".format(
+        len(different), len(texts), different[0])
+
+
+@pytest.mark.parametrize("lowercase", [False, True], ids=["original", "lowercased"])
+@pytest.mark.parametrize("fname", DATA_FILES)
+def test_get_tokens_matches_word_tokenize(fname, lowercase):
+    texts = load_texts(fname, lowercase)
+    different = mismatches(texts, get_tokens)
+    assert not different, "{0} of {1} texts tokenized differently, e.g. {2!r}".format(
+        len(different), len(texts), different[0])
+
+
+@pytest.mark.parametrize("text", EDGE_CASES)
+def test_edge_cases_match_word_tokenize(text):
+    assert mismatches([text, text.lower()], TOKENIZER.tokenize) == []
+
+
+@pytest.mark.parametrize("fname", DATA_FILES)
+def test_tokenize_many_matches_tokenize(fname):
+    texts = load_texts(fname, False)
+    tokenizer = WordTokenizer()
+    assert tokenizer.tokenize_many(texts) == [tokenizer.tokenize(text) for text in texts]
+
+
+def test_sentences_match_sent_tokenize():
+    texts = load_texts("test.csv", False) + EDGE_CASES
+    assert [TOKENIZER.sentences(text) for text in texts] == [nltk.tokenize.sent_tokenize(text) for text in texts]
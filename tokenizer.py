@@ -0,0 +1,118 @@
+# Word tokenizer engine
+#
+# get_tokens used to call nltk.data.find('tokenizers/punkt') on every call, which
+# touches the filesystem, before calling nltk.tokenize.word_tokenize.  Since
+# get_tokens is the TfidfVectorizer tokenizer and is also used by string2vec, that
+# cost was paid for every document.
+#
+# WordTokenizer resolves the Punkt sentence tokenizer once and keeps NLTK's word
+# tokenizer instance around, so tokenize() produces exactly the tokens of
+# nltk.tokenize.word_tokenize without the per-call lookups.  Two precompiled
+# regular expressions add fast paths that skip work whose result is known:
+#   - text without any sentence-ending character (. ? !) is a single sentence
+#     for Punkt, so sentence splitting is skipped;
+#   - a sentence made only of letters, digits, spaces and commas (optionally
+#     ending with . ? or !) is split with a single findall instead of going
+#     through the ~30 regular expression substitutions of the Treebank rules.
+#
+# "python -m pytest test_tokenizer.py" checks parity with word_tokenize on
+# dataset.csv and test.csv; run "python benchmarks.py tokenizer" to measure the
+# speedup.
+# =========================================================================================================
+
+import re
+import threading
+
+import nltk
+from nltk.tokenize import NLTKWordTokenizer
+
+from nltk_resources import require
+
+
+# Punkt only considers these characters as possible sentence ends (PunktLanguageVars.sent_end_chars)
+SENTENCE_END_RE = re.compile(r"[.?!]")
+
+# Sentences that the Treebank rules would only split on whitespace and commas, plus one final . ? or !
+SIMPLE_SENTENCE_RE = re.compile(r"([A-Za-z0-9 ,]*[A-Za-z0-9])( *)([.?!]?)")
+SIMPLE_TOKEN_RE = re.compile(r"[A-Za-z0-9]+|,")
+
+# Commas directly followed by a digit (e.g. "3,36") or by another comma are not split the simple way
+COMMA_DIGIT_RE = re.compile(r",[0-9,]")
+
+# Words that the Treebank contraction rules split even without punctuation (e.g. "gonna" -> "gon na")
+CONTRACTION_RE = re.compile(r"(?i)(cannot|gimme|gonna|gotta|lemme|wanna)")
+
+
+# Function: load_punkt(language)
+# language: The model name in the Punkt corpus
+# Returns: The Punkt sentence tokenizer used by nltk.tokenize.sent_tokenize
+def load_punkt(language="english"):
+    try:
+        from nltk.tokenize.punkt import PunktTokenizer
+    except ImportError:
+        # NLTK < 3.8.2 ships Punkt as a pickled model
+        return nltk.data.load("tokenizers/punkt/{0}.pickle".format(language))
+    return PunktTokenizer(language)
+
+
+# Class: WordTokenizer(language="english")
+# language: The model name in the Punkt corpus
+#
+# Drop-in replacement for nltk.tokenize.word_tokenize.  The sentence tokenizer is
+# loaded on first use (the Punkt data is located by nltk_resources.require) and
+# then shared by every call, including calls from other threads.
+class WordTokenizer:
+    def __init__(self, language="english"):
+        self.language = language
+        self._sentence_tokenizer = None
+        self._word_tokenizer = NLTKWordTokenizer()
+        self._lock = threading.Lock()
+
+    @property
+    def sentence_tokenizer(self):
+        if self._sentence_tokenizer is None:
+            with self._lock:
+                if self._sentence_tokenizer is None:
+                    require("punkt")
+                    self._sentence_tokenizer = load_punkt(self.language)
+        return self._sentence_tokenizer
+
+    # Function: sentences(text)
+    # text: A string of arbitrary length
+    # Returns: The sentences of text, as nltk.tokenize.sent_tokenize would return them
+    def sentences(self, text):
+        if SENTENCE_END_RE.search(text) is None:
+            # Punkt returns the whole text without trailing whitespace, or nothing if it is blank
+            text = text.rstrip()
+            return [text] if text else []
+        return self.sentence_tokenizer.tokenize(text)
+
+    # Function: tokenize_sentence(sentence)
+    # sentence: A single sentence, as returned by sentences()
+    # Returns: The Treebank tokens of the sentence
+    def tokenize_sentence(self, sentence):
+        simple = SIMPLE_SENTENCE_RE.fullmatch(sentence.strip(" "))
+        if simple is not None and CONTRACTION_RE.search(sentence) is None and COMMA_DIGIT_RE.search(sentence) is None:
+            tokens = SIMPLE_TOKEN_RE.findall(simple.group(1))
+            if simple.group(3):
+                tokens.append(simple.group(3))
+            return tokens
+        return self._word_tokenizer.tokenize(sentence)
+
+    # Function: tokenize(text)
+    # text: A string of arbitrary length
+    # Returns: The same list of tokens as nltk.tokenize.word_tokenize(text)
+    def tokenize(self, text):
+        tokenize_sentence = self.tokenize_sentence
+        return [token for sentence in self.sentences(text) for token in tokenize_sentence(sentence)]
+
+    # Function: tokenize_many(texts)
+    # texts: An iterable of strings
+    # Returns: A list holding the token list of every text
+    def tokenize_many(self, texts):
+        tokenize = self.tokenize
+        return [tokenize(text) for text in texts]
+
+
+# Shared instance used by get_tokens
+TOKENIZER = WordTokenizer()
@@ -0,0 +1,161 @@
+# Parallel training and evaluation of model/feature combinations
+#
+# The main function of Part 1 trains four classifiers on two feature sets (TF-IDF
+# and Word2Vec) and evaluates each of them on the test set.  The eight jobs are
+# independent, so run_training_jobs() runs them on a process pool (see
+# parallel.py); each job fits its model and evaluates it with
+# evaluation.evaluate_model, which predicts the test documents and measures the
+# cost of featurizing and predicting them besides the four metrics.
+#
+# The training and test matrices are computed once per feature set by the parent
+# process (the test set with evaluation.featurize_test_set, which also times its
+# featurization) and written to a temporary directory as .npy files (a CSR matrix
+# as its data, indices and indptr arrays).  Workers memory-map those files, so all of them read the same
+# pages of the page cache instead of receiving a pickled copy of every matrix
+# with every job.  With a single process the matrices are used directly.
+#
+# With memory_profile, every job also profiles the memory of its fit and of its
+# evaluation (see memory_profile.py), in the process that runs it, and measures
+# the peak memory of its prediction of the test set (JobResult.peak_memory_mb).
+# =========================================================================================================
+
+import os
+import tempfile
+import time
+from typing import NamedTuple
+
+import numpy as np
+from scipy import sparse
+
+import parallel
+from evaluation import evaluate_model
+from memory_profile import MemoryProfiler
+from parallel import parallel_apply, resolve_n_jobs
+from sparse_models import fit_sparse
+
+
+# Class: TrainingJob(name, model, features)
+# name: The name of the job in the classification report, e.g. "SVM + TFIDF"
+# model: An instantiated machine learning model
+# features: The name of the feature set the model is trained on, e.g. "TFIDF"
+class TrainingJob(NamedTuple):
+    name: str
+    model: object
+    features: str
+
+
+# Class: JobResult(name, model, precision, recall, f1, accuracy, train_seconds, test_seconds, featurize_seconds,
+#                  predict_seconds, docs_per_sec, p50_ms, p99_ms, peak_memory_mb, memory=())
+# model: The trained model
+# train_seconds: Wall-clock time spent fitting the model
+# test_seconds: Wall-clock time spent featurizing and predicting the test set once (featurize_seconds + predict_seconds)
+# featurize_seconds, ..., peak_memory_mb: The costs measured by evaluate_model (see evaluation.Evaluation); the
+#                                         featurization is measured once per feature set and shared by its jobs
+# memory: The memory_profile.StageMemory of the fit and of the evaluation, if they were profiled
+class JobResult(NamedTuple):
+    name: str
+    model: object
+    precision: float
+    recall: float
+    f1: float
+    accuracy: float
+    train_seconds: float
+    test_seconds: float
+    featurize_seconds: float
+    predict_seconds: float
+    docs_per_sec: float
+    p50_ms: float
+    p99_ms: float
+    peak_memory_mb: float
+    memory: tuple = ()
+
+
+# Function: share_matrix(directory, name, matrix)
+# directory: Directory to write the matrix into
+# name: A file name prefix, unique within directory
+# matrix: A dense numpy matrix or a scipy sparse matrix
+# Returns: A dictionary describing the saved matrix, to be opened with open_shared_matrix
+def share_matrix(directory, name, matrix):
+    if sparse.issparse(matrix):
+        matrix = sparse.csr_matrix(matrix)
+        spec = {"format": "csr", "shape": matrix.shape}
+        for part in ("data", "indices", "indptr"):
+            spec[part] = os.path.join(directory, "{0}.{1}.npy".format(name, part))
+            np.save(spec[part], getattr(matrix, part))
+        return spec
+
+    spec = {"format": "dense", "data": os.path.join(directory, name + ".npy")}
+    np.save(spec["data"], np.asarray(matrix))
+    return spec
+
+
+# Function: open_shared_matrix(spec)
+# spec: A dictionary returned by share_matrix, or a matrix used as is
+# Returns: The matrix, backed by read-only memory-mapped arrays
+def open_shared_matrix(spec):
+    if not isinstance(spec, dict):
+        return spec
+    if spec["format"] == "dense":
+        return np.load(spec["data"], mmap_mode="r")
+
+    parts = [np.load(spec[part], mmap_mode="r") for part in ("data", "indices", "indptr")]
+    return sparse.csr_matrix(tuple(parts), shape=spec["shape"], copy=False)
+
+
+# Function: run_job(job)
+# job: A TrainingJob
+# Returns: The JobResult of the job
+#
+# Worker of run_training_jobs: the feature matrices, the TestFeatures and the
+# labels are read from parallel.shared().  Training and prediction go
+# through fit_sparse and predict_sparse, like train_model_tfidf and
+# test_model_tfidf, which handle dense Word2Vec matrices with plain fit and
+# predict calls.
+def run_job(job):
+    shared = parallel.shared()
+    train_spec, test_features = shared["features"][job.features]
+    test_features = test_features._replace(features=open_shared_matrix(test_features.features))
+    profiler = MemoryProfiler(enabled=shared["memory_profile"])
+
+    start = time.perf_counter()
+    with profiler.stage("fit " + job.name):
+        model = fit_sparse(job.model, open_shared_matrix(train_spec), shared["training_labels"])
+    train_seconds = time.perf_counter() - start
+
+    with profiler.stage("evaluate " + job.name):
+        evaluation = evaluate_model(model, test_features, shared["test_labels"], memory=shared["memory_profile"])
+    profiler.close()
+
+    # Only the pass that computes the metrics: evaluate_model also runs the latency and memory measurements
+    test_seconds = evaluation.featurize_seconds + evaluation.predict_seconds
+    return JobResult(job.name, model, *evaluation[:4], train_seconds, test_seconds, *evaluation[4:],
+                     memory=tuple(profiler.records))
+
+
+# Function: run_training_jobs(jobs, features, training_labels, test_labels, n_jobs=None, memory_profile=False)
+# jobs: A list of TrainingJob
+# features: A dictionary from feature set name to its (training matrix, TestFeatures), the TestFeatures of the
+#           test documents returned by evaluation.featurize_test_set
+# training_labels, test_labels: Lists of integers (all 0 or 1)
+# n_jobs: OPTIONAL; Number of worker processes (serial by default, -1 for one per CPU)
+# memory_profile: OPTIONAL; True to profile the memory of every fit and evaluation (JobResult.memory), and to
+#                 measure JobResult.peak_memory_mb
+# Returns: The list of JobResult, in the order of jobs, and the total wall-clock time in seconds
+def run_training_jobs(jobs, features, training_labels, test_labels, n_jobs=None, memory_profile=False):
+    start = time.perf_counter()
+    shared = {"training_labels": np.asarray(training_labels), "test_labels": np.asarray(test_labels),
+              "memory_profile": memory_profile}
+
+    if min(resolve_n_jobs(n_jobs), len(jobs)) == 1:
+        shared["features"] = features
+        results = parallel_apply(run_job, jobs, 1, shared)
+    else:
+        with tempfile.TemporaryDirectory(prefix="training_jobs-") as directory:
+            shared["features"] = {
+                name: (share_matrix(directory, name + "-train", train),
+                       test._replace(features=share_matrix(directory, name + "-test", test.features)))
+                for name, (train, test) in features.items()
+            }
+            results = parallel_apply(run_job, jobs, n_jobs, shared)
+
+    return results, time.perf_counter() - start
@@ -0,0 +1,245 @@
+# Per-word sentiment scores of linear Word2Vec models
+#
+# The Word2Vec models of Part 3 classify the average of the token embeddings.
+# For a linear model (LinearSVC, LogisticRegression) the decision value is
+#   mean(w2v(token) for token in tokens) . coef_ + intercept_
+#     = mean(w2v(token) . coef_ for token in tokens) + intercept_
+# so the dot product of every vocabulary word with coef_ can be computed once.
+# A WordScoreModel keeps that single score per word and classifies a message by
+# averaging the scores of its tokens: one dictionary lookup per token instead of
+# gathering and averaging 300-dimensional vectors.  Unknown tokens score 0 and
+# still count towards the average, like the zero vector returned by w2v().
+#
+# The scores are exported to a directory, like the embedding store:
+#   scores.npy: a float64 vector, one score per word
+#   vocab.txt:  the words, one per line, in the same order
+#   meta.json:  the format version, the model class, classes and intercept, and
+#               a fingerprint of the model weights and of the embeddings
+#
+# Averaging scores rounds differently from averaging vectors, so a decision
+# value within TIE_MARGIN of zero is recomputed from the embeddings when the
+# model and the embeddings are given; the labels then equal model.predict.
+#
+# Export the scores of the chatbot's model bundle from a terminal with:
+#   python word_scores.py svm_w2v_bundle svm_w2v_scores
+# =========================================================================================================
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from embedding_store import EmbeddingStore, embed_token_lists, embeddings_version
+from model_bundle import StaleBundleError
+
+
+SCORES_FORMAT = 1
+SCORES_FILE = "scores.npy"
+VOCAB_FILE = "vocab.txt"
+META_FILE = "meta.json"
+
+# Decision values closer to zero than this are recomputed from the embeddings
+TIE_MARGIN = 1e-9
+
+# Embedding rows multiplied with the weights at once while exporting
+CHUNK_ROWS = 1 << 16
+
+
+# Function: linear_weights(model)
+# model: A trained classification model
+# Returns: The weights, as a float64 vector, and the intercept of a binary linear model;
+#          raises ValueError for any other model (e.g. GaussianNB or MLPClassifier)
+def linear_weights(model):
+    coef = getattr(model, "coef_", None)
+    if coef is None or np.ndim(coef) != 2 or coef.shape[0] != 1 or len(model.classes_) != 2:
+        raise ValueError("Per-word scores need a binary linear model such as LinearSVC or LogisticRegression, "
+                         "got {0}".format(type(model).__name__))
+    return np.asarray(coef[0], dtype=np.float64), float(np.ravel(model.intercept_)[0])
+
+
+# Function: fingerprint(model, word2vec)
+# model: A binary linear model
+# word2vec: The pretrained Word2Vec model, as a dictionary or an EmbeddingStore
+# Returns: A string identifying the weights of model and the embeddings, stored in meta.json
+#
+# The embeddings are identified by embeddings_version: a dictionary and the
+# EmbeddingStore converted from it give the same fingerprint.
+def fingerprint(model, word2vec):
+    coef, intercept = linear_weights(model)
+    digest = hashlib.sha256(coef.tobytes())
+    digest.update(np.float64(intercept).tobytes())
+    digest.update(repr(model.classes_.tolist()).encode("utf-8"))
+    digest.update(embeddings_version(word2vec).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Function: compute_word_scores(model, word2vec)
+# model: A binary linear model trained on averaged Word2Vec embeddings
+# word2vec: The pretrained Word2Vec model, as a dictionary or an EmbeddingStore
+# Returns: The list of words, and a float64 vector holding the score of every word
+def compute_word_scores(model, word2vec):
+    coef, _ = linear_weights(model)
+    words = list(word2vec.words if isinstance(word2vec, EmbeddingStore) else word2vec)
+    scores = np.empty(len(words), dtype=np.float64)
+    for start in range(0, len(words), CHUNK_ROWS):
+        if isinstance(word2vec, EmbeddingStore):
+            chunk = word2vec.vectors[start:start + CHUNK_ROWS]
+        else:
+            chunk = np.array([word2vec[word] for word in words[start:start + CHUNK_ROWS]])
+        scores[start:start + len(chunk)] = np.asarray(chunk, dtype=np.float64) @ coef
+    return words, scores
+
+
+# Class: WordScoreModel(words, scores, intercept, classes, model=None, word2vec=None)
+# words: The vocabulary, a list of strings
+# scores: The score of every word, in the same order
+# intercept: The intercept of the linear model
+# classes: The two labels of the model, negative class first
+# model, word2vec: OPTIONAL; The linear model and its embeddings, used to settle decision values within TIE_MARGIN of zero
+#
+# Classifies token lists like model.predict(embed_token_lists(word2vec, token_lists)).
+class WordScoreModel:
+    def __init__(self, words, scores, intercept, classes, model=None, word2vec=None):
+        self.scores = dict(zip(words, np.asarray(scores, dtype=np.float64).tolist()))
+        self.intercept = float(intercept)
+        self.classes = np.asarray(classes)
+        self.model = model
+        self.word2vec = word2vec
+        self.meta = {}
+
+    # Function: decision_function(token_lists)
+    # token_lists: A list of token lists, one per message
+    # Returns: A float64 vector holding the decision value of the linear model for every message
+    def decision_function(self, token_lists):
+        scores = self.scores
+        decisions = np.full(len(token_lists), self.intercept)
+        for i, tokens in enumerate(token_lists):
+            if tokens:
+                decisions[i] += sum([scores.get(token, 0.0) for token in tokens]) / len(tokens)
+        return decisions
+
+    # Function: predict_token_lists(token_lists)
+    # token_lists: A list of token lists, one per message
+    # Returns: A numpy array holding the label of every message
+    def predict_token_lists(self, token_lists):
+        decisions = self.decision_function(token_lists)
+        labels = self.classes[(decisions > 0).astype(np.int64)]
+        if self.model is not None and self.word2vec is not None:
+            ties = np.flatnonzero(np.abs(decisions) <= TIE_MARGIN)
+            if len(ties):
+                embeddings = embed_token_lists(self.word2vec, [token_lists[i] for i in ties], dtype=np.float64)
+                labels[ties] = self.model.predict(embeddings)
+        return labels
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __repr__(self):
+        return "WordScoreModel(size={0}, classes={1})".format(len(self), self.classes.tolist())
+
+
+# Function: build_word_scores(model, word2vec)
+# model: A binary linear model trained on averaged Word2Vec embeddings
+# word2vec: The pretrained Word2Vec model, as a dictionary or an EmbeddingStore
+# Returns: A WordScoreModel predicting like model, settling ties with word2vec
+def build_word_scores(model, word2vec):
+    _, intercept = linear_weights(model)
+    words, scores = compute_word_scores(model, word2vec)
+    return WordScoreModel(words, scores, intercept, model.classes_, model, word2vec)
+
+
+# Function: save_word_scores(scores_dir, model, word2vec)
+# scores_dir: Directory to write the scores into (created if needed)
+# model: A binary linear model trained on averaged Word2Vec embeddings
+# word2vec: The pretrained Word2Vec model, as a dictionary or an EmbeddingStore
+# Returns: The saved WordScoreModel, opened with load_word_scores
+#
+# meta.json is written last: an interrupted export has no metadata and is treated as missing.
+def save_word_scores(scores_dir, model, word2vec):
+    _, intercept = linear_weights(model)
+    words, scores = compute_word_scores(model, word2vec)
+
+    os.makedirs(scores_dir, exist_ok=True)
+    meta_path = os.path.join(scores_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    np.save(os.path.join(scores_dir, SCORES_FILE), scores)
+    with open(os.path.join(scores_dir, VOCAB_FILE), "w", encoding="utf-8", newline="\n") as fout:
+        for word in words:
+            if "\n" in word:
+                raise ValueError("Cannot store a word containing a newline: {0!r}".format(word))
+            fout.write(word + "\n")
+
+    meta = {
+        "format": SCORES_FORMAT,
+        "model": type(model).__name__,
+        "classes": model.classes_.tolist(),
+        "intercept": intercept,
+        "size": len(words),
+        "fingerprint": fingerprint(model, word2vec),
+    }
+    with open(meta_path + ".tmp", "w", encoding="utf-8") as fout:
+        json.dump(meta, fout, indent=2)
+    os.replace(meta_path + ".tmp", meta_path)
+
+    return load_word_scores(scores_dir, model, word2vec)
+
+
+# Function: load_word_scores(scores_dir, model=None, word2vec=None)
+# scores_dir: Directory written by save_word_scores
+# model, word2vec: OPTIONAL; The linear model and embeddings the scores were exported from, used to settle ties
+# Returns: A WordScoreModel
+#
+# Raises FileNotFoundError if there are no complete scores in scores_dir, and
+# StaleBundleError if they were exported from another model or other embeddings.
+# Without model and word2vec, only the small score table is loaded.
+def load_word_scores(scores_dir, model=None, word2vec=None):
+    with open(os.path.join(scores_dir, META_FILE), "r", encoding="utf-8") as fin:
+        meta = json.load(fin)
+
+    if meta.get("format") != SCORES_FORMAT:
+        raise StaleBundleError("Unsupported word score format in {0}: {1}".format(scores_dir, meta.get("format")))
+    if model is not None and word2vec is not None and meta["fingerprint"] != fingerprint(model, word2vec):
+        raise StaleBundleError("The word scores in {0} were exported from another model or other embeddings".format(scores_dir))
+
+    scores = np.load(os.path.join(scores_dir, SCORES_FILE))
+    with open(os.path.join(scores_dir, VOCAB_FILE), "r", encoding="utf-8", newline="\n") as fin:
+        words = fin.read().split("\n")[:-1]
+    if len(words) != len(scores):
+        raise StaleBundleError("The vocabulary and the scores in {0} have different sizes".format(scores_dir))
+
+    word_scores = WordScoreModel(words, scores, meta["intercept"], meta["classes"], model, word2vec)
+    word_scores.meta = meta
+    return word_scores
+
+
+# Function: open_word_scores(scores_dir, model, word2vec)
+# scores_dir: Directory of the exported scores
+# model: A binary linear model trained on averaged Word2Vec embeddings
+# word2vec: The pretrained Word2Vec model, as a dictionary or an EmbeddingStore
+# Returns: The WordScoreModel of model, exported into scores_dir first if it is missing or stale
+def open_word_scores(scores_dir, model, word2vec):
+    try:
+        return load_word_scores(scores_dir, model, word2vec)
+    except (FileNotFoundError, StaleBundleError) as error:
+        print("Exporting the word scores of the model into {0} ({1})....".format(scores_dir, error))
+        return save_word_scores(scores_dir, model, word2vec)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from model_bundle import load_bundle
+
+    parser = argparse.ArgumentParser(description="Export the per-word scores of a linear Word2Vec model bundle")
+    parser.add_argument("bundle_dir", help="model bundle directory, e.g. svm_w2v_bundle")
+    parser.add_argument("scores_dir", help="directory to write the scores into, e.g. svm_w2v_scores")
+    args = parser.parse_args()
+
+    bundle = load_bundle(args.bundle_dir)
+    if bundle.word2vec is None:
+        parser.error("{0} is not a Word2Vec model bundle".format(args.bundle_dir))
+    word_scores = save_word_scores(args.scores_dir, bundle.model, bundle.word2vec)
+    print("Wrote {0} to {1}".format(word_scores, args.scores_dir))